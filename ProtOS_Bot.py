@@ -218,7 +218,7 @@ class ProtosBot(Client):
 
                 if msg.guild:
                     #Check if this channel is blocked for AI
-                    if len(self.db.get_db_by_message(msg).query(BlockedChannel).filter(channel_id=msg.channel.id)) > 0: #YOU'RE BANNED
+                    if self.db.get_db_by_message(msg).query(BlockedChannel).filter(channel_id=msg.channel.id): #YOU'RE BANNED
                         await msg.channel.send(msg.author.mention + ", " + interaction.confused.getRandom())
                         return
 
@@ -228,6 +228,7 @@ class ProtosBot(Client):
                         return
 
 
+                await self.cs.flushObserve() #the reply should see all messages observed before it
                 response = await self.cs.respond(msg)
 
                 if self.config.getElementText("bot.chat.aistate") == "passive": #AI in passive mode
@@ -245,10 +246,10 @@ class ProtosBot(Client):
 
                 if msg.guild:
                     #Check if this channel is blocked for AI
-                    if len(self.db.get_db_by_message(msg).query(BlockedChannel).filter(channel_id=msg.channel.id)) > 0: #YOU'RE BANNED
+                    if self.db.get_db_by_message(msg).query(BlockedChannel).filter(channel_id=msg.channel.id): #YOU'RE BANNED
                         return
 
-                await self.cs.observe(msg)
+                await self.cs.queueObserve(msg)
 
                 c = msg.content.lower()
                 if " ram " in c or c.startswith("ram ") or c.endswith(" ram") or c == "ram": #Make the bot sometimes respond to its name when it comes up
@@ -314,6 +315,7 @@ class ProtosBot(Client):
 
         self.logger.debug("Saving data...")
         self.config.save()
+        await self.cs.flushObserve()
         await self.cs.setOpt("SAVE", None)
         self.logger.debug("Backup complete!")
 
@@ -332,6 +334,7 @@ class ProtosBot(Client):
         await cmdsys.cleanUp()
 
         await self.save()
+        await self.cs.close()
         await self.logout()
         await self.close()
 
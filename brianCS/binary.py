@@ -0,0 +1,244 @@
+#BrianCS Conversation Simulator
+#
+#Author: fredi_68
+#
+#Binary model format.
+
+#A binary model file is a flat container of typed sections.
+#The file starts with a fixed size header and a section table,
+#followed by the section data. Each section is an array of
+#fixed width items (int64 node indices, float64 edge weights,
+#raw bytes for strings, ...), aligned to 8 bytes. This allows
+#the file to be memory mapped and its sections to be used in
+#place, without having to parse individual records.
+#
+#Layout (all values little endian):
+#
+#   header:     magic (8 bytes), version (uint32), section count (uint32)
+#   table:      name (32 bytes, NUL padded), typecode (1 byte), padding (7 bytes),
+#               offset (uint64), item count (uint64) for each section
+#   data:       section contents
+
+import struct
+import mmap
+import sys
+from array import array
+
+MAGIC = b"BRCSBIN\0"
+VERSION = 1
+
+HEADER = struct.Struct("<8sII")
+SECTION = struct.Struct("<32sc7xQQ")
+
+ALIGNMENT = 8
+
+#item sizes of the supported array typecodes, as stored in the file
+ITEM_SIZES = {
+    "B": 1,
+    "h": 2,
+    "i": 4,
+    "q": 8,
+    "d": 8
+    }
+
+class FormatError(ValueError):
+
+    """
+    Raised if a file is not a valid binary model file.
+    """
+
+    pass
+
+def isBinaryFile(path):
+
+    """
+    Check if the file at path is a binary model file.
+    """
+
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def copyArray(data):
+
+    """
+    Return a copy of an array.array instance or of a view returned by BinaryReader.view() as a new array.array instance.
+    """
+
+    if isinstance(data, array):
+        return data[:]
+    copy = array(data.format)
+    copy.frombytes(data.cast("B"))
+    return copy
+
+class BinaryWriter():
+
+    """
+    Writes sections to a binary model file.
+    """
+
+    def __init__(self):
+
+        self.sections = []
+
+    def add(self, name, data):
+
+        """
+        Add a section.
+        data should be an array.array instance using one of the supported typecodes.
+        """
+
+        if not data.typecode in ITEM_SIZES or data.itemsize != ITEM_SIZES[data.typecode]:
+            raise FormatError("Unsupported array type '%s'." % data.typecode)
+        if sys.byteorder != "little":
+            data = array(data.typecode, data)
+            data.byteswap()
+        self.sections.append((name, data.typecode, data.tobytes(), len(data)))
+
+    def addBytes(self, name, data):
+
+        """
+        Add a section containing raw bytes.
+        """
+
+        self.sections.append((name, "B", bytes(data), len(data)))
+
+    def write(self, f):
+
+        """
+        Write the file to the binary file like object f.
+        """
+
+        offset = HEADER.size + SECTION.size * len(self.sections)
+        table = []
+        for name, typecode, data, count in self.sections:
+            offset += -offset % ALIGNMENT
+            table.append(SECTION.pack(name.encode(), typecode.encode(), offset, count))
+            offset += len(data)
+
+        f.write(HEADER.pack(MAGIC, VERSION, len(self.sections)))
+        for entry in table:
+            f.write(entry)
+        position = HEADER.size + SECTION.size * len(self.sections)
+        for name, typecode, data, count in self.sections:
+            f.write(b"\0" * (-position % ALIGNMENT))
+            position += -position % ALIGNMENT
+            f.write(data)
+            position += len(data)
+
+class BinaryReader():
+
+    """
+    Reads sections from a memory mapped binary model file.
+    Sections are returned as typed views of the mapping (see view()) or copied into arrays (see array()).
+
+    This class can be used as a context manager.
+    """
+
+    def __init__(self, path):
+
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise FormatError("File '%s' is empty." % str(path))
+
+        magic, self.version, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise FormatError("File '%s' is not a binary model file." % str(path))
+        if self.version > VERSION:
+            self.close()
+            raise FormatError("Unsupported binary model version %i (maximum supported version is %i)." % (self.version, VERSION))
+
+        self.sections = {}
+        for i in range(count):
+            name, typecode, offset, length = SECTION.unpack_from(self._map, HEADER.size + SECTION.size * i)
+            self.sections[name.rstrip(b"\0").decode()] = (typecode.decode(), offset, length)
+
+    def __contains__(self, name):
+
+        return name in self.sections
+
+    def view(self, name):
+
+        """
+        Return a read only memoryview of a section, cast to the typecode of the section.
+        Views behave like read only arrays and do not copy the data. Each view keeps the mapping alive,
+        even after this reader is closed, so the mapping is only released once all views of it are gone.
+        On big endian platforms the data has to be converted, so a copy is returned instead (see array()).
+        """
+
+        typecode, offset, length = self.sections[name]
+        if sys.byteorder != "little":
+            return self.array(name)
+        if array(typecode).itemsize != ITEM_SIZES[typecode]:
+            raise FormatError("Array type '%s' has an incompatible item size on this platform." % typecode)
+        return memoryview(self._map)[offset:offset + length * ITEM_SIZES[typecode]].cast(typecode)
+
+    def views(self, prefix):
+
+        """
+        Return views of all sections whose name starts with prefix.
+        Returns a dictionary mapping section names, without the prefix, to views.
+        """
+
+        return {name[len(prefix):]: self.view(name) for name in self.sections if name.startswith(prefix)}
+
+    def array(self, name):
+
+        """
+        Copy a section into a new array.array instance.
+        """
+
+        typecode, offset, length = self.sections[name]
+        data = array(typecode)
+        if data.itemsize != ITEM_SIZES[typecode]:
+            raise FormatError("Array type '%s' has an incompatible item size on this platform." % typecode)
+        view = memoryview(self._map)[offset:offset + length * data.itemsize]
+        try:
+            data.frombytes(view)
+        finally:
+            view.release()
+        if sys.byteorder != "little":
+            data.byteswap()
+        return data
+
+    def arrays(self, prefix):
+
+        """
+        Copy all sections whose name starts with prefix.
+        Returns a dictionary mapping section names, without the prefix, to arrays.
+        """
+
+        return {name[len(prefix):]: self.array(name) for name in self.sections if name.startswith(prefix)}
+
+    def bytes(self, name):
+
+        """
+        Return the contents of a section as bytes.
+        """
+
+        typecode, offset, length = self.sections[name]
+        return self._map[offset:offset + length * ITEM_SIZES[typecode]]
+
+    def close(self):
+
+        """
+        Close the file. If views of the mapping are still in use, the mapping is released once they are gone.
+        """
+
+        try:
+            self._map.close()
+        except BufferError:
+            pass #views still reference the mapping
+        self._file.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+
+        self.close()
+        return False
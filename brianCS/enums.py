@@ -50,4 +50,22 @@ class Tags(Enum):
     VERB = 1
     ADJECTIVE = 2
     ADVERB = 3
-    PRONOUN = 4
\ No newline at end of file
+    PRONOUN = 4
+
+class Storage(Enum):
+
+    """
+    Specifies the data structure used to store the graphs of a model.
+    """
+
+    OBJECT = 0
+    COMPACT = 1
+
+class ModelFormat(Enum):
+
+    """
+    Specifies the file format used to store a model.
+    """
+
+    ZIP = 0
+    BINARY = 1
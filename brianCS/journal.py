@@ -0,0 +1,135 @@
+#BrianCS Conversation Simulator
+#
+#Author: fredi_68
+#
+#Append only model journal.
+
+#The journal records every change made to a BrianModel since its last
+#snapshot as a sequence of JSON records, one per line. Each record
+#carries a sequence number. Snapshots store the sequence number of the
+#last record they include, so replaying a journal on top of a snapshot
+#skips records that are already part of it, even if the journal could
+#not be truncated after the snapshot was written.
+
+import json
+import os
+import logging
+
+class Journal():
+
+    """
+    Append only journal file.
+
+    Records are written to the operating system immediately, but are only
+    guaranteed to be on disk after sync() has been called.
+    """
+
+    logger = logging.getLogger("BrianCS Journal")
+
+    def __init__(self, path, seq=0):
+
+        """
+        Open the journal at path, creating it if it does not exist.
+        seq is the sequence number to continue counting from if the journal is empty.
+        """
+
+        self.path = path
+        self.seq = seq
+
+        #find the last sequence number and cut off incomplete records left behind by a crash,
+        #otherwise the next record would be appended to the broken line.
+        valid = 0
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self.seq = max(self.seq, json.loads(line)["n"])
+                    valid += len(line)
+        except FileNotFoundError:
+            pass
+
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > valid:
+            self.logger.warning("Removing incomplete record from journal '%s'." % path)
+            self._file.truncate(valid)
+            self._file.seek(valid)
+
+    @classmethod
+    def read(cls, path):
+
+        """
+        Iterate over all records in the journal at path.
+        Incomplete records at the end of the file are ignored.
+        """
+
+        try:
+            f = open(path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if not line.endswith("\n"):
+                    cls.logger.warning("Ignoring incomplete record in journal '%s'." % path)
+                    break
+                yield json.loads(line)
+
+    def append(self, record):
+
+        """
+        Append a record to the journal.
+        record should be a JSON serializable dictionary. Its sequence number is stored as "n".
+        Returns the sequence number of the record.
+        """
+
+        self.seq += 1
+        record["n"] = self.seq
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        return self.seq
+
+    def sync(self):
+
+        """
+        Make sure all records are written to disk.
+        """
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def size(self):
+
+        """
+        Return the size of the journal in bytes.
+        """
+
+        return self._file.tell()
+
+    def truncate(self, size=None):
+
+        """
+        Remove records from the start of the journal.
+        size is the size of the journal (as returned by size()) at the time the records to remove were
+        written. If size is None, all records are removed. The sequence number keeps counting from where it was.
+        """
+
+        self._file.flush()
+        rest = b""
+        if size is not None:
+            with open(self.path, "rb") as f:
+                f.seek(size)
+                rest = f.read()
+
+        #replace the journal atomically, so a crash can't lose the remaining records
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(rest)
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+
+        self._file.close()
@@ -22,13 +22,29 @@ import random
 import multiprocessing
 import os
 import time
+import threading
 import re
 import zipfile
 import json
 import io
 import math
+import itertools
+import operator
+import bisect
+import heapq
+import collections
+import collections.abc
+from array import array
 
 from .enums import *
+from . import binary
+from .journal import Journal
+
+HAS_NUMPY = True
+try: #NumPy is optional, it is only used to speed up dropout and candidate scoring
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
 
 PROCESS_COUNT = os.cpu_count()
 if PROCESS_COUNT == None:
@@ -36,6 +52,152 @@ if PROCESS_COUNT == None:
 
 ENABLE_MULTIPROCESSING = PROCESS_COUNT > 3 #we only use multiprocessing if we have 4 or more cores
 
+SELECT_ARRAY_THRESHOLD = 64 #minimum amount of dropout candidates selected using NumPy, fewer are faster in pure Python
+
+def applyCurve(weight, curve, steps=1):
+
+    """
+    Apply a dropout curve to a single edge weight steps times and return the new weight.
+    """
+
+    if steps <= 0:
+        return weight
+    if curve == DropoutCurve.DECREMENT:
+        return weight - steps
+    elif curve == DropoutCurve.HALF:
+        return weight / 2 ** steps
+    elif steps > 1:
+        for i in range(steps):
+            new = applyCurve(weight, curve)
+            if new == weight or math.isnan(new):
+                break #the curve reached a fixed point
+            weight = new
+        return weight
+    #the comparisons below are False for NaN weights (deleted edges in compact graphs), which keeps them NaN
+    elif curve == DropoutCurve.LOG2:
+        if weight <= 1:
+            return 0.0
+        return math.log2(weight)
+    elif curve == DropoutCurve.LOG10:
+        if weight <= 1:
+            return 0.0
+        return math.log10(weight)
+    elif curve == DropoutCurve.SQUARE_ROOT:
+        if weight <= 0:
+            return 0.0
+        return float(weight ** 0.5)
+    return weight
+
+def applyCurveArray(weights, curve, steps=1):
+
+    """
+    Apply a dropout curve to a NumPy array of edge weights in place.
+    steps is either the amount of times the curve is applied to all weights, or an array
+    specifying the amount for each weight. NaN weights stay NaN.
+    The results are the same as applying applyCurve() to each weight.
+    """
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if curve == DropoutCurve.DECREMENT:
+            weights -= steps
+            return
+        elif curve == DropoutCurve.HALF:
+            weights /= np.exp2(steps)
+            return
+        elif curve == DropoutCurve.LOG2:
+            f = np.log2
+        elif curve == DropoutCurve.LOG10:
+            f = np.log10
+        elif curve == DropoutCurve.SQUARE_ROOT:
+            f = np.sqrt
+        else:
+            return
+
+        perWeight = np.ndim(steps) > 0
+        for i in range(int(np.max(steps, initial=0))):
+            active = steps > i if perWeight else slice(None)
+            w = weights[active]
+            #like in applyCurve(), the comparison is False for NaN weights, which keeps them NaN
+            new = np.where(w <= (0 if curve == DropoutCurve.SQUARE_ROOT else 1), 0.0, f(w))
+            if np.array_equal(new, w, equal_nan=True):
+                break #the curve reached a fixed point
+            weights[active] = new
+
+def selectDropout(candidates, policy, factor):
+
+    """
+    Choose the edges to drop from a list of candidates according to a dropout policy.
+    candidates should be a list of tuples, with the edge weight as the first element.
+    Returns a list containing the selected candidates.
+
+    The following algorithms are currently available:
+
+    Random - Drop random edges below weight threshold. Factor specifies how likely an edge is to be dropped.
+    Random weighted - Drop random edges below weight threshold after inverting their weights to seed the randomizer.
+        The final weights are multiplied by factor.
+    Least used - Drop edges with the lowest weight. factor specifies the amount of edges to drop.
+    All - All edges below threshold are dropped. factor is ignored.
+    None - No edges will be dropped.
+    """
+
+    if policy == Dropout.ALL:
+        return list(candidates)
+
+    elif HAS_NUMPY and len(candidates) >= SELECT_ARRAY_THRESHOLD and policy in (Dropout.LEAST_USED, Dropout.RANDOM, Dropout.RANDOM_WEIGHTED):
+        weights = np.fromiter((c[0] for c in candidates), np.float64, len(candidates))
+        return [candidates[i] for i in _selectArray(weights, policy, factor).tolist()]
+
+    elif policy == Dropout.LEAST_USED:
+        edges = list(candidates)
+        amount = int(len(edges)*factor)
+        return heapq.nsmallest(amount, edges, key=lambda x: x[0])
+
+    elif policy == Dropout.RANDOM:
+        return [c for c in candidates if random.random() < factor]
+
+    elif policy == Dropout.RANDOM_WEIGHTED:
+        edges = list(candidates)
+        amount = int(len(edges)*factor)
+        if not amount:
+            return []
+        weights = [-x[0]*factor for x in edges]
+        m = min(weights)
+        pad = 1 - m if m < 1 else 0
+        #Weighted sampling without replacement (Efraimidis and Spirakis): every edge gets a random key
+        #u ** (1 / weight), the edges with the largest keys are selected. This picks all edges at once,
+        #with the same probabilities as picking one edge at a time and removing it from the candidates.
+        #Logarithms of the keys are compared to avoid underflow for large weights.
+        keys = [math.log(1 - random.random()) / (w + pad) for w in weights]
+        return [edges[i] for i in heapq.nlargest(amount, range(len(edges)), key=keys.__getitem__)]
+
+    return []
+
+def _selectArray(weights, policy, factor):
+
+    """
+    Like selectDropout(), but selects from a NumPy array of candidate weights.
+    Returns an array of the positions of the selected candidates.
+    """
+
+    if policy == Dropout.RANDOM:
+        return np.flatnonzero(np.random.random(len(weights)) < factor)
+
+    amount = int(len(weights)*factor)
+    if amount <= 0:
+        return np.empty(0, dtype=np.int64)
+    if amount >= len(weights):
+        return np.arange(len(weights))
+
+    if policy == Dropout.LEAST_USED:
+        return np.argpartition(weights, amount - 1)[:amount]
+
+    #RANDOM_WEIGHTED, see selectDropout()
+    weights = -weights*factor
+    m = weights.min()
+    pad = 1 - m if m < 1 else 0
+    keys = np.log(1 - np.random.random(len(weights))) / (weights + pad)
+    return np.argpartition(-keys, amount - 1)[:amount]
+
 class Message():
 
     """
@@ -77,6 +239,10 @@ class TokenTable():
 
     """
     Stores tokens and their respective internal representation.
+
+    Tokens are stored by name in mapping and by ID in tokens. IDs are never reused,
+    the slots of deleted tokens in tokens are set to None.
+    version is incremented whenever existing IDs become invalid (tokens are deleted or the table is loaded).
     """
 
     logger = logging.getLogger("TokenTable")
@@ -84,12 +250,16 @@ class TokenTable():
     def __init__(self):
 
         self.mapping = {}
+        self.tokens = []
+        self.version = 0
+        self._deleted = 0
 
     def addToken(self, name, type=TokenTypes.WORD, tag=Tags.NOUN):
 
-        ind = len(self.mapping)
+        ind = len(self.tokens)
         token = Token(name, type, ind, tag)
         self.mapping[name] = token
+        self.tokens.append(token)
         return token
 
     def getTokenByName(self, name):
@@ -98,12 +268,42 @@ class TokenTable():
 
     def getTokenByID(self, ID):
 
-        return list(self.mapping.values())[ID]
+        """
+        Return the token with the given ID.
+        Raises KeyError if there is no such token.
+        """
+
+        try:
+            token = self.tokens[ID]
+        except IndexError:
+            token = None
+        if token is None:
+            raise KeyError(ID)
+        return token
+
+    def getTokensByID(self, IDs):
+
+        """
+        Return a list of the tokens with the given IDs.
+        Raises KeyError if any of them does not exist.
+        """
+
+        tokens = self.tokens
+        try:
+            result = [tokens[ID] for ID in IDs]
+        except IndexError:
+            result = [None]
+        if None in result:
+            raise KeyError([ID for ID in IDs if ID >= len(tokens) or tokens[ID] is None][0])
+        return result
 
     def deleteToken(self, ID):
 
         t = self.getTokenByID(ID)
         del self.mapping[t.name]
+        self.tokens[ID] = None
+        self._deleted += 1
+        self.version += 1
 
     def hasToken(self, name):
 
@@ -111,7 +311,27 @@ class TokenTable():
 
     def getRandom(self):
 
-        return random.choice(list(self.mapping.values()))
+        if self._deleted * 2 > len(self.tokens):
+            return random.choice(list(self.mapping.values()))
+
+        #at least half of the slots are in use, so this takes two tries on average
+        while True:
+            token = random.choice(self.tokens)
+            if token is not None:
+                return token
+
+    def _rebuild(self):
+
+        """
+        Rebuild the ID index from the tokens in mapping.
+        """
+
+        size = max((token.index for token in self.mapping.values()), default=-1) + 1
+        self.tokens = [None] * size
+        for token in self.mapping.values():
+            self.tokens[token.index] = token
+        self._deleted = size - len(self.mapping)
+        self.version += 1
 
     def load(self, f):
 
@@ -122,6 +342,7 @@ class TokenTable():
         d = json.load(f)
         for name, token in d.items():
             self.mapping[name] = Token(name, TokenTypes(token["type"]), token["ind"], Tags(token["tag"]))
+        self._rebuild()
 
     def save(self):
 
@@ -137,6 +358,47 @@ class TokenTable():
 
         return json.dumps(d)
 
+    def loadArrays(self, arrays):
+
+        """
+        Load the table from a dictionary of arrays, as returned by saveArrays().
+        """
+
+        self.logger.debug("Clearing table...")
+        self.mapping.clear()
+        self.logger.info("Loading...")
+
+        names = arrays["names"].tobytes()
+        start = 0
+        for ind, type, tag, end in zip(arrays["index"], arrays["type"], arrays["tag"], arrays["name_end"]):
+            name = names[start:end].decode()
+            start = end
+            self.mapping[name] = Token(name, TokenTypes(type), ind, Tags(tag))
+        self._rebuild()
+
+    def saveArrays(self):
+
+        """
+        Save the table as a dictionary of fixed width arrays.
+        Token names are stored as a single UTF-8 encoded byte array, along with the end offset of each name.
+        """
+
+        self.logger.info("Saving...")
+
+        index = array("q")
+        types = array("B")
+        tags = array("B")
+        ends = array("q")
+        names = bytearray()
+        for name, token in self.mapping.items():
+            index.append(token.index)
+            types.append(token.type.value)
+            tags.append(token.tag.value)
+            names += name.encode()
+            ends.append(len(names))
+
+        return {"index": index, "type": types, "tag": tags, "name_end": ends, "names": array("B", names)}
+
 class Node():
 
     """
@@ -199,18 +461,87 @@ class MModel():
         self.order = order #TODO: Add the option to create a graph with infinite memory
         self.starting_weight = starting_weight
         self.weight_increase = weight_increase
+        self._clear()
+
+    def _clear(self):
+
+        """
+        Remove all nodes and edges from the graph.
+        """
+
         self.nodes = {0: None}
-        self.edges = []
+        #adjacency maps, indexed by node index. _outgoing[fromInd][toInd] and _incoming[toInd][fromInd]
+        #both reference the same Edge instance, which allows us to look up, sample and remove edges
+        #by only visiting the edges connected to a single node.
+        self._outgoing = {0: {}}
+        self._incoming = {0: {}}
+        #context index, maps every suffix of a nodes argument tuple to the nodes ending in that suffix.
+        #Candidates are kept in insertion order so lookups return the oldest matching node.
+        self._contexts = {}
+        #cached successor samplers, maps node index to a tuple of target indices and cumulative weights.
+        #Entries are dropped whenever an outgoing edge of the node changes.
+        self._samplers = {}
         self._nextIndex = 0
+        self._clearFresh()
+
+    def _clearFresh(self):
+
+        #Dropout curves are applied to all edges once for a number of fed sequences (see _weighEdges()).
+        #Edges created since then should only be weighed for the sequences fed after their creation,
+        #so we remember the amount of sequences fed before each of them was created.
+        self._feeds = 0
+        self._fresh = {}
+
+    def _freshSteps(self, fromInd, toInd, steps):
+
+        """
+        Return the amount of times a curve applied steps times should be applied to the edge
+        connecting two nodes, which is less than steps if the edge was created during the last steps feeds.
+        """
+
+        feeds = self._fresh.get((fromInd, toInd))
+        if feeds is None:
+            return steps
+        return min(steps, self._feeds - feeds)
+
+    @property
+    def edges(self):
+
+        """
+        List of all edges in this graph.
+        The returned list is a copy, modifying it does not change the graph.
+        Use addEdge() and deleteEdge() instead.
+        """
+
+        return [edge for targets in self._outgoing.values() for edge in targets.values()]
+
+    def edgeCount(self):
+
+        """
+        Return the amount of edges in this graph, without building the list returned by edges.
+        """
+
+        return sum(map(len, self._outgoing.values()))
 
     def addEdge(self, fromInd, toInd, weight=1):
 
         """
         Add a new edge connecting two nodes.
+        If the nodes are already connected, weight is added to the existing edge instead.
         """
 
+        self.invalidate(fromInd)
+        targets = self._outgoing.setdefault(fromInd, {})
+        if toInd in targets:
+            edge = targets[toInd]
+            edge.weight += weight
+            return edge
+
         edge = Edge(fromInd, toInd, self.nodes[fromInd], self.nodes[toInd], weight)
-        self.edges.append(edge)
+        targets[toInd] = edge
+        self._incoming.setdefault(toInd, {})[fromInd] = edge
+        if self._feeds:
+            self._fresh[(fromInd, toInd)] = self._feeds
         return edge
 
     def deleteEdge(self, fromInd, toInd):
@@ -220,7 +551,10 @@ class MModel():
         """
 
         edge = self.findEdge(fromInd, toInd)
-        self.edges.remove(edge)
+        self.invalidate(fromInd)
+        del self._outgoing[fromInd][toInd]
+        del self._incoming[toInd][fromInd]
+        return edge
 
     def findEdge(self, fromInd, toInd):
 
@@ -231,10 +565,65 @@ class MModel():
         assert isinstance(fromInd, int)
         assert isinstance(toInd, int)
 
-        for edge in self.edges:
-            if edge.fromInd == fromInd and edge.toInd == toInd:
-                return edge
-        raise KeyError("No edge from %i to %i exists in this graph." % (fromInd, toInd))
+        try:
+            return self._outgoing[fromInd][toInd]
+        except KeyError:
+            raise KeyError("No edge from %i to %i exists in this graph." % (fromInd, toInd))
+
+    def setWeight(self, fromInd, toInd, weight):
+
+        """
+        Set the weight of the edge connecting two nodes.
+        Unlike changing the weight of an Edge instance, this also discards the cached successor sampler of the source node.
+        """
+
+        self.findEdge(fromInd, toInd).weight = float(weight)
+        self.invalidate(fromInd)
+
+    def invalidate(self, fromInd=None):
+
+        """
+        Discard the cached successor sampler of the node at index fromInd.
+        This has to be called whenever the weight of an outgoing edge of that node is changed directly.
+        If fromInd is None, the samplers of all nodes are discarded.
+        """
+
+        if fromInd is None:
+            self._samplers.clear()
+        else:
+            self._samplers.pop(fromInd, None)
+
+    def hasOutgoing(self, node):
+
+        """
+        Check if any edges originate at node.
+        """
+
+        return self._outDegree(self.getIndex(node)) > 0
+
+    def hasIncoming(self, node):
+
+        """
+        Check if any edges terminate at node.
+        """
+
+        return self._inDegree(self.getIndex(node)) > 0
+
+    def _outDegree(self, ind):
+
+        return len(self._outgoing.get(ind, ()))
+
+    def _inDegree(self, ind):
+
+        return len(self._incoming.get(ind, ()))
+
+    def _predecessors(self, ind):
+
+        """
+        Return a list of the indices of all nodes with an edge terminating at the node at index ind.
+        """
+
+        return list(self._incoming.get(ind, ()))
 
     def parseToken(self, value, previous=None):
 
@@ -256,11 +645,7 @@ class MModel():
             #parent, then return the existing node.
             nodeInd = self.getIndex(node)
             preInd = self.getIndex(previous)
-            try:
-                edge = self.findEdge(preInd, nodeInd)
-            except KeyError:
-                edge = self.addEdge(preInd, nodeInd, 0)
-            edge.weight += self.weight_increase
+            self.addEdge(preInd, nodeInd, self.weight_increase)
             return node
         except ValueError:
             #print("Adding new node for value %s" % str(value))
@@ -283,14 +668,30 @@ class MModel():
         Adds a new node to the graph.
         """
         
+        node = self._newNode(value, previous)
+        self.addEdge(self.getIndex(previous), node.index, weight)
+        return node
+
+    def _newNode(self, value, previous=None):
+
+        """
+        Create and store the node following previous with the given value, without connecting it.
+        """
+
         prevArgs = previous.args[-(self.order-1):] if previous else []
         node = Node(*prevArgs, value, index=self.getNextIndex())
-        prevInd = self.getIndex(previous)
-        newInd = self.getIndex(node)
-        self.nodes[newInd] = (node)
-        self.addEdge(prevInd, newInd, weight)
+        self._storeNode(node)
         return node
 
+    def _storeNode(self, node):
+
+        """
+        Add a node instance to the node store.
+        """
+
+        self.nodes[node.index] = node
+        self._indexNode(node)
+
     def addStop(self, node, weight=1):
 
         """
@@ -315,13 +716,54 @@ class MModel():
             return None
         if len(args) > self.order:
             raise ValueError("Invalid argument count for model of order %i: Was %i." % (self.order, len(args)))
-        for i in self.nodes.values():
-            if i == None:
-                continue
-            if i.args[-len(args):] == args:
-                return i
+        try:
+            return self._findContext(args)
+        except KeyError:
+            pass
         raise ValueError("Could not find a node that satisfies the provided conditions: %s" % str(args))
 
+    def _findContext(self, args):
+
+        """
+        Return the oldest node ending in the argument tuple args.
+        Raises KeyError if no such node exists.
+        """
+
+        return next(iter(self._contexts[args].values()))
+
+    def contextCount(self, ind):
+
+        """
+        Return the amount of nodes ending in the token ind, which is the amount of distinct contexts
+        the token has been seen in.
+        """
+
+        return len(self._contexts.get((ind,), ()))
+
+    def _indexNode(self, node):
+
+        """
+        Add a node to the context index.
+        """
+
+        for i in range(1, node.order + 1):
+            self._contexts.setdefault(node.args[-i:], {})[node.index] = node
+
+    def _unindexNode(self, node):
+
+        """
+        Remove a node from the context index.
+        """
+
+        for i in range(1, node.order + 1):
+            suffix = node.args[-i:]
+            candidates = self._contexts.get(suffix)
+            if candidates is None:
+                continue
+            candidates.pop(node.index, None)
+            if not candidates:
+                del self._contexts[suffix]
+
     def getNext(self, node=None):
 
         """
@@ -332,13 +774,15 @@ class MModel():
         This method is non deterministic.
         """
 
-        weights = []
-        targets = []
-        for edge in self.edges:
-            if edge.fromNode == node:
-                targets.append(edge.toInd)
-                weights.append(max(edge.weight, 1))
-        choice = random.choices(targets, weights, k=1)[0]
+        ind = self.getIndex(node)
+        try:
+            targets, cum_weights = self._samplers[ind]
+        except KeyError:
+            edges = self._outgoing.get(ind, {}).values()
+            targets = [edge.toInd for edge in edges]
+            cum_weights = list(itertools.accumulate(max(edge.weight, 1) for edge in edges))
+            self._samplers[ind] = (targets, cum_weights)
+        choice = random.choices(targets, cum_weights=cum_weights, k=1)[0] #bisects the cumulative weights
         return self.nodes[choice]
 
     def getSequence(self, startAt=None):
@@ -368,29 +812,88 @@ class MModel():
         for i in seq:
             lastNode = self.parseToken(i, lastNode)
         self.addStop(lastNode, self.starting_weight)
+        self._feeds += 1
 
-    def _sanitize(self, nodes):
+    def feedMany(self, seqs):
 
-        dirty_nodes = []
+        """
+        Feed a batch of token sequences into the model. Empty sequences are skipped.
+        The result is the same as calling feed() for every sequence, but the weight changes are summed up
+        per edge first and every edge is only updated once, which is a lot faster for large batches.
+        """
 
-        #Step 1: Walk the nodes, checking for edges that have this node as a source
-        for node in nodes:
-            if node is None:
-                continue #Ignore termination token
-            for edge in self.edges:
-                if edge.fromNode == node:
-                    break
+        #nodes have to be created in order, since the lookup of a token depends on the nodes created before it
+        weights = {}
+        born = {}
+        feeds = self._feeds
+        for seq in seqs:
+            if not seq:
+                continue
+            previous = None
+            for value in seq:
+                args = list(previous.args[1:]) if previous else []
+                args.append(value)
+                try:
+                    node = self.findNodeForArgs(args)
+                    weight = self.weight_increase
+                except ValueError:
+                    node = self._newNode(value, previous)
+                    weight = self.starting_weight
+                key = (self.getIndex(previous), node.index)
+                if key in weights:
+                    weights[key] += weight
+                else:
+                    weights[key] = weight
+                    born[key] = feeds
+                previous = node
+            key = (previous.index, 0)
+            if key in weights:
+                weights[key] += self.starting_weight
             else:
-                #Step 2: This node does not connect to any other node.
-                #This means the path has been broken, remove all source edges.
-                self.logger.debug("Node %s has no target, removing all source edges." % str(node))
-                for edge in self.edges[:]:
-                    if edge.toNode == node:
-                        self.edges.remove(edge)
-                        dirty_nodes.append(edge.fromNode)
-
-        #Step 3: Return list of nodes that were affected
-        #so they can be checked
+                weights[key] = self.starting_weight
+                born[key] = feeds
+            feeds += 1
+
+        self._feeds = feeds
+        for (fromInd, toInd), weight in weights.items():
+            self.addEdge(fromInd, toInd, weight)
+
+        #addEdge() marks new edges as created by the last sequence, correct this to the sequence that created them
+        for key, first in born.items():
+            if self._fresh.get(key) == feeds:
+                if first:
+                    self._fresh[key] = first
+                else:
+                    del self._fresh[key]
+
+    def _sanitizeIndices(self, indices):
+
+        """
+        Like sanitize(), but operates on node indices instead of Node instances.
+        Returns the set of indices of all nodes that were affected.
+        """
+
+        dirty_nodes = set(indices)
+
+        #Walk a worklist of nodes that might have become dead ends. A node without outgoing edges
+        #breaks every path running through it, so all edges leading to it are removed. Its predecessors
+        #only need to be checked again if that removed their last outgoing edge, which happens at most
+        #once per node and keeps the amount of work proportional to the amount of edges removed.
+        worklist = list(dirty_nodes)
+        while worklist:
+            ind = worklist.pop()
+            if ind == 0 or self._outDegree(ind):
+                continue #Ignore termination token and nodes that still lead somewhere
+            predecessors = self._predecessors(ind)
+            if predecessors:
+                self.logger.debug("Node %i has no target, removing all source edges." % ind)
+            for fromInd in predecessors:
+                self.deleteEdge(fromInd, ind)
+                dirty_nodes.add(fromInd)
+                if not self._outDegree(fromInd):
+                    worklist.append(fromInd)
+
+        self.logger.debug("Graph sanitized.")
         return dirty_nodes
 
     def sanitize(self, nodes=None):
@@ -405,122 +908,92 @@ class MModel():
         if nodes is None:
             nodes = self.nodes.values()
 
-        dirty_nodes = set(nodes)
+        dirty_nodes = self._sanitizeIndices([self.getIndex(node) for node in nodes])
+        return set(self.nodes[ind] for ind in dirty_nodes)
 
-        r = 1
-        while nodes:
-            self.logger.debug("Looking for disconnected paths (round %i)..." % r)
-            nodes = self._sanitize(nodes)
-            dirty_nodes.update(nodes)
-            r += 1
+    def _weighEdges(self, curve, threshold, steps=1):
 
-        self.logger.debug("Graph sanitized.")
-        return dirty_nodes
+        """
+        Apply a dropout curve steps times to the weights of all edges.
+        steps is the amount of sequences fed since the curve was last applied that are accounted for.
+        Edges created in the meantime are only weighed for the sequences fed after they were created.
+        Returns a list of (weight, fromInd, toInd) tuples for all edges whose weight fell below threshold.
+        """
+
+        self.invalidate()
+        if HAS_NUMPY:
+            candidates = self._weighArrays(curve, threshold, steps)
+        else:
+            candidates = []
+            fresh = self._fresh
+            for targets in self._outgoing.values():
+                for edge in targets.values():
+                    s = self._freshSteps(edge.fromInd, edge.toInd, steps) if fresh else steps
+                    edge.weight = applyCurve(edge.weight, curve, s)
+                    if edge.weight < threshold:
+                        candidates.append((edge.weight, edge.fromInd, edge.toInd))
+        self._clearFresh()
+        return candidates
+
+    def _weighArrays(self, curve, threshold, steps):
+
+        """
+        Apply a dropout curve to all edges using NumPy.
+        The weights are gathered into a single array, weighed by applyCurveArray() and written back to the edges.
+        Returns the candidates below threshold like _weighEdges().
+        """
+
+        edges = [edge for targets in self._outgoing.values() for edge in targets.values()]
+        weights = np.fromiter((edge.weight for edge in edges), np.float64, len(edges))
+        if self._fresh:
+            steps = np.fromiter((self._freshSteps(edge.fromInd, edge.toInd, steps) for edge in edges), np.int64, len(edges))
+        applyCurveArray(weights, curve, steps)
+
+        values = weights.tolist()
+        for edge, weight in zip(edges, values):
+            edge.weight = weight
+        positions = np.flatnonzero(weights < threshold).tolist()
+        return [(values[i], edges[i].fromInd, edges[i].toInd) for i in positions]
 
-    def dropout(self, policy=Dropout.RANDOM_WEIGHTED, curve=DropoutCurve.DECREMENT, factor=0.5, threshold=0):
+    def dropout(self, policy=Dropout.RANDOM_WEIGHTED, curve=DropoutCurve.DECREMENT, factor=0.5, threshold=0, steps=1):
 
         """
         Perform token dropout on the whole model using the specified policy and weighting curve.
         The curve is applied first, adjusting the weights of the entire model.
         After this step, dropout is performed according to the chosen policy.
 
-        After edges have been cleaned up, the entire graph is checked for loose paths which will be
-        deleted. This process can take a long time.
+        After edges have been cleaned up, loose paths leading to the dropped edges are deleted as well.
 
         How factor and threshold are applied depends on the chosen dropout algorithm.
+        steps specifies how many times the curve is applied.
+
+        Returns a list of (fromInd, toInd) tuples for the edges selected by the dropout policy.
         """
 
         #Step 1: Accumulate and adjust weights
-        edge_weights = []
-        for edge in self.edges:
-            if curve == DropoutCurve.DECREMENT:
-                edge.weight -= 1
-            elif curve == DropoutCurve.HALF:
-                edge.weight /= 2
-            elif curve == DropoutCurve.LOG2:
-                if edge.weight > 1:
-                    edge.weight = math.log2(edge.weight)
-                else:
-                    edge.weight = 0.0
-            elif curve == DropoutCurve.LOG10:
-                if edge.weight > 1:
-                    edge.weight = math.log10(edge.weight)
-                else:
-                    edge.weight = 0.0
-
-            elif curve == DropoutCurve.SQUARE_ROOT:
-                edge.weight = float(edge.weight ** 0.5)
-
-            if edge.weight < threshold:
-                edge_weights.append(edge)
+        edge_weights = self._weighEdges(curve, threshold, steps)
 
         #Step 2: Drop edges.
-        #The following algorithms are currently available:
-        #
-        #Random - Drop random edges below weight threshold. Factor specifies how likely an edge is to be dropped.
-        #Random weighted - Drop random edges below weight threshold after inverting their weights to seed the randomizer.
-        #   The final weights are multiplied by factor.
-        #Least used - Drop edges with the lowest weight. factor specifies the amount of edges to drop.
-        #All - All edges below threshold are dropped. factor is ignored.
-        #None - No edges will be dropped.
-
         if edge_weights:
             self.logger.debug("There are %i edge(s) below the weight threshold. Applying dropout policy..." % len(edge_weights))
 
-        deleted = set()
+        dropped = [(fromInd, toInd) for weight, fromInd, toInd in selectDropout(edge_weights, policy, factor)]
+        self.dropEdges(dropped)
+        return dropped
 
-        if policy == Dropout.NONE:
-            pass
+    def dropEdges(self, edges):
+
+        """
+        Delete a number of edges, given as (fromInd, toInd) tuples.
+        Afterwards, any paths that became disconnected and any nodes left without edges are removed as well.
+        """
 
-        elif policy == Dropout.ALL:
-            for edge in edge_weights:
-                deleted.add(edge.fromNode)
-                deleted.add(edge.toNode)
-                self.edges.remove(edge)
-
-        elif policy == Dropout.LEAST_USED:
-            edges = edge_weights[:]
-
-            def sort(x):
-                return x.weight
-            edges.sort(key=sort)
-            amount = int(len(edges)*factor)
-            for edge in edges[:amount]:
-                deleted.add(edge.fromNode)
-                deleted.add(edge.toNode)
-                self.edges.remove(edge)
-
-        elif policy == Dropout.RANDOM:
-            for edge in edge_weights:
-                if random.random() < factor:
-                    deleted.add(edge.fromNode)
-                    deleted.add(edge.toNode)
-                    self.edges.remove(edge)
-
-        elif policy == Dropout.RANDOM_WEIGHTED:
-            edges = edge_weights[:]
-            amount = int(len(edges)*factor)
-            selection = []
-            for i in range(amount):
-                f = lambda x: -x.weight*factor
-                weights = list(map(f, edges))
-                m = min(weights)
-                if m < 1:
-                    pad = 1 - m
-                    for j in range(len(weights)):
-                        weights[j] = weights[j] + pad
-                s = random.choices(edges, weights, k=1)[0]
-                selection.append(s)
-                edges.remove(s)
-            for edge in selection:
-                deleted.add(edge.fromNode)
-                deleted.add(edge.toNode)
-                self.edges.remove(edge)
+        deleted = self._deleteEdges(edges)
 
         #save processing time by exiting early if we didn't drop any edges
         if not deleted:
             return
-        deleted = self.sanitize(deleted)
+        deleted = self._sanitizeIndices(deleted)
 
         #Step 3: Drop nodes.
         #We only need to check nodes that had edges dropped, which is why we are keeping track of them
@@ -534,16 +1007,62 @@ class MModel():
         #An alternative would be to check if a node has an alternative path before removing an edge.
         #Experimentation is needed to find the best approachd/solution here.
 
-        for node in deleted:
-            if node == None:
+        isolated = []
+        for ind in deleted:
+            if ind == 0:
                 continue #Don't drop the terminating node
-            for edge in self.edges:
-                if node in (edge.fromNode, edge.toNode):
-                    break
-            else:
+            if not (self._outDegree(ind) or self._inDegree(ind)):
                 #No edges connected to this node, drop it
+                node = self.nodes[ind]
                 self.logger.debug("Dropping node %s: Node is isolated." % str(node))
-                del self.nodes[node.index]
+                isolated.append(node)
+        self.deleteNodes(isolated)
+
+    def _deleteEdges(self, edges):
+
+        """
+        Delete a number of edges, given as (fromInd, toInd) tuples, without removing the paths that became disconnected.
+        Returns the set of indices of all nodes connected to the deleted edges.
+        """
+
+        outgoing, incoming = self._outgoing, self._incoming
+        sources = set()
+        targets = set()
+        try:
+            for fromInd, toInd in edges:
+                del outgoing[fromInd][toInd]
+                del incoming[toInd][fromInd]
+                sources.add(fromInd)
+                targets.add(toInd)
+        except KeyError:
+            raise KeyError("No edge from %i to %i exists in this graph." % (fromInd, toInd))
+        finally:
+            for fromInd in sources:
+                self.invalidate(fromInd)
+        return sources | targets
+
+    def deleteNodes(self, nodes):
+
+        """
+        Remove a number of nodes from the graph.
+        The nodes should not have any edges connected to them.
+        """
+
+        for node in nodes:
+            self.deleteNode(node)
+
+    def deleteNode(self, node):
+
+        """
+        Remove a node from the graph.
+        The node should not have any edges connected to it.
+        """
+
+        del self.nodes[node.index]
+        self._unindexNode(node)
+        self.invalidate(node.index)
+        self._outgoing.pop(node.index, None)
+        self._incoming.pop(node.index, None)
 
     def save(self):
 
@@ -560,24 +1079,32 @@ class MModel():
             edges.append(e)
 
         d = {"nodes": nodes, "edges": edges}
+        d.update(self._saveFresh())
 
         return json.dumps(d)
 
+    def _saveFresh(self):
+
+        return {"feeds": self._feeds, "fresh": [[fromInd, toInd, feeds] for (fromInd, toInd), feeds in self._fresh.items()]}
+
+    def _loadFresh(self, d):
+
+        self._feeds = d.get("feeds", 0)
+        self._fresh = {(fromInd, toInd): feeds for fromInd, toInd, feeds in d.get("fresh", ())}
+
     def load(self, f):
 
-        self.logger.debug("Clearing node store...")
-        self.nodes.clear()
-        self.logger.debug("Clearing edge store...")
-        self.edges.clear()
+        self.logger.debug("Clearing graph...")
+        self._clear()
 
         self.logger.info("Loading HMM graph...")
         d = json.load(f)
 
-        self.nodes = {0: None}
         maxIndex = 0
         for ind, node in d["nodes"].items():
             i = int(ind)
             self.nodes[i] = Node(*node["p"], node["v"], index=i)
+            self._indexNode(self.nodes[i])
             maxIndex = max(maxIndex, i)
 
         self._nextIndex = maxIndex
@@ -586,30 +1113,817 @@ class MModel():
             fromInd = edge["s"]
             toInd = edge["d"]
             weight = edge["w"]
-            self.edges.append(Edge(fromInd, toInd, self.nodes[fromInd], self.nodes[toInd], weight))
+            self.addEdge(fromInd, toInd, weight) #duplicate edges written by older versions are merged here
 
-class PoSTagger():
+        self._loadFresh(d)
 
-    """
-    BrianCS Part of Speech (PoS) tagger.
+    def saveArrays(self):
 
-    Takes a sequence of tokens and tags them with information about part of speech.
-    Used as supplemental input for the main model.
-    """
+        """
+        Save the graph as a dictionary of fixed width arrays.
+        Nodes are stored as index, argument offset and argument count, with the arguments of all nodes
+        concatenated in a separate array. Edges are stored as source, target and weight, sorted by source and target.
+        """
 
-    logger = logging.getLogger("BrianCS Tagger")
+        self.logger.info("Saving HMM graph...")
+        index = array("q")
+        start = array("q")
+        length = array("h")
+        args = array("q")
+        for node in self.nodes.values():
+            if node is None:
+                continue
+            index.append(node.index)
+            start.append(len(args))
+            length.append(node.order)
+            args.extend(node.args)
+
+        sources = array("q")
+        targets = array("q")
+        weights = array("d")
+        for fromInd in sorted(self._outgoing):
+            for toInd, edge in sorted(self._outgoing[fromInd].items()):
+                sources.append(fromInd)
+                targets.append(toInd)
+                weights.append(edge.weight)
+
+        return {
+            "nodes.index": index,
+            "nodes.start": start,
+            "nodes.length": length,
+            "args": args,
+            "edges.from": sources,
+            "edges.to": targets,
+            "edges.weight": weights,
+            **self._saveFreshArrays()
+            }
 
-    def __init__(self):
+    def _saveFreshArrays(self):
 
-        pass
+        sources = array("q")
+        targets = array("q")
+        feeds = array("q")
+        for (fromInd, toInd), n in self._fresh.items():
+            sources.append(fromInd)
+            targets.append(toInd)
+            feeds.append(n)
+        return {"fresh.from": sources, "fresh.to": targets, "fresh.feeds": feeds, "feeds": array("q", [self._feeds])}
 
-class Parser():
+    def _loadFreshArrays(self, arrays):
 
-    """
-    Parser for the BrianCS model.
-    Parses a string into a sequence of tokens and translates them into
-    a sequence of integers. Tokens are stored internally using a TokenTable.
-    This class provides an interface for translating between numerical token IDs
+        if not "feeds" in arrays: #written by an older version
+            self._clearFresh()
+            return
+        self._feeds = arrays["feeds"][0]
+        self._fresh = {(fromInd, toInd): n for fromInd, toInd, n in zip(arrays["fresh.from"], arrays["fresh.to"], arrays["fresh.feeds"])}
+
+    def loadArrays(self, arrays):
+
+        """
+        Load the graph from a dictionary of arrays, as returned by saveArrays().
+        """
+
+        self.logger.debug("Clearing graph...")
+        self._clear()
+
+        self.logger.info("Loading HMM graph...")
+        args = arrays["args"]
+        maxIndex = 0
+        for ind, start, length in zip(arrays["nodes.index"], arrays["nodes.start"], arrays["nodes.length"]):
+            self._storeNode(Node(*args[start:start + length], index=ind))
+            maxIndex = max(maxIndex, ind)
+
+        self._nextIndex = maxIndex
+
+        for fromInd, toInd, weight in zip(arrays["edges.from"], arrays["edges.to"], arrays["edges.weight"]):
+            self.addEdge(fromInd, toInd, weight)
+
+        self._loadFreshArrays(arrays)
+
+class _NodeView(collections.abc.Mapping):
+
+    """
+    Read only mapping of node indices to Node instances, used by CompactMModel.
+    Node instances are created on access.
+    """
+
+    def __init__(self, graph):
+
+        self._graph = graph
+
+    def __getitem__(self, ind):
+
+        if ind == 0:
+            return None
+        if not self._graph._hasNode(ind):
+            raise KeyError(ind)
+        return self._graph._node(ind)
+
+    def __iter__(self):
+
+        yield 0
+        lengths = self._graph._argLen
+        for ind in range(1, len(lengths)):
+            if lengths[ind] >= 0:
+                yield ind
+
+    def __len__(self):
+
+        return self._graph._nodeCount + 1
+
+class _EdgeView(Edge):
+
+    """
+    Edge of a CompactMModel. The weight is read from and written to the edge store of the graph
+    on every access, the nodes are created on access.
+    """
+
+    def __init__(self, graph, fromInd, toInd):
+
+        self._graph = graph
+        self.fromInd = fromInd
+        self.toInd = toInd
+
+    @property
+    def fromNode(self):
+
+        return self._graph.nodes[self.fromInd]
+
+    @property
+    def toNode(self):
+
+        return self._graph.nodes[self.toInd]
+
+    @property
+    def weight(self):
+
+        return self._graph._weight(self.fromInd, self.toInd)
+
+    @weight.setter
+    def weight(self, weight):
+
+        self._graph.setWeight(self.fromInd, self.toInd, weight)
+
+class CompactMModel(MModel):
+
+    """
+    Array backed implementation of MModel.
+
+    Instead of keeping a Node and an Edge instance for every state and connection, this graph
+    stores node arguments and edge data in typed arrays. Edges are stored in compressed sparse
+    row (CSR) form, sorted by source and target index, with a second, reversed copy of the
+    source indices for looking up incoming edges. New edges are staged in a small map and merged
+    into the arrays in bulk, deleted edges are marked and purged during the next merge.
+
+    loadArrays() accepts read only views (see binary.BinaryReader.view()) for the node argument
+    and edge arrays, which are used in place until the graph is first changed and only copied then.
+
+    Node instances returned by this class are created on demand and are not tracked by the graph.
+    Edge instances returned by addEdge(), findEdge() or the edges property are views of the edge store,
+    their weight is looked up on every access and setting it changes the graph (see setWeight()).
+    """
+
+    MERGE_THRESHOLD = 4096 #minimum amount of staged changes before they are merged into the arrays
+    SAMPLER_CACHE_SIZE = 4096 #maximum amount of cached successor samplers
+
+    def _clear(self):
+
+        #Node store, indexed by node index. The arguments of each node are a slice of _argPool.
+        #Slots of deleted nodes have an argument length of -1.
+        self._argStart = array("q", [0])
+        self._argLen = array("h", [0])
+        self._argPool = array("q")
+        self._deadArgs = 0
+        self._nodeCount = 0
+        #context index, maps suffixes to a node index or a list of node indices in insertion order
+        self._contexts = {}
+
+        #Edge store. The outgoing edges of node i are stored at _targets/_weights[_rows[i]:_rows[i+1]],
+        #the sources of its incoming edges at _sources[_inRows[i]:_inRows[i+1]].
+        #Deleted edges have their weight set to NaN until the next merge.
+        self._rows = array("q", [0, 0])
+        self._targets = array("q")
+        self._weights = array("d")
+        self._inRows = array("q", [0, 0])
+        self._sources = array("q")
+        self._outDeg = array("l", [0])
+        self._inDeg = array("l", [0])
+        self._staged = {}
+        self._stagedIn = {}
+        self._stagedCount = 0
+        self._deadRows = set()
+        self._deferMerge = False
+        self._mapped = False #_argPool, _targets and _weights are read only views, see _unmap()
+
+        self._samplers = {}
+        self._nextIndex = 0
+        self._clearFresh()
+
+    @property
+    def nodes(self):
+
+        return _NodeView(self)
+
+    @property
+    def edges(self):
+
+        return [_EdgeView(self, fromInd, toInd) for fromInd, toInd, weight in self._edgeItems()]
+
+    def edgeCount(self):
+
+        return sum(self._outDeg)
+
+    def _grow(self, size):
+
+        """
+        Extend the per node arrays to hold at least size node slots.
+        """
+
+        grow = size - len(self._argLen)
+        if grow <= 0:
+            return
+        self._argStart.extend(array("q", [0]) * grow)
+        self._argLen.extend(array("h", [-1]) * grow)
+        self._outDeg.extend(array("l", [0]) * grow)
+        self._inDeg.extend(array("l", [0]) * grow)
+        self._rows.extend(array("q", [self._rows[-1]]) * grow)
+        self._inRows.extend(array("q", [self._inRows[-1]]) * grow)
+
+    def _hasNode(self, ind):
+
+        return ind == 0 or (0 < ind < len(self._argLen) and self._argLen[ind] >= 0)
+
+    def _unmap(self):
+
+        """
+        Copy the node argument and edge arrays if they are read only views passed to loadArrays().
+        This has to be called before the arrays are changed in place.
+        """
+
+        for name in ("_argPool", "_targets", "_weights"):
+            data = getattr(self, name)
+            if isinstance(data, memoryview):
+                setattr(self, name, binary.copyArray(data))
+        self._mapped = False
+
+    def _node(self, ind):
+
+        """
+        Create a Node instance for the node at index ind.
+        """
+
+        if ind == 0:
+            return None
+        start = self._argStart[ind]
+        return Node(*self._argPool[start:start + self._argLen[ind]], index=ind)
+
+    def _storeNode(self, node):
+
+        if self._mapped:
+            self._unmap()
+        self._grow(node.index + 1)
+        self._argStart[node.index] = len(self._argPool)
+        self._argLen[node.index] = node.order
+        self._argPool.extend(node.args)
+        self._nodeCount += 1
+        self._indexNode(node)
+
+    def _indexNode(self, node):
+
+        for i in range(1, node.order + 1):
+            suffix = node.args[-i:]
+            candidates = self._contexts.get(suffix)
+            if candidates is None:
+                self._contexts[suffix] = node.index
+            elif isinstance(candidates, list):
+                candidates.append(node.index)
+            else:
+                self._contexts[suffix] = [candidates, node.index]
+
+    def _unindexNode(self, node):
+
+        for i in range(1, node.order + 1):
+            suffix = node.args[-i:]
+            candidates = self._contexts.get(suffix)
+            if candidates is None:
+                continue
+            if isinstance(candidates, list):
+                candidates.remove(node.index)
+                if len(candidates) == 1:
+                    self._contexts[suffix] = candidates[0]
+            elif candidates == node.index:
+                del self._contexts[suffix]
+
+    def _findContext(self, args):
+
+        candidates = self._contexts[args]
+        if isinstance(candidates, list):
+            candidates = candidates[0]
+        return self._node(candidates)
+
+    def contextCount(self, ind):
+
+        candidates = self._contexts.get((ind,))
+        if candidates is None:
+            return 0
+        if isinstance(candidates, list):
+            return len(candidates)
+        return 1
+
+    def deleteNode(self, node):
+
+        ind = node.index
+        if not self._hasNode(ind) or ind == 0:
+            raise KeyError(ind)
+        self._unindexNode(self._node(ind))
+        self._forgetNode(ind)
+
+    def deleteNodes(self, nodes):
+
+        #removing indices from the context lists one at a time is quadratic for common suffixes,
+        #so we collect them first and filter every list once.
+        removed = {}
+        for node in nodes:
+            ind = node.index
+            if not self._hasNode(ind) or ind == 0:
+                raise KeyError(ind)
+            node = self._node(ind)
+            for i in range(1, node.order + 1):
+                removed.setdefault(node.args[-i:], set()).add(ind)
+            self._forgetNode(ind)
+
+        for suffix, inds in removed.items():
+            candidates = self._contexts.get(suffix)
+            if candidates is None:
+                continue
+            if isinstance(candidates, list):
+                candidates = [ind for ind in candidates if not ind in inds]
+                if not candidates:
+                    del self._contexts[suffix]
+                elif len(candidates) == 1:
+                    self._contexts[suffix] = candidates[0]
+                else:
+                    self._contexts[suffix] = candidates
+            elif candidates in inds:
+                del self._contexts[suffix]
+
+    def _forgetNode(self, ind):
+
+        self.invalidate(ind)
+        self._deadArgs += self._argLen[ind]
+        self._argLen[ind] = -1
+        self._nodeCount -= 1
+
+    def _find(self, fromInd, toInd):
+
+        """
+        Return the position of an edge in the edge arrays, or -1 if the edge is not stored there.
+        """
+
+        if fromInd + 1 >= len(self._rows):
+            return -1
+        hi = self._rows[fromInd + 1]
+        i = bisect.bisect_left(self._targets, toInd, self._rows[fromInd], hi)
+        if i < hi and self._targets[i] == toInd and not math.isnan(self._weights[i]):
+            return i
+        return -1
+
+    def _stage(self, fromInd, toInd, weight):
+
+        targets = self._staged.setdefault(fromInd, {})
+        if toInd in targets:
+            targets[toInd] += weight
+            return
+        targets[toInd] = float(weight)
+        self._stagedIn.setdefault(toInd, set()).add(fromInd)
+        self._stagedCount += 1
+        self._outDeg[fromInd] += 1
+        self._inDeg[toInd] += 1
+
+    def _mergeIfNeeded(self):
+
+        if self._deferMerge:
+            return
+        if self._stagedCount + len(self._deadRows) > max(self.MERGE_THRESHOLD, len(self._targets) >> 3):
+            self._merge()
+
+    def _mergeAfter(self, method, *args):
+
+        """
+        Call method, merging staged and deleted edges into the arrays once afterwards instead of while it runs.
+        Merging rebuilds the edge arrays, which is too expensive to do repeatedly during bulk changes.
+        """
+
+        self._deferMerge = True
+        try:
+            result = method(*args)
+        finally:
+            self._deferMerge = False
+        self._mergeIfNeeded()
+        return result
+
+    def feedMany(self, seqs):
+
+        self._mergeAfter(super().feedMany, seqs)
+
+    def dropEdges(self, edges):
+
+        self._mergeAfter(super().dropEdges, edges)
+
+    def _deleteEdges(self, edges):
+
+        deleted = set()
+        for fromInd, toInd in edges:
+            deleted.add(fromInd)
+            deleted.add(toInd)
+            self.deleteEdge(fromInd, toInd)
+        return deleted
+
+    def addEdge(self, fromInd, toInd, weight=1):
+
+        """
+        Add a new edge connecting two nodes.
+        If the nodes are already connected, weight is added to the existing edge instead.
+        """
+
+        if not (self._hasNode(fromInd) and self._hasNode(toInd)):
+            raise KeyError("No node at index %i or %i exists in this graph." % (fromInd, toInd))
+        self.invalidate(fromInd)
+        pos = self._find(fromInd, toInd)
+        if pos >= 0:
+            if self._mapped:
+                self._unmap()
+            self._weights[pos] += weight
+            return _EdgeView(self, fromInd, toInd)
+        if self._feeds and not toInd in self._staged.get(fromInd, ()):
+            self._fresh[(fromInd, toInd)] = self._feeds
+        self._stage(fromInd, toInd, weight)
+        self._mergeIfNeeded()
+        return _EdgeView(self, fromInd, toInd)
+
+    def deleteEdge(self, fromInd, toInd):
+
+        pos = self._find(fromInd, toInd)
+        if pos >= 0:
+            if self._mapped:
+                self._unmap()
+            self._weights[pos] = math.nan
+            self._deadRows.add(fromInd)
+        else:
+            targets = self._staged.get(fromInd, {})
+            if not toInd in targets:
+                raise KeyError("No edge from %i to %i exists in this graph." % (fromInd, toInd))
+            del targets[toInd]
+            if not targets:
+                del self._staged[fromInd]
+            sources = self._stagedIn[toInd]
+            sources.discard(fromInd)
+            if not sources:
+                del self._stagedIn[toInd]
+            self._stagedCount -= 1
+        self._outDeg[fromInd] -= 1
+        self._inDeg[toInd] -= 1
+        self.invalidate(fromInd)
+        self._mergeIfNeeded()
+
+    def findEdge(self, fromInd, toInd):
+
+        self._weight(fromInd, toInd)
+        return _EdgeView(self, fromInd, toInd)
+
+    def _weight(self, fromInd, toInd):
+
+        """
+        Return the weight of the edge connecting two nodes.
+        """
+
+        pos = self._find(fromInd, toInd)
+        if pos >= 0:
+            return self._weights[pos]
+        try:
+            return self._staged[fromInd][toInd]
+        except KeyError:
+            raise KeyError("No edge from %i to %i exists in this graph." % (fromInd, toInd))
+
+    def setWeight(self, fromInd, toInd, weight):
+
+        pos = self._find(fromInd, toInd)
+        if pos >= 0:
+            if self._mapped:
+                self._unmap()
+            self._weights[pos] = weight
+        else:
+            targets = self._staged.get(fromInd, {})
+            if not toInd in targets:
+                raise KeyError("No edge from %i to %i exists in this graph." % (fromInd, toInd))
+            targets[toInd] = float(weight)
+        self.invalidate(fromInd)
+
+    def _outDegree(self, ind):
+
+        return self._outDeg[ind] if ind < len(self._outDeg) else 0
+
+    def _inDegree(self, ind):
+
+        return self._inDeg[ind] if ind < len(self._inDeg) else 0
+
+    def _successors(self, ind):
+
+        """
+        Return a list of (toInd, weight) tuples for all edges originating at the node at index ind.
+        """
+
+        successors = []
+        if ind + 1 < len(self._rows):
+            for i in range(self._rows[ind], self._rows[ind + 1]):
+                weight = self._weights[i]
+                if not math.isnan(weight):
+                    successors.append((self._targets[i], weight))
+        successors.extend(self._staged.get(ind, {}).items())
+        return successors
+
+    def _predecessors(self, ind):
+
+        predecessors = []
+        if ind + 1 < len(self._inRows):
+            for i in range(self._inRows[ind], self._inRows[ind + 1]):
+                fromInd = self._sources[i]
+                if self._find(fromInd, ind) >= 0:
+                    predecessors.append(fromInd)
+        predecessors.extend(self._stagedIn.get(ind, ()))
+        return predecessors
+
+    def _edgeItems(self):
+
+        """
+        Iterate over all edges as (fromInd, toInd, weight) tuples.
+        """
+
+        for ind in range(len(self._rows) - 1):
+            for toInd, weight in self._successors(ind):
+                yield ind, toInd, weight
+
+    def _merge(self):
+
+        """
+        Merge staged edges into the edge arrays and purge deleted edges and node arguments.
+        """
+
+        if self._staged or self._deadRows:
+            self._mergeEdges()
+
+        if self._deadArgs * 2 > len(self._argPool):
+            pool = array("q")
+            for ind in range(1, len(self._argLen)):
+                if self._argLen[ind] < 0:
+                    continue
+                start = self._argStart[ind]
+                self._argStart[ind] = len(pool)
+                pool.extend(self._argPool[start:start + self._argLen[ind]])
+            self._argPool = pool
+            self._deadArgs = 0
+
+    def _mergeEdges(self):
+
+        rows = array("q", [0])
+        targets = array("q")
+        weights = array("d")
+        oldRows, oldTargets, oldWeights = self._rows, self._targets, self._weights
+        for ind in range(len(oldRows) - 1):
+            lo, hi = oldRows[ind], oldRows[ind + 1]
+            staged = self._staged.get(ind)
+            if staged is None and not ind in self._deadRows:
+                targets.extend(oldTargets[lo:hi])
+                weights.extend(oldWeights[lo:hi])
+            else:
+                entries = [(oldTargets[i], oldWeights[i]) for i in range(lo, hi) if not math.isnan(oldWeights[i])]
+                if staged:
+                    entries.extend(staged.items())
+                    entries.sort()
+                for toInd, weight in entries:
+                    targets.append(toInd)
+                    weights.append(weight)
+            rows.append(len(targets))
+
+        self._rows, self._targets, self._weights = rows, targets, weights
+        self._buildReverse()
+        self._staged = {}
+        self._stagedIn = {}
+        self._stagedCount = 0
+        self._deadRows = set()
+
+    def _buildReverse(self):
+
+        """
+        Rebuild the index of incoming edges using a counting sort over the target indices.
+        """
+
+        rows, targets = self._rows, self._targets
+        inRows = array("q", [0]) * len(rows)
+        for toInd in targets:
+            inRows[toInd + 1] += 1
+        for ind in range(1, len(inRows)):
+            inRows[ind] += inRows[ind - 1]
+        sources = array("q", [0]) * len(targets)
+        fill = inRows[:]
+        for ind in range(len(rows) - 1):
+            for i in range(rows[ind], rows[ind + 1]):
+                toInd = targets[i]
+                sources[fill[toInd]] = ind
+                fill[toInd] += 1
+        self._inRows, self._sources = inRows, sources
+
+    def getNext(self, node=None):
+
+        ind = self.getIndex(node)
+        try:
+            targets, cum_weights = self._samplers[ind]
+        except KeyError:
+            successors = self._successors(ind)
+            targets = [toInd for toInd, weight in successors]
+            cum_weights = list(itertools.accumulate(max(weight, 1) for toInd, weight in successors))
+            if len(self._samplers) >= self.SAMPLER_CACHE_SIZE:
+                self._samplers.clear()
+            self._samplers[ind] = (targets, cum_weights)
+        choice = random.choices(targets, cum_weights=cum_weights, k=1)[0]
+        return self._node(choice)
+
+    def _weighEdges(self, curve, threshold, steps=1):
+
+        self.invalidate()
+        if self._mapped:
+            self._unmap()
+        if HAS_NUMPY:
+            candidates = self._weighArrays(curve, threshold, steps)
+        else:
+            candidates = []
+            rows, targets, weights = self._rows, self._targets, self._weights
+            fresh = self._fresh
+            for ind in range(len(rows) - 1):
+                for i in range(rows[ind], rows[ind + 1]):
+                    s = self._freshSteps(ind, targets[i], steps) if fresh else steps
+                    weight = applyCurve(weights[i], curve, s) #deleted edges stay NaN and are never selected
+                    weights[i] = weight
+                    if weight < threshold:
+                        candidates.append((weight, ind, targets[i]))
+        fresh = self._fresh
+        for fromInd, staged in self._staged.items():
+            for toInd, weight in staged.items():
+                weight = applyCurve(weight, curve, self._freshSteps(fromInd, toInd, steps))
+                staged[toInd] = weight
+                if weight < threshold:
+                    candidates.append((weight, fromInd, toInd))
+        self._clearFresh()
+        return candidates
+
+    def _weighArrays(self, curve, threshold, steps):
+
+        """
+        Apply a dropout curve to the merged edge arrays using NumPy.
+        Returns the candidates below threshold like _weighEdges(), staged edges are not included.
+        """
+
+        #views share memory with the arrays, they have to be released before the arrays can be resized again
+        weights = np.frombuffer(self._weights, dtype=np.float64)
+        if self._fresh:
+            steps = np.full(len(weights), steps, dtype=np.int64)
+            for (fromInd, toInd), feeds in self._fresh.items():
+                pos = self._find(fromInd, toInd)
+                if pos >= 0:
+                    steps[pos] = self._freshSteps(fromInd, toInd, steps[pos])
+        applyCurveArray(weights, curve, steps)
+
+        with np.errstate(invalid="ignore"):
+            positions = np.flatnonzero(weights < threshold) #deleted edges are NaN and never selected
+        sources = np.searchsorted(np.frombuffer(self._rows, dtype=np.int64), positions, side="right") - 1
+        targets = np.frombuffer(self._targets, dtype=np.int64)[positions]
+        candidates = list(zip(weights[positions].tolist(), sources.tolist(), targets.tolist()))
+        del weights
+        return candidates
+
+    def save(self):
+
+        self.logger.info("Saving HMM graph...")
+        nodes = {}
+        for ind in range(1, len(self._argLen)):
+            if self._argLen[ind] < 0:
+                continue
+            start = self._argStart[ind]
+            args = self._argPool[start:start + self._argLen[ind]].tolist()
+            nodes[str(ind)] = {"v": args[-1], "p": args[:-1]}
+
+        edges = []
+        for fromInd, toInd, weight in self._edgeItems():
+            edges.append({"s": fromInd, "d": toInd, "w": weight})
+
+        d = {"nodes": nodes, "edges": edges}
+        d.update(self._saveFresh())
+
+        return json.dumps(d)
+
+    def load(self, f):
+
+        self.logger.debug("Clearing graph...")
+        self._clear()
+
+        self.logger.info("Loading HMM graph...")
+        d = json.load(f)
+
+        nodes = sorted((int(ind), node) for ind, node in d["nodes"].items())
+        maxIndex = nodes[-1][0] if nodes else 0
+        self._grow(maxIndex + 1)
+        for i, node in nodes:
+            self._storeNode(Node(*node["p"], node["v"], index=i))
+
+        self._nextIndex = maxIndex
+
+        for edge in d["edges"]:
+            self._stage(edge["s"], edge["d"], edge["w"])
+        self._merge()
+
+        self._loadFresh(d)
+
+    def saveArrays(self):
+
+        self.logger.info("Saving HMM graph...")
+        self._merge()
+        argLen = self._argLen
+        index = array("q", [ind for ind in range(1, len(argLen)) if argLen[ind] >= 0])
+        start = array("q", map(self._argStart.__getitem__, index))
+        length = array("h", map(argLen.__getitem__, index))
+
+        rows = self._rows
+        sources = array("q", itertools.chain.from_iterable(map(itertools.repeat, range(len(rows) - 1), map(operator.sub, rows[1:], rows))))
+
+        return {
+            "nodes.index": index,
+            "nodes.start": start,
+            "nodes.length": length,
+            "args": binary.copyArray(self._argPool),
+            "edges.from": sources,
+            "edges.to": binary.copyArray(self._targets),
+            "edges.weight": binary.copyArray(self._weights),
+            **self._saveFreshArrays()
+            }
+
+    def loadArrays(self, arrays):
+
+        self.logger.debug("Clearing graph...")
+        self._clear()
+
+        self.logger.info("Loading HMM graph...")
+        index = arrays["nodes.index"]
+        maxIndex = max(index) if index else 0
+        self._grow(maxIndex + 1)
+        self._argPool = arrays["args"]
+        for ind, start, length in zip(index, arrays["nodes.start"], arrays["nodes.length"]):
+            self._argStart[ind] = start
+            self._argLen[ind] = length
+            self._indexNode(self._node(ind))
+        self._nodeCount = len(index)
+        self._deadArgs = len(self._argPool) - sum(arrays["nodes.length"])
+        self._nextIndex = maxIndex
+
+        #edges are stored sorted by source and target, so the target and weight arrays can be used as they are
+        rows = array("q", [0]) * (len(self._argLen) + 1)
+        for fromInd in arrays["edges.from"]:
+            rows[fromInd + 1] += 1
+        for ind in range(1, len(rows)):
+            rows[ind] += rows[ind - 1]
+        self._rows = rows
+        self._targets = arrays["edges.to"]
+        self._weights = arrays["edges.weight"]
+        #views are used in place until the graph is changed (copy on write)
+        self._mapped = any(isinstance(data, memoryview) for data in (self._argPool, self._targets, self._weights))
+        self._buildReverse()
+        for ind in range(len(self._argLen)):
+            self._outDeg[ind] = rows[ind + 1] - rows[ind]
+            self._inDeg[ind] = self._inRows[ind + 1] - self._inRows[ind]
+
+        self._loadFreshArrays(arrays)
+
+class PoSTagger():
+
+    """
+    BrianCS Part of Speech (PoS) tagger.
+
+    Takes a sequence of tokens and tags them with information about part of speech.
+    Used as supplemental input for the main model.
+    """
+
+    logger = logging.getLogger("BrianCS Tagger")
+
+    def __init__(self):
+
+        pass
+
+class Parser():
+
+    """
+    Parser for the BrianCS model.
+    Parses a string into a sequence of tokens and translates them into
+    a sequence of integers. Tokens are stored internally using a TokenTable.
+    This class provides an interface for translating between numerical token IDs
     and plain text.
     """
 
@@ -624,10 +1938,26 @@ class Parser():
 
     PATTERN = re.compile('|'.join('(?P<%s>%s)' % pair for pair in PATTERNS))
 
-    def __init__(self, table):
+    #token types of new tokens by pattern name
+    TYPES = {
+        "LINK": TokenTypes.LINK,
+        "WORD": TokenTypes.WORD,
+        "SEPARATOR": TokenTypes.SEPARATOR,
+        "MISMATCH": TokenTypes.WORD
+        }
+
+    def __init__(self, table, cache_size=1024):
+
+        """
+        cache_size is the amount of recently parsed messages whose token IDs are kept in memory.
+        Chat messages repeat a lot (greetings, commands, emotes), so these don't need to be tokenized again.
+        """
 
         self.table = table
         self.tagger = PoSTagger()
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._cacheVersion = table.version
 
     def tokenize(self, msg):
 
@@ -642,40 +1972,404 @@ class Parser():
             tokens.append((value, type))
         return tokens
 
-    def parse(self, msg):
+    def iterIDs(self, msg):
+
+        """
+        Tokenize a text message and yield the ID of each token, adding new tokens to the table.
+        Unlike parseIDs(), this does not use the cache.
+        """
+
+        #TODO: run message through tagger to obtain PoS information
+        mapping = self.table.mapping
+        for match in self.PATTERN.finditer(msg):
+            value = match.group()
+            token = mapping.get(value)
+            if token is None:
+                token = self.table.addToken(value, self.TYPES[match.lastgroup], Tags.NOUN)
+            yield token.index
+
+    def parseIDs(self, msg):
+
+        """
+        Tokenize and translate a text message into a list of token IDs.
+        """
+
+        cache = self._cache
+        if self._cacheVersion != self.table.version:
+            #tokens were deleted or the table was reloaded, cached IDs may be stale
+            cache.clear()
+            self._cacheVersion = self.table.version
+
+        ids = cache.get(msg)
+        if ids is not None:
+            cache.move_to_end(msg)
+            return list(ids)
+
+        ids = list(self.iterIDs(msg))
+        if self.cache_size > 0:
+            cache[msg] = tuple(ids)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return ids
+
+    def parseMany(self, msgs):
+
+        """
+        Tokenize and translate an iterable of text messages, returning a list of token ID lists.
+        This is meant for training data, which is not added to the cache.
+        """
+
+        iterIDs = self.iterIDs
+        return [list(iterIDs(msg)) for msg in msgs]
+
+    def parse(self, msg):
+
+        """
+        Tokenizes and translates a text message into a sequence of tokens.
+        """
+
+        return self.table.getTokensByID(self.parseIDs(msg))
+
+    def build(self, seq):
+
+        """
+        Translate a sequence of numerical IDs into plaintext through token table lookup.
+        """
+
+        tokens = []
+        for ID in seq:
+            tokens.append(self.table.getTokenByID(ID).name)
+
+        return "".join(tokens)
+
+def tableJSON(arrays):
+
+    """
+    Convert a token table stored as arrays (see TokenTable.saveArrays()) to the JSON format used by TokenTable.save().
+    """
+
+    names = arrays["names"].tobytes()
+    d = {}
+    start = 0
+    for ind, type, tag, end in zip(arrays["index"], arrays["type"], arrays["tag"], arrays["name_end"]):
+        d[names[start:end].decode()] = {"type": type, "ind": ind, "tag": tag}
+        start = end
+    return json.dumps(d)
+
+def graphJSON(arrays):
+
+    """
+    Convert a graph stored as arrays (see MModel.saveArrays()) to the JSON format used by MModel.save().
+    """
+
+    args = arrays["args"]
+    nodes = {}
+    for ind, start, length in zip(arrays["nodes.index"], arrays["nodes.start"], arrays["nodes.length"]):
+        nodeArgs = args[start:start + length].tolist()
+        nodes[str(ind)] = {"v": nodeArgs[-1], "p": nodeArgs[:-1]}
+
+    edges = []
+    for fromInd, toInd, weight in zip(arrays["edges.from"], arrays["edges.to"], arrays["edges.weight"]):
+        edges.append({"s": fromInd, "d": toInd, "w": weight})
+
+    if "feeds" in arrays:
+        feeds = arrays["feeds"][0]
+        fresh = [list(edge) for edge in zip(arrays["fresh.from"], arrays["fresh.to"], arrays["fresh.feeds"])]
+    else: #written by an older version, see MModel._loadFreshArrays()
+        feeds = 0
+        fresh = []
+
+    return json.dumps({"nodes": nodes, "edges": edges, "feeds": feeds, "fresh": fresh})
+
+def _generatorWorker(conn, settings, forward, backward):
+
+    """
+    Main function of generator worker processes, see GeneratorPool.
+    """
+
+    random.seed() #make sure workers don't generate identical candidates
+
+    model = BrianModel()
+    model._applySettings(settings)
+    model.genForward.loadArrays(forward)
+    model.genBackward.loadArrays(backward)
+    del forward, backward
+    conn.send("ready")
+
+    while True:
+        try:
+            cmd, *args = conn.recv()
+        except EOFError:
+            break
+
+        if cmd == "update":
+            for record in args[0]:
+                model._replay(record)
+        elif cmd == "generate":
+            seeds, duration, limit = args
+            conn.send(model._generateCandidates(seeds, duration, limit))
+        elif cmd == "stop":
+            break
+
+    conn.close()
+
+class GeneratorPool():
+
+    """
+    A pool of worker processes generating reply candidates in parallel.
+
+    Each worker holds a copy of the graphs of a BrianModel. Changes to the model are
+    forwarded to the workers as journal records (see BrianModel._record()), which
+    the workers replay to keep their copies up to date.
+    """
+
+    logger = logging.getLogger("BrianCS Generator Pool")
+
+    def __init__(self, model, count):
+
+        self.count = count
+        self._workers = []
+
+        snapshot = model.snapshot()
+        ctx = multiprocessing.get_context("spawn") #forking would copy the locks held by other threads
+        for i in range(count):
+            conn, child = ctx.Pipe()
+            process = ctx.Process(target=_generatorWorker, args=(child, snapshot.settings, snapshot.forward, snapshot.backward), daemon=True)
+            process.start()
+            child.close()
+            self._workers.append((process, conn))
+
+        #wait until all workers have loaded the graphs
+        for process, conn in self._workers:
+            conn.recv()
+
+        self.logger.info("Started %i generator worker(s)." % count)
+
+    def update(self, record):
+
+        """
+        Forward a journal record to all workers.
+        """
+
+        if "t" in record:
+            return #workers don't need the token table
+        for process, conn in self._workers:
+            conn.send(("update", [record]))
+
+    def generate(self, seeds, duration, limit):
+
+        """
+        Generate up to limit candidate replies within duration seconds on all workers and return them.
+        seeds is a list of token IDs to start generating from.
+        """
+
+        share = -(-limit // self.count)
+        for process, conn in self._workers:
+            conn.send(("generate", seeds, duration, share))
+
+        results = []
+        for process, conn in self._workers:
+            results.extend(conn.recv())
+        return results
+
+    def close(self):
+
+        """
+        Stop all workers.
+        """
+
+        for process, conn in self._workers:
+            try:
+                conn.send(("stop",))
+            except OSError:
+                pass
+            conn.close()
+        for process, conn in self._workers:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self._workers = []
+
+class ModelSnapshot():
+
+    """
+    A copy of the state of a BrianModel at a single point in time, as returned by BrianModel.snapshot().
+    Snapshots do not share any data with the model they were taken from.
+    """
+
+    logger = logging.getLogger("BrianCS Snapshot")
+
+    def __init__(self, settings, blacklist, table, forward, backward):
+
+        self.settings = settings
+        self.blacklist = blacklist
+        self.table = table
+        self.forward = forward
+        self.backward = backward
+
+    def write(self, path, format=ModelFormat.ZIP):
+
+        """
+        Write the snapshot to a file.
+        The snapshot is written to a temporary file next to path first, which then replaces path.
+        This way, path always contains either the previous or the new model, even if writing fails halfway.
+        """
+
+        tmp = "%s.%i.tmp" % (path, threading.get_ident())
+        try:
+            with open(tmp, "wb") as f:
+                if format == ModelFormat.BINARY:
+                    self._writeBinary(f)
+                else:
+                    self._writeZip(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+        if hasattr(os, "O_DIRECTORY"): #make sure the rename itself is on disk, this is not supported on windows
+            fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _writeZip(self, fp):
+
+        f = zipfile.ZipFile(fp, "w")
+
+        #Settings (model.json)
+        self.logger.info("Saving model configuration...")
+        f.writestr("model.json", json.dumps(self.settings, indent=4))
+
+        #Token table
+        f.writestr("table.dat", tableJSON(self.table))
+
+        #Models
+        f.writestr("model1.dat", graphJSON(self.forward))
+        f.writestr("model2.dat", graphJSON(self.backward))
+
+        #Blacklist
+        f.writestr("blacklist.txt", "\n".join(self.blacklist))
+
+        f.close()
+
+    def _writeBinary(self, f):
+
+        writer = binary.BinaryWriter()
+
+        self.logger.info("Saving model configuration...")
+        writer.addBytes("config", json.dumps(self.settings).encode())
+
+        for name, data in self.table.items():
+            writer.add("tokens." + name, data)
+        for name, data in self.forward.items():
+            writer.add("forward." + name, data)
+        for name, data in self.backward.items():
+            writer.add("backward." + name, data)
+
+        writer.addBytes("blacklist", "\n".join(self.blacklist).encode())
+
+        writer.write(f)
+
+class CandidateScorer():
+
+    """
+    Rates reply candidates by the tokens they share with a set of reference messages.
+
+    references is a list of (weight, token IDs) pairs, idf is a function returning the weight of a token ID,
+    which should be higher for rare tokens. Every token counts once per message. The score of a candidate is
+    the F1 measure of its overlap with the references, weighted by idf, where a reference token counts with
+    the share of the reference weight of the messages containing it. Scores range from 0 to 1.
+
+    If novelty is True, scores are multiplied by the share of the candidate that is not part of the
+    references, so candidates repeating the references are rated 0.
+    """
 
-        """
-        Tokenizes and translates a text message into a sequence of tokens.
-        """
+    ARRAY_THRESHOLD = 64 #minimum amount of candidates scored using NumPy, smaller batches are faster in pure Python
 
-        tokens = self.tokenize(msg)
+    def __init__(self, references, idf, novelty=False):
 
-        seq = []
-        #TODO: run message through tagger to obtain PoS information
-        for token, type in tokens:
-            if self.table.hasToken(token):
-                seq.append(self.table.getTokenByName(token))
-                continue
-            eType = TokenTypes.WORD
-            if type == "SEPARATOR":
-                eType = TokenTypes.SEPARATOR
-            elif type == "LINK":
-                eType = TokenTypes.LINK
-            seq.append(self.table.addToken(token, eType, Tags.NOUN))
+        self.idf = idf
+        self.novelty = novelty
+        self._weights = {} #cached idf weights by token ID
 
-        return seq
+        self.context = {} #reference weight share by token ID
+        total = sum(weight for weight, tokens in references)
+        if total > 0:
+            for weight, tokens in references:
+                for ind in set(tokens):
+                    self.context[ind] = self.context.get(ind, 0) + weight / total
+        self.mass = sum(self.weight(ind) * share for ind, share in self.context.items())
 
-    def build(self, seq):
+    def weight(self, ind):
+
+        w = self._weights.get(ind)
+        if w is None:
+            w = self._weights[ind] = self.idf(ind)
+        return w
+
+    def score(self, candidates):
 
         """
-        Translate a sequence of numerical IDs into plaintext through token table lookup.
+        Return a list of scores for a list of candidates, given as lists of token IDs.
         """
 
-        tokens = []
-        for ID in seq:
-            tokens.append(self.table.getTokenByID(ID).name)
-
-        return "".join(tokens)
+        if not self.context:
+            return [0.0] * len(candidates)
+        if HAS_NUMPY and len(candidates) >= self.ARRAY_THRESHOLD:
+            return self._scoreArrays(candidates)
+        return [self._scoreOne(candidate) for candidate in candidates]
+
+    def _finish(self, shared, mass):
+
+        if mass + self.mass <= 0:
+            return 0.0
+        score = 2 * shared / (mass + self.mass)
+        if self.novelty and mass > 0:
+            score *= 1 - shared / mass
+        return score
+
+    def _scoreOne(self, candidate):
+
+        shared = mass = 0.0
+        for ind in set(candidate):
+            w = self.weight(ind)
+            mass += w
+            shared += w * self.context.get(ind, 0.0)
+        return self._finish(shared, mass)
+
+    def _scoreArrays(self, candidates):
+
+        #all candidates are scored at once: token IDs are flattened and mapped to the list of distinct
+        #tokens, duplicates within a candidate are removed and the weights are summed per candidate.
+        n = len(candidates)
+        lengths = np.fromiter(map(len, candidates), np.int64, n)
+        flat = np.fromiter(itertools.chain.from_iterable(candidates), np.int64, int(lengths.sum()))
+        if not flat.size:
+            return [0.0] * n
+        tokens, inverse = np.unique(flat, return_inverse=True)
+        keys = np.repeat(np.arange(n, dtype=np.int64), lengths) * len(tokens) + inverse.ravel()
+        keys.sort()
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        rows, inverse = np.divmod(keys, len(tokens))
+
+        ids = tokens.tolist()
+        weights = np.fromiter(map(self.weight, ids), np.float64, len(ids))
+        shares = np.fromiter((self.context.get(ind, 0.0) for ind in ids), np.float64, len(ids))
+        mass = np.bincount(rows, weights[inverse], n)
+        shared = np.bincount(rows, (weights * shares)[inverse], n)
+
+        total = mass + self.mass
+        scores = np.divide(2 * shared, total, out=np.zeros(n), where=total > 0)
+        if self.novelty:
+            scores *= 1 - np.divide(shared, mass, out=np.zeros(n), where=mass > 0)
+        return scores.tolist()
 
 class BrianModel():
 
@@ -688,9 +2382,23 @@ class BrianModel():
 
     logger = logging.getLogger("BrianCS Model")
 
+    TRAIN_BATCH = 256 #amount of messages train() parses and feeds while holding the lock
+    #approximate memory used per graph node or edge and per token in bytes, measured with tracemalloc (see estimateMemory())
+    NODE_EDGE_MEMORY = {
+        Storage.OBJECT: 940,
+        Storage.COMPACT: 290
+        }
+    TOKEN_MEMORY = 200
+    BULK_BATCH = 1000 #amount of messages trainBulk() accumulates before updating the graphs
+    EVALUATION_TIME = 0.05 #seconds the evaluation stage may spend scoring candidates, see _evaluate()
+    EVALUATION_BATCH = 256 #amount of candidates scored at once
+    CONTEXT_TIMEOUT = 300 #seconds after which the timeout policy has (about) halved the weight of a message
+    SCORE_FLOOR = 0.01 #added to the score of every candidate, so candidates without any overlap can still be chosen
+
     def __init__(self, timeout=Timeout.LOGARITHMIC, dropout=Dropout.LEAST_USED, dropout_curve=DropoutCurve.DECREMENT,
                  message_buffer=2, prediction_time=500, max_predictions=300,
-                 context_bias=0.5, dropout_chance=0.0002, dropout_factor=0.001):
+                 context_bias=0.5, dropout_chance=0.0002, dropout_factor=0.001, storage=Storage.OBJECT,
+                 save_format=ModelFormat.ZIP, dropout_interval=100, dropout_period=300):
 
         """
         Create a new model and initialize it.
@@ -702,6 +2410,13 @@ class BrianModel():
         max_predictions specifies the maximum amount of candidate replies the model should generate before evaluating
         context_bias is the percentage of the votes on reply candidates that is cast by the context awareness algorithm
         dropout_chance specifies the probability of dropout being applied on a state.
+        storage specifies the data structure used to store the models graphs. Storage.COMPACT uses
+            significantly less memory at the cost of slightly slower updates.
+        save_format specifies the default file format used by save().
+        dropout_interval and dropout_period specify how often dropout is performed, see maintain().
+
+        Changes to the model can be recorded in an append only journal (see openJournal()), which allows
+        checkpoint() to persist them without writing a full snapshot of the model.
         """
 
         self.timeout = timeout
@@ -713,6 +2428,14 @@ class BrianModel():
         self.context_bias = context_bias
         self.dropout_chance = dropout_chance
         self.dropout_factor = dropout_factor
+        self.storage = storage
+        self.save_format = save_format
+        self.dropout_interval = dropout_interval
+        self.dropout_period = dropout_period
+
+        self.auto_maintenance = True #run maintain() from observe() and respond() once it is due
+        self.dropout_pending = 0 #messages observed since the last maintenance pass
+        self._lastMaintenance = time.time()
 
         self.conversations = {}
 
@@ -722,29 +2445,236 @@ class BrianModel():
         self.parser = Parser(self.tokenTable)
 
         self.modelOrder = 6
-        self.genForward = MModel(self.modelOrder)
-        self.genBackward = MModel(self.modelOrder)
+        self.genForward = self._createGraph()
+        self.genBackward = self._createGraph()
+
+        self.lock = threading.RLock() #held while the model is used or changed, see snapshot()
+        self._saveLock = threading.Lock()
+
+        self.workers = None
+
+        self.journal = None
+        self.journal_seq = 0 #sequence number of the last journal record included in the model state
+        self.journal_limit = 64 * 2**20 #journal size in bytes after which checkpoint() writes a full snapshot
+
+    def _createGraph(self):
+
+        """
+        Create an empty graph using the configured storage type.
+        """
+
+        if self.storage == Storage.COMPACT:
+            return CompactMModel(self.modelOrder)
+        return MModel(self.modelOrder)
+
+    def setStorage(self, storage):
+
+        """
+        Change the data structure used to store the models graphs.
+        Existing graphs are converted to the new storage type.
+        """
+
+        with self.lock:
+            if storage == self.storage:
+                return
+            self.storage = storage
+
+            graph = self._createGraph()
+            graph.load(io.StringIO(self.genForward.save()))
+            self.genForward = graph
+
+            graph = self._createGraph()
+            graph.load(io.StringIO(self.genBackward.save()))
+            self.genBackward = graph
+
+    def estimateMemory(self):
+
+        """
+        Return a rough estimate of the memory used by this model in bytes.
+        This takes time proportional to the amount of nodes in the graphs.
+        """
+
+        with self.lock:
+            items = sum(len(graph.nodes) + graph.edgeCount() for graph in (self.genForward, self.genBackward))
+            return items * self.NODE_EDGE_MEMORY[self.storage] + len(self.tokenTable.tokens) * self.TOKEN_MEMORY
+
+    def copySettings(self, model):
+
+        """
+        Copy the configuration and blacklist of another model, keeping the state of this model.
+        The change is recorded in the journal if one is open and the configuration or blacklist changed.
+        """
+
+        settings = model._getSettings()
+        with self.lock:
+            previous = (self._getSettings(), self.blacklist)
+            settings["journal_seq"] = self.journal_seq
+            settings["dropout_pending"] = self.dropout_pending
+            self._applySettings(settings, graphs=False)
+            self.genForward.order = self.genBackward.order = self.modelOrder
+            self.setStorage(model.storage)
+            self.save_format = model.save_format
+            self.auto_maintenance = model.auto_maintenance
+            self.blacklist = list(model.blacklist)
+            if (self._getSettings(), self.blacklist) != previous:
+                self.recordSettings()
 
     def train(self, data):
 
         """
         Train the model on the given data.
-        Data should be a list of strings, each denoting its own message.
+        Data should be an iterable of strings, each denoting its own message.
+        Messages are parsed in batches, the model lock is released between batches.
+        """
+
+        data = iter(data)
+        while True:
+            with self.lock:
+                size = len(self.tokenTable.tokens)
+                batch = self.parser.parseMany(itertools.islice(data, self.TRAIN_BATCH))
+                if not batch:
+                    break
+                #all tokens of the batch are recorded before the messages, so replaying the journal adds them first
+                self._recordTokens(itertools.chain.from_iterable(batch), size)
+                for numTokens in batch:
+                    self._feed(numTokens)
+                    self._record({"o": numTokens})
+                    self._maintainIfDue()
+
+    def trainBulk(self, data, batch=BULK_BATCH):
+
+        """
+        Train the model on a large corpus, like an imported chat log.
+        data may be any iterable of strings, e.g. an open file or a generator. It is consumed batch
+        messages at a time, so memory usage does not depend on the size of the corpus.
+        Unlike train(), messages are not observed one by one. The weight changes of a batch are summed
+        up per edge and applied at once, followed by a single maintenance pass (if auto_maintenance is set)
+        that keeps the graphs from growing without bounds. Larger batches are faster, but the dropout pass
+        applies the curve for the whole batch at once and drops more aggressively than train() would.
+        Returns the amount of messages trained on.
         """
 
-        for i in data:
-            self.observe(i)
+        data = iter(data)
+        count = 0
+        while True:
+            with self.lock:
+                size = len(self.tokenTable.tokens)
+                seqs = self.parser.parseMany(itertools.islice(data, batch))
+                if not seqs:
+                    break
+                count += len(seqs)
+                seqs = [seq for seq in seqs if seq]
+                self._recordTokens(itertools.chain.from_iterable(seqs), size)
+                self._feedMany(seqs)
+                self._record({"m": seqs})
+                if self.auto_maintenance:
+                    self.maintain()
+        return count
 
-    def perform_dropout(self, amount):
+    def perform_dropout(self, amount, steps=1):
 
         """
         Reduce the size of the model by dropping states according to the set dropout policy.
+        steps specifies how many times the dropout curve is applied to the edge weights.
         This method can be quite computationally expensive.
         """
 
         self.logger.debug("Performing edge dropout...")
-        self.genForward.dropout(self.dropout, self.dropout_curve, amount, self.dropout_chance)
-        self.genBackward.dropout(self.dropout, self.dropout_curve, amount, self.dropout_chance)
+        forward = self.genForward.dropout(self.dropout, self.dropout_curve, amount, self.dropout_chance, steps)
+        backward = self.genBackward.dropout(self.dropout, self.dropout_curve, amount, self.dropout_chance, steps)
+
+        #the curve changes the weight of every edge, so this has to be recorded even if nothing was dropped
+        self._record({"d": [self.dropout_curve.value, self.dropout_chance, steps], "f": forward, "b": backward})
+
+    def maintenanceDue(self):
+
+        """
+        Check if the maintenance pass should run, i.e. if dropout_interval messages have been
+        observed or dropout_period seconds have passed since the last pass.
+        """
+
+        if not self.dropout_pending:
+            return False
+        return self.dropout_pending >= self.dropout_interval or time.time() - self._lastMaintenance >= self.dropout_period
+
+    def maintain(self):
+
+        """
+        Run the maintenance pass.
+        Dropout is not performed for every message. Instead, the messages observed since the last pass
+        are counted and the dropout curve is applied to all edges once for all of them. The dropout factor
+        is scaled to drop as many edges as dropout would drop when performed for every message.
+        """
+
+        with self.lock:
+            steps = self.dropout_pending
+            if steps:
+                factor = 1 - (1 - min(self.dropout_factor, 1)) ** steps
+                self.perform_dropout(factor, steps)
+                self.dropout_pending = 0
+            self._lastMaintenance = time.time()
+
+    def _maintainIfDue(self):
+
+        if self.auto_maintenance and self.maintenanceDue():
+            self.maintain()
+
+    def _feed(self, numTokens):
+
+        """
+        Train both graphs on a sequence of token IDs.
+        """
+
+        self.genForward.feed(numTokens)
+        self.genBackward.feed(numTokens[::-1])
+        self.dropout_pending += 1
+
+    def _feedMany(self, seqs):
+
+        """
+        Train both graphs on a batch of non empty token ID sequences.
+        """
+
+        self.genForward.feedMany(seqs)
+        self.genBackward.feedMany([seq[::-1] for seq in seqs])
+        self.dropout_pending += len(seqs)
+
+    def _tokenWeight(self):
+
+        """
+        Return a function weighing token IDs by their inverse document frequency.
+        The frequency of a token is approximated by the amount of contexts it has been seen in (see MModel.contextCount()).
+        """
+
+        graph = self.genForward
+        nodes = len(graph.nodes) - 1
+        return lambda ind: math.log(1 + nodes / (1 + graph.contextCount(ind)))
+
+    def _messageWeight(self, age):
+
+        """
+        Return the weight of a message in the conversation buffer that is age seconds old, according to the timeout policy.
+        """
+
+        age = max(age, 0) / self.CONTEXT_TIMEOUT
+        if self.timeout == Timeout.LINEAR:
+            return max(1 - age / 2, 0)
+        if self.timeout == Timeout.EXPONENTIAL:
+            return 0.5 ** age
+        return 1 / (1 + math.log1p(age) / math.log(2))
+
+    def _currentScorer(self, input):
+
+        #candidates repeating the input are penalized, the model would just echo the user otherwise
+        return CandidateScorer([(1, [token.index for token in input])], self._tokenWeight(), novelty=True)
+
+    def _conversationScorer(self, conversation=None):
+
+        now = time.time()
+        references = []
+        for msg in self.conversations.get(conversation, ()) if conversation is not None else ():
+            references.append((self._messageWeight(now - msg.timestamp), [token.index for token in msg.data]))
+        return CandidateScorer(references, self._tokenWeight())
 
     def _evaluate_current(self, candidates, input):
 
@@ -755,7 +2685,7 @@ class BrianModel():
         sequence representing the rating for each response candidate.
         """
 
-        return [1] * len(candidates)
+        return self._currentScorer(input).score(candidates)
 
     def _evaluate_conversation(self, candidates, conversation=None):
 
@@ -766,7 +2696,30 @@ class BrianModel():
         sequence representing the rating for each response candidate.
         """
 
-        return [1] * len(candidates)
+        return self._conversationScorer(conversation).score(candidates)
+
+    def _evaluate(self, candidates, input, conversation=None):
+
+        """
+        Rate candidates by their relevance to the input and the conversation (see CandidateScorer).
+        Candidates are scored in batches until EVALUATION_TIME has passed, remaining candidates are dropped.
+        Returns the scored candidates and their weights.
+        """
+
+        deadline = time.time() + self.EVALUATION_TIME
+        current = self._currentScorer(input)
+        context = self._conversationScorer(conversation)
+        scored = []
+        weights = []
+        for start in range(0, len(candidates), self.EVALUATION_BATCH):
+            if start and time.time() > deadline:
+                self.logger.debug("Evaluation timed out, dropping %i candidates." % (len(candidates) - start))
+                break
+            batch = candidates[start:start+self.EVALUATION_BATCH]
+            for cur, conv in zip(current.score(batch), context.score(batch)):
+                weights.append(conv * self.context_bias + cur * (1 - self.context_bias) + self.SCORE_FLOOR)
+            scored.extend(batch)
+        return scored, weights
 
     def updateConversation(self, tokens, conversation=None, timestamp=None):
 
@@ -800,16 +2753,43 @@ class BrianModel():
         If conversation is not None, it should be a keyword identifying the conversation this message belongs to.
         """
 
-        tokens = self.parser.parse(message)
+        with self.lock:
+            size = len(self.tokenTable.tokens)
+            numTokens = self.parser.parseIDs(message)
+            self._recordTokens(numTokens, size)
 
-        self.updateConversation(tokens, conversation)
+            if conversation is not None:
+                self.updateConversation(self.tokenTable.getTokensByID(numTokens), conversation)
 
-        numTokens = list(map(lambda x: x.index, tokens))
-        self.genForward.feed(numTokens)
-        numTokens.reverse()
-        self.genBackward.feed(numTokens)
+            self._feed(numTokens)
+            self._record({"o": numTokens})
+
+            self._maintainIfDue()
+
+    def observeMany(self, messages):
 
-        self.perform_dropout(self.dropout_factor)
+        """
+        Observe a batch of messages, given as an iterable of (message, conversation) pairs.
+        This has the same effect as calling observe() for every message, but the batch is parsed, applied and
+        recorded in the journal at once (see trainBulk()), followed by a single maintenance check.
+        """
+
+        messages = list(messages)
+        with self.lock:
+            size = len(self.tokenTable.tokens)
+            batch = self.parser.parseMany(message for message, conversation in messages)
+            self._recordTokens(itertools.chain.from_iterable(batch), size)
+
+            for numTokens, (message, conversation) in zip(batch, messages):
+                if conversation is not None:
+                    self.updateConversation(self.tokenTable.getTokensByID(numTokens), conversation)
+
+            seqs = [numTokens for numTokens in batch if numTokens]
+            if seqs:
+                self._feedMany(seqs)
+                self._record({"m": seqs})
+
+            self._maintainIfDue()
 
     def generate(self, token):
 
@@ -817,12 +2797,43 @@ class BrianModel():
         Generate a candidate reply.
         """
 
+        return self._generate(token.index)
+
+    def _generate(self, ind):
+
         #generate reply sequence
-        tail = self.genForward.getSequence(self.genForward.findNodeForArgs([token.index]))
+        tail = self.genForward.getSequence(self.genForward.findNodeForArgs([ind]))
         args = tail[:self.modelOrder-1]
-        head = self.genBackward.getSequence(self.genBackward.findNodeForArgs([*args[::-1], token.index]))
+        head = self.genBackward.getSequence(self.genBackward.findNodeForArgs([*args[::-1], ind]))
         head.reverse() #make sure to reverse since the returned sequence is generated backwards
-        return head + [token.index] + tail
+        return head + [ind] + tail
+
+    def _generateCandidates(self, seeds, duration, limit, refill=None):
+
+        """
+        Generate up to limit candidate replies within duration seconds.
+        seeds is a list of token IDs to start generating from. Seeds that can't be used to generate
+        a reply are removed from the list. If refill is not None, it is called to obtain a new seed
+        once the list is empty, otherwise generation stops early.
+        """
+
+        startTime = time.time()
+        results = []
+        while time.time() - startTime < duration:
+            if not seeds:
+                if refill is None:
+                    break
+                seeds.append(refill())
+            ind = random.choice(seeds)
+            try:
+                results.append(self._generate(ind))
+            except ValueError as e:
+                self.logger.debug("Removing token %i from seed: %s" % (ind, str(e)))
+                seeds.remove(ind)
+                continue
+            if len(results) >= limit:
+                break
+        return results
 
     def filter(self, tokens):
 
@@ -855,50 +2866,206 @@ class BrianModel():
         If conversation is not None, it should be a keyword identifying the conversation this message belongs to.
         """
 
-        #Do tokenizing, parsing and filtering
-        tokens = self.parser.parse(message)
-        numTokens = list(map(lambda x: x.index, tokens))
-        tokens = self.filter(tokens)
-        if not tokens:
-            tokens.append(self.tokenTable.getRandom())
+        with self.lock:
+            #Do tokenizing, parsing and filtering
+            size = len(self.tokenTable.tokens)
+            numTokens = self.parser.parseIDs(message)
+            self._recordTokens(numTokens, size)
+            tokens = self.filter(self.tokenTable.getTokensByID(numTokens))
+            if not tokens:
+                tokens.append(self.tokenTable.getRandom())
+
+            #Generate replies
+            startTime = time.time()
+            results = []
+            self.logger.debug("Generating responses...")
+            if self.workers is not None:
+                try:
+                    results = self.workers.generate([token.index for token in tokens], self.prediction_time/1000, self.max_predictions)
+                except (OSError, EOFError) as e:
+                    self.logger.error("Generator workers failed, falling back to local generation: %s" % str(e))
+                    self.stopWorkers()
+            if not results:
+                #none of the seeds produced a reply (or there are no workers), continue with random seeds if necessary
+                refill = lambda: self.tokenTable.getRandom().index
+                results = self._generateCandidates([token.index for token in tokens], self.prediction_time/1000, self.max_predictions, refill)
+
+            self.logger.debug("Evaluating responses...")
+            results, final_w = self._evaluate(results, tokens, conversation)
+
+            c = random.choices(results, weights=final_w, k=1)[0] #choose final candidate based on evaluation
+            result = self.parser.build(c)
+
+            #Train models
+            self._feed(numTokens)
+            self._record({"o": numTokens})
+
+            self._maintainIfDue()
+
+            return result
+
+    def _record(self, record):
 
-        #Generate replies
-        startTime = time.time()
-        results = []
-        self.logger.debug("Generating responses...")
-        while time.time() - startTime < self.prediction_time/1000:
-            token = random.choice(tokens)
-            try:
-                results.append(self.generate(token))
-            except ValueError as e:
-                self.logger.debug("Removing token %s from seed: %s" % (token.name, str(e)))
-                tokens.remove(token)
-                if not tokens:
-                    tokens.append(self.tokenTable.getRandom())
+        """
+        Append a record to the journal, if one is open, and forward it to the generator workers.
+        """
+
+        if self.journal is not None:
+            self.journal_seq = self.journal.append(record)
+        if self.workers is not None:
+            self.workers.update(record)
+
+    def startWorkers(self, count=PROCESS_COUNT):
+
+        """
+        Start count worker processes that generate reply candidates in parallel.
+        Each worker holds its own copy of the models graphs, which means memory usage grows with the amount of workers.
+        """
+
+        with self.lock:
+            self.stopWorkers()
+            if count > 0:
+                self.workers = GeneratorPool(self, count)
+
+    def stopWorkers(self):
+
+        """
+        Stop all generator workers.
+        """
+
+        with self.lock:
+            if self.workers is not None:
+                self.workers.close()
+                self.workers = None
+
+    def _recordTokens(self, numTokens, size):
+
+        """
+        Record all tokens in the ID sequence numTokens with an ID of at least size, i.e. tokens added after the
+        table had size slots. Tokens are recorded right after parsing, so later records can refer to them even
+        if generating a reply fails.
+        """
+
+        new = sorted({ind for ind in numTokens if ind >= size})
+        if new:
+            self._record({"t": [[token.name, token.type.value, token.tag.value] for token in self.tokenTable.getTokensByID(new)]})
+
+    def recordSettings(self):
+
+        """
+        Record the current configuration and blacklist in the journal.
+        This should be called after changing model parameters while a journal is open.
+        """
+
+        self._record({"s": self._getSettings(), "l": self.blacklist})
+
+    def _replay(self, record):
+
+        """
+        Apply a journal record to the model.
+        """
+
+        if "t" in record:
+            for name, type, tag in record["t"]:
+                self.tokenTable.addToken(name, TokenTypes(type), Tags(tag))
+        elif "o" in record:
+            self._feed(record["o"])
+        elif "m" in record:
+            self._feedMany(record["m"])
+        elif "d" in record:
+            curve, threshold, *steps = record["d"]
+            steps = steps[0] if steps else 1
+            curve = DropoutCurve(curve)
+            for graph, dropped in ((self.genForward, record["f"]), (self.genBackward, record["b"])):
+                graph._weighEdges(curve, threshold, steps)
+                graph.dropEdges(map(tuple, dropped))
+            self.dropout_pending = 0
+        elif "s" in record:
+            storage = Storage(record["s"].get("storage", self.storage.value))
+            self._applySettings(record["s"], graphs=False)
+            self.genForward.order = self.genBackward.order = self.modelOrder
+            self.setStorage(storage)
+            self.blacklist = list(record["l"])
+        else:
+            self.logger.warning("Ignoring unknown journal record %i." % record["n"])
+
+    def openJournal(self, path):
+
+        """
+        Open the journal at path and record all subsequent changes to the model in it.
+        Records that are not yet part of the model (i.e. that were added after the model was last saved)
+        are replayed first, which restores the state the model was in when the journal was last synced.
+        Returns the amount of replayed records.
+        """
+
+        self.closeJournal()
+
+        replayed = 0
+        for record in Journal.read(path):
+            if record["n"] <= self.journal_seq:
                 continue
-            if len(results) >= self.max_predictions:
-                break
+            self._replay(record)
+            self.journal_seq = record["n"]
+            replayed += 1
 
-        #TODO: Implement evaluation stage
-        self.logger.debug("Evaluating responses...")
-        current_w = self._evaluate_current(results, tokens)
-        conv_w = self._evaluate_conversation(results, conversation)
-        final_w = []
-        for i in range(len(results)):
-            v = conv_w[i] * self.context_bias + current_w[i] * (1 - self.context_bias)
-            final_w.append(v)
+        if replayed:
+            self.logger.info("Replayed %i journal record(s)." % replayed)
+        self.journal = Journal(path, self.journal_seq)
+        return replayed
 
-        c = random.choices(results, weights=final_w, k=1)[0] #choose final candidate based on evaluation
-        result = self.parser.build(c)
+    def closeJournal(self):
 
-        #Train models
-        self.genForward.feed(numTokens)
-        numTokens.reverse()
-        self.genBackward.feed(numTokens)
+        """
+        Sync and close the journal, if one is open.
+        """
 
-        self.perform_dropout(self.dropout_factor)
+        if self.journal is not None:
+            self.journal.sync()
+            self.journal.close()
+            self.journal = None
 
-        return result
+    def compact(self, path, format=None):
+
+        """
+        Save a full snapshot of the model to path and remove the records it includes from the journal.
+        The model is only locked while the snapshot is captured and while the journal is truncated,
+        so this may run in a worker thread without blocking other users of the model.
+        """
+
+        if format is None:
+            format = self.save_format
+
+        with self._saveLock:
+            with self.lock:
+                snapshot = self.snapshot()
+                journal = self.journal
+                size = journal.size() if journal is not None else None
+
+            snapshot.write(path, format)
+
+            #records made while the snapshot was written are not part of it and have to be kept.
+            #If another journal was opened in the meantime, it does not belong to the snapshot.
+            with self.lock:
+                if journal is not None and journal is self.journal:
+                    journal.truncate(size)
+
+        self.logger.info("Backup complete!")
+
+    def checkpoint(self, path, format=None):
+
+        """
+        Make all changes to the model durable.
+        If a journal is open, this only syncs the journal to disk, which is proportional to the amount of changes
+        made since the last checkpoint. Once the journal grows beyond journal_limit bytes, it is compacted into
+        a full snapshot at path instead.
+        Without a journal, this is the same as save().
+        """
+
+        with self.lock:
+            if self.journal is not None and self.journal.size() < self.journal_limit:
+                self.journal.sync()
+                return
+        self.compact(path, format)
 
     def loadBlacklist(self, f):
 
@@ -943,20 +3110,37 @@ class BrianModel():
 
         return "\n".join(self.blacklist)
 
-    def load(self, path):
+    def _getSettings(self):
 
         """
-        Load a model from a file.
+        Return the model configuration as a dictionary (stored as model.json).
         """
 
-        self.logger.info("Loading model configuration...")
+        return {
+            "timeout": self.timeout.value,
+            "dropout": self.dropout.value,
+            "message_buffer": self.message_buffer,
+            "prediction_time": self.prediction_time,
+            "max_predictions": self.max_predictions,
+            "context_bias": self.context_bias,
+            "dropout_chance": self.dropout_chance,
+            "model_order": self.modelOrder,
+            "dropout_curve": self.dropout_curve.value,
+            "dropout_factor": self.dropout_factor,
+            "storage": self.storage.value,
+            "journal_seq": self.journal_seq,
+            "dropout_interval": self.dropout_interval,
+            "dropout_period": self.dropout_period,
+            "dropout_pending": self.dropout_pending
+            }
+
+    def _applySettings(self, d, graphs=True):
+
+        """
+        Apply a model configuration dictionary, as returned by _getSettings().
+        If graphs is True, the graphs are replaced by empty graphs of the configured storage type.
+        """
 
-        try:
-            f = zipfile.ZipFile(path)
-        except OSError as e:
-            self.logger.error("Loading model failed: %s" % str(e))
-            return
-        d = json.load(f.open("model.json"))
         self.timeout = Timeout(d["timeout"])
         self.dropout = Dropout(d["dropout"])
         self.message_buffer = d["message_buffer"]
@@ -967,11 +3151,54 @@ class BrianModel():
         self.modelOrder = d.get("model_order", 4)
         self.dropout_factor = d.get("dropout_factor", self.dropout_factor)
         self.dropout_curve = DropoutCurve(d.get("dropout_curve", self.dropout_curve.value))
+        self.dropout_interval = d.get("dropout_interval", self.dropout_interval)
+        self.dropout_period = d.get("dropout_period", self.dropout_period)
+        self.dropout_pending = d.get("dropout_pending", 0)
+
+        if graphs:
+            self.storage = Storage(d.get("storage", self.storage.value))
+            self.journal_seq = d.get("journal_seq", 0)
+            self.genForward = self._createGraph()
+            self.genBackward = self._createGraph()
+
+    def load(self, path):
+
+        """
+        Load a model from a file.
+        Both zip archives and binary model files are supported, the format is detected automatically.
+        Subsequent calls to save() will use the format of the loaded file unless specified otherwise.
+        """
+
+        self.logger.info("Loading model configuration...")
+
+        try:
+            isBinary = binary.isBinaryFile(path)
+        except OSError as e:
+            self.logger.error("Loading model failed: %s" % str(e))
+            return
+
+        with self.lock:
+            if isBinary:
+                self._loadBinary(path)
+                self.save_format = ModelFormat.BINARY
+            else:
+                self._loadZip(path)
+                self.save_format = ModelFormat.ZIP
+
+            if self.workers is not None:
+                #the workers still hold the old graphs
+                self.startWorkers(self.workers.count)
+
+        self.logger.info("Loading complete!")
+
+    def _loadZip(self, path):
+
+        f = zipfile.ZipFile(path)
+        d = json.load(f.open("model.json"))
+        self._applySettings(d)
 
         self.tokenTable.load(f.open("table.dat"))
 
-        self.genForward.order = self.modelOrder
-        self.genBackward.order = self.modelOrder
         self.genForward.load(f.open("model1.dat"))
         self.genBackward.load(f.open("model2.dat"))
 
@@ -982,41 +3209,63 @@ class BrianModel():
         except KeyError:
             pass
 
-        self.logger.info("Loading complete!")
+    def _loadBinary(self, path):
+
+        #sections are read from the mapped file in place. Compact graphs keep using them until they are changed,
+        #which keeps the mapping alive after the reader is closed.
+        with binary.BinaryReader(path) as f:
+            d = json.loads(f.bytes("config"))
+            self._applySettings(d)
 
-    def save(self, path):
+            self.tokenTable.loadArrays(f.views("tokens."))
+
+            self.genForward.loadArrays(f.views("forward."))
+            self.genBackward.loadArrays(f.views("backward."))
+
+            if "blacklist" in f:
+                self.loadBlacklist(io.StringIO(f.bytes("blacklist").decode()))
+
+    def snapshot(self):
 
         """
-        Save this model to a file.
+        Capture the current state of the model and return it as a ModelSnapshot.
+        The model is locked while its state is copied, which is considerably faster than serializing it.
+        The snapshot can then be written from a different thread while the model keeps working.
         """
 
-        f = zipfile.ZipFile(path, "w")
+        with self.lock:
+            if self.journal is not None:
+                self.journal_seq = self.journal.seq
+            if os.name == "nt":
+                #mapped files can not be replaced on windows, so graphs loaded from the file the snapshot may replace are copied
+                for graph in (self.genForward, self.genBackward):
+                    if isinstance(graph, CompactMModel):
+                        graph._unmap()
+            return ModelSnapshot(self._getSettings(), list(self.blacklist), self.tokenTable.saveArrays(),
+                                 self.genForward.saveArrays(), self.genBackward.saveArrays())
 
-        #Settings (model.json)
-        d = {
-            "timeout": self.timeout.value,
-            "dropout": self.dropout.value,
-            "message_buffer": self.message_buffer,
-            "prediction_time": self.prediction_time,
-            "max_predictions": self.max_predictions,
-            "context_bias": self.context_bias,
-            "dropout_chance": self.dropout_chance,
-            "model_order": self.modelOrder,
-            "dropout_curve": self.dropout_curve.value,
-            "dropout_factor": self.dropout_factor
-            }
-        self.logger.info("Saving model configuration...")
-        f.writestr("model.json", json.dumps(d, indent=4))
+    def save(self, path, format=None):
 
-        #Token table
-        f.writestr("table.dat", self.tokenTable.save())
+        """
+        Save this model to a file.
+        format specifies the file format as a ModelFormat. If it is None, the format of the
+        last loaded file is used (zip archives by default).
+        The file is replaced atomically, see ModelSnapshot.write().
+        """
 
-        #Models
-        f.writestr("model1.dat", self.genForward.save())
-        f.writestr("model2.dat", self.genBackward.save())
+        if format is None:
+            format = self.save_format
 
-        #Blacklist
-        f.writestr("blacklist.txt", self.saveBlacklist())
+        self.snapshot().write(path, format)
 
-        f.close()
         self.logger.info("Backup complete!")
+
+def convert(source, destination, format=ModelFormat.BINARY):
+
+    """
+    Convert the model file at source to the specified format and save it at destination.
+    """
+
+    model = BrianModel()
+    model.load(source)
+    model.save(destination, format)
@@ -0,0 +1,459 @@
+#BrianCS Conversation Simulator
+#
+#Author: fredi_68
+#
+#Model server process.
+
+#Model work is pure Python and holds the GIL, so running it in a thread
+#pool still starves the event loop of the bot while a reply is generated.
+#ModelServer runs a BrianModel in a dedicated child process instead and
+#talks to it over a socket, similar to the MegaHAL wrapper in chatbot.py.
+#
+#Every frame on the socket is a JSON object prefixed with its length as a
+#4 byte big endian integer. Requests carry an ID, a command and its
+#arguments, the server answers every request with a response carrying the
+#same ID, in the order the requests were sent. Up to max_pending requests
+#may be in flight at the same time, which keeps the server busy without
+#waiting for a round trip between requests. Once all slots are taken,
+#callers wait for a response before their request is sent.
+#
+#Observed messages are buffered and sent along with the next request, or
+#on their own once a slot is free. Messages observed while all slots are
+#taken are coalesced into a single request. The server applies them
+#before the command of the request, so replies always see all messages
+#observed before them.
+
+import json
+import struct
+import socket
+import asyncio
+import threading
+import logging
+import multiprocessing
+
+from .model import BrianModel
+from .enums import ModelFormat
+
+HEADER = struct.Struct(">I")
+
+def getConfig(model):
+
+    """
+    Return the configuration and blacklist of a model as a JSON serializable dictionary.
+    """
+
+    return {"s": model._getSettings(), "l": list(model.blacklist), "f": model.save_format.value}
+
+def applyConfig(model, config):
+
+    """
+    Apply a configuration dictionary, as returned by getConfig(), to an empty model.
+    Use BrianModel.copySettings() to configure a model that holds state.
+    """
+
+    model._applySettings(config["s"])
+    model.blacklist = list(config["l"])
+    model.save_format = ModelFormat(config["f"])
+
+class _ModelHost():
+
+    """
+    The model owned by a server process.
+    """
+
+    logger = logging.getLogger("BrianCS Server")
+
+    def __init__(self, path, journal, workers=0):
+
+        self.path = path
+        self.journal = journal
+        self.model = BrianModel()
+        self._maintenance = None
+        self.load()
+        if workers > 0:
+            self.model.startWorkers(workers)
+
+    def load(self, path=None):
+
+        self._waitMaintenance()
+        if not path:
+            self.model.load(self.path)
+            self.model.openJournal(self.journal)
+        else:
+            #the backup replaces the current state, which makes the journal obsolete
+            self.model.load(path)
+            self.model.compact(self.path)
+        self.model.auto_maintenance = False #dropout runs in the background, see _scheduleMaintenance()
+        return getConfig(self.model)
+
+    def save(self, path=None):
+
+        if not path:
+            self.model.checkpoint(self.path)
+        else:
+            self.model.save(path)
+
+    def configure(self, config):
+
+        template = BrianModel()
+        applyConfig(template, config)
+        template.auto_maintenance = False
+        self.model.copySettings(template)
+
+    def _scheduleMaintenance(self):
+
+        if self._maintenance is not None and self._maintenance.is_alive():
+            return
+        if self.model.maintenanceDue():
+            self._maintenance = threading.Thread(target=self._maintain, daemon=True)
+            self._maintenance.start()
+
+    def _maintain(self):
+
+        try:
+            self.model.maintain()
+        except Exception:
+            self.logger.exception("Model maintenance failed.")
+
+    def _waitMaintenance(self):
+
+        if self._maintenance is not None:
+            self._maintenance.join()
+            self._maintenance = None
+
+    def handle(self, request):
+
+        """
+        Apply the observed messages of a request and execute its command.
+        """
+
+        observed = request.get("o")
+        if observed:
+            self.model.observeMany(observed)
+
+        cmd = request["c"]
+        args = request["a"]
+        result = None
+        if cmd == "respond":
+            result = self.model.respond(*args)
+        elif cmd == "save":
+            self.save(*args)
+        elif cmd == "load":
+            result = self.load(*args)
+        elif cmd == "configure":
+            self.configure(*args)
+        elif cmd not in ("observe", "stop"):
+            raise NotImplementedError("Unknown command %s" % cmd)
+
+        self._scheduleMaintenance()
+        return result
+
+    def close(self):
+
+        self._waitMaintenance()
+        self.model.stopWorkers()
+        self.model.closeJournal()
+
+def _readFrame(f):
+
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    return json.loads(f.read(HEADER.unpack(header)[0]))
+
+def _writeFrame(f, frame):
+
+    data = json.dumps(frame, separators=(",", ":")).encode()
+    f.write(HEADER.pack(len(data)) + data)
+    f.flush()
+
+def _serverMain(sock, path, journal, workers):
+
+    """
+    Main function of the server process, see ModelServer.
+    """
+
+    logging.basicConfig(level=logging.INFO)
+    f = sock.makefile("rwb")
+    try:
+        host = _ModelHost(path, journal, workers)
+        _writeFrame(f, {"i": 0, "r": getConfig(host.model)})
+    except Exception as e:
+        _ModelHost.logger.exception("Starting the model server failed.")
+        _writeFrame(f, {"i": 0, "e": "%s: %s" % (type(e).__name__, str(e))})
+        return
+
+    response = None
+    while True:
+        try:
+            request = _readFrame(f)
+        except (OSError, ValueError):
+            break
+        if request is None:
+            break
+        try:
+            response = {"i": request["i"], "r": host.handle(request)}
+        except Exception as e:
+            _ModelHost.logger.exception("Request '%s' failed." % request["c"])
+            response = {"i": request["i"], "e": "%s: %s" % (type(e).__name__, str(e))}
+        if request["c"] == "stop":
+            break #answered once the journal is closed
+        try:
+            _writeFrame(f, response)
+        except OSError:
+            break
+        response = None
+
+    host.close()
+    if response is not None:
+        _writeFrame(f, response)
+    f.close()
+    sock.close()
+
+class ModelServer():
+
+    """
+    A BrianModel running in a child process, see the comment at the top of this module.
+
+    The model is loaded from path when the process starts, and its changes are recorded in the journal at journal.
+    If workers is greater than 0, the server process starts as many generator workers (see BrianModel.startWorkers()).
+
+    template is a BrianModel holding the configuration and blacklist of the served model. It is updated
+    when the server process has loaded its model and after load(). Changes to the template are applied to the
+    served model using configure().
+
+    All coroutines of this class must be called from the same event loop. The connection to the server
+    process is established by the first call, or explicitly using start().
+    """
+
+    logger = logging.getLogger("BrianCS Server")
+
+    def __init__(self, path, journal, template=None, workers=0, max_pending=4, max_observe=256):
+
+        """
+        max_pending is the amount of requests that may be in flight at the same time.
+        max_observe is the amount of observed messages that may be buffered. observe() waits until
+        buffered messages have been sent once the buffer is full.
+        """
+
+        self.template = template if template is not None else BrianModel()
+        self.max_pending = max_pending
+        self.max_observe = max_observe
+
+        self._sock, child = socket.socketpair()
+        ctx = multiprocessing.get_context("spawn") #forking would copy the locks held by other threads
+        self.process = ctx.Process(target=_serverMain, args=(child, path, journal, workers), daemon=True)
+        self.process.start()
+        child.close()
+
+        self._starting = None
+        self._reader = None
+        self._writer = None
+        self._closed = False
+        self._requests = {} #futures of requests in flight by request ID
+        self._nextID = 0
+        self._observed = [] #buffered messages, sent along with the next request
+
+    async def _readFrame(self):
+
+        header = await self._reader.readexactly(HEADER.size)
+        return json.loads(await self._reader.readexactly(HEADER.unpack(header)[0]))
+
+    def _error(self, response):
+
+        """
+        Return the exception for a failed request, or None if the request succeeded.
+        The exception is not raised here, since raising it in _receive() would tie its traceback to the receiver.
+        """
+
+        if "e" in response:
+            return RuntimeError("Model server request failed: %s" % response["e"])
+        return None
+
+    async def _start(self):
+
+        self._reader, self._writer = await asyncio.open_connection(sock=self._sock)
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._space = asyncio.Event() #set while the observe buffer is not full
+        self._space.set()
+        self._wake = asyncio.Event() #set when messages are buffered
+
+        try:
+            response = await self._readFrame()
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Model server process exited during startup.")
+        error = self._error(response)
+        if error is not None:
+            raise error
+        applyConfig(self.template, response["r"])
+
+        loop = asyncio.get_running_loop()
+        self._receiver = loop.create_task(self._receive())
+        self._flusher = loop.create_task(self._flush())
+
+    async def start(self):
+
+        """
+        Connect to the server process and wait until it has loaded the model.
+        """
+
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+        await self._starting
+
+    def _write(self, cmd, args=()):
+
+        """
+        Send a request along with all buffered messages.
+        A slot must have been acquired, it is released once the response arrives.
+        Returns a future resolving to the response.
+        """
+
+        self._nextID += 1
+        frame = {"i": self._nextID, "c": cmd, "a": list(args)}
+        if self._observed:
+            frame["o"] = self._observed
+            self._observed = []
+            self._space.set()
+
+        data = json.dumps(frame, separators=(",", ":")).encode()
+        self._writer.write(HEADER.pack(len(data)) + data)
+        future = asyncio.get_running_loop().create_future()
+        self._requests[self._nextID] = future
+        return future
+
+    async def _acquire(self):
+
+        await self._slots.acquire()
+        if self._closed:
+            self._slots.release()
+            raise ConnectionError("Model server process has exited.")
+
+    async def _receive(self):
+
+        while True:
+            try:
+                response = await self._readFrame()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            future = self._requests.pop(response["i"])
+            self._slots.release()
+            if future.done(): #the caller was cancelled
+                continue
+            error = self._error(response)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(response["r"])
+
+        self._closed = True
+        for future in self._requests.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Model server process has exited."))
+        self._requests.clear()
+        self._space.set()
+        #wake up everyone waiting for a slot, they will find the connection closed
+        for i in range(self.max_pending):
+            self._slots.release()
+        if self._observed:
+            self.logger.warning("Dropping %i observed message(s), the model server process has exited." % len(self._observed))
+            self._observed = []
+
+    async def _flush(self):
+
+        """
+        Send buffered messages that are not picked up by another request.
+        Messages observed while waiting for a slot are coalesced into a single request.
+        """
+
+        while not self._closed:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                await self._acquire()
+            except ConnectionError:
+                break
+            if not self._observed: #sent along with another request in the meantime
+                self._slots.release()
+                continue
+            future = self._write("observe")
+            try:
+                await self._writer.drain()
+                await future
+            except Exception:
+                self.logger.exception("Observing messages failed.")
+
+    async def request(self, cmd, *args):
+
+        """
+        Send a request to the server process and return its result.
+        RuntimeError is raised if the request failed, ConnectionError if the server process has exited.
+        """
+
+        await self.start()
+        await self._acquire()
+        future = self._write(cmd, args)
+        await self._writer.drain()
+        return await future
+
+    async def observe(self, message, conversation=None):
+
+        """
+        Observe a message (see BrianModel.observe()).
+        This returns once the message is buffered, it is applied before any request made afterwards.
+        """
+
+        await self.start()
+        while len(self._observed) >= self.max_observe and not self._closed:
+            self._space.clear()
+            await self._space.wait()
+        if self._closed:
+            raise ConnectionError("Model server process has exited.")
+        self._observed.append([message, conversation])
+        self._wake.set()
+
+    async def respond(self, message, conversation=None):
+
+        return await self.request("respond", message, conversation)
+
+    async def save(self, path=None):
+
+        """
+        Make the changes to the model durable (see BrianModel.checkpoint()), or save a backup to path.
+        """
+
+        await self.request("save", path)
+
+    async def load(self, path=None):
+
+        """
+        Reload the model from its snapshot and journal, or replace it with the backup at path.
+        The template is updated with the configuration of the loaded model.
+        """
+
+        applyConfig(self.template, await self.request("load", path))
+
+    async def configure(self):
+
+        """
+        Apply the configuration of the template to the served model.
+        """
+
+        await self.request("configure", getConfig(self.template))
+
+    async def close(self):
+
+        """
+        Stop the server process. The journal is synced and closed.
+        """
+
+        if self._starting is not None and not self._closed:
+            try:
+                await self.request("stop")
+            except ConnectionError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            self._sock.close()
+        await asyncio.get_running_loop().run_in_executor(None, self.process.join)
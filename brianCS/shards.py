@@ -0,0 +1,258 @@
+#BrianCS Conversation Simulator
+#
+#Author: fredi_68
+#
+#Sharded models.
+
+#A bot that is part of many guilds may not want them to share a single
+#model. ModelShards keeps one model per shard key (a guild or a group of
+#guilds), each stored as its own snapshot and journal. Shards are loaded
+#when they are first used and kept in memory in least recently used
+#order. Once the estimated memory usage of all loaded shards exceeds the
+#memory budget, the least recently used shards are compacted into their
+#snapshot files and unloaded.
+
+import os
+import re
+import threading
+import logging
+import collections
+
+from .model import BrianModel
+from .enums import ModelFormat
+
+class ModelShards():
+
+    """
+    A collection of BrianModel instances, one per shard key.
+
+    template is a BrianModel whose configuration and blacklist are applied to every shard when it is
+    loaded (see BrianModel.copySettings()). Changes to the template can be applied to all loaded shards
+    using configure().
+
+    Shards are pinned while they are in use (see use()), pinned shards are never unloaded.
+    This class is thread safe. Loading and unloading shards happens while the collection is locked.
+    """
+
+    logger = logging.getLogger("BrianCS Shards")
+
+    def __init__(self, directory, memory_budget=512 * 2**20, template=None):
+
+        """
+        directory is the directory the shards are stored in. Each shard is stored as <key>.zip or <key>.bin,
+        depending on the save format of the template, along with a journal in <key>.journal.
+        memory_budget is the amount of memory in bytes the loaded shards may use, as estimated by
+        BrianModel.estimateMemory(). The most recently used shard is always kept in memory, even if it
+        exceeds the budget on its own.
+        """
+
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.template = template if template is not None else BrianModel()
+
+        self._shards = collections.OrderedDict() #loaded shards in least recently used order
+        self._sizes = {} #estimated memory usage of loaded shards, updated when they are loaded, changed or checkpointed
+        self._pins = collections.Counter()
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+
+        """
+        Return the snapshot and journal paths of a shard.
+        An existing snapshot is used even if its format differs from the save format of the template.
+        """
+
+        name = re.sub(r"[^0-9A-Za-z_\-]", "_", str(key))
+        base = os.path.join(self.directory, name)
+        snapshot = base + (".bin" if self.template.save_format == ModelFormat.BINARY else ".zip")
+        for ext in (".zip", ".bin"):
+            if os.path.exists(base + ext):
+                snapshot = base + ext
+                break
+        return snapshot, base + ".journal"
+
+    def _load(self, key):
+
+        snapshot, journal = self._paths(key)
+        model = BrianModel()
+        if os.path.exists(snapshot):
+            self.logger.info("Loading shard '%s'..." % str(key))
+            model.load(snapshot)
+        model.openJournal(journal)
+        model.copySettings(self.template)
+        return model
+
+    def _unload(self, key):
+
+        model = self._shards.pop(key)
+        self._sizes.pop(key, None)
+        self.logger.info("Unloading shard '%s'..." % str(key))
+        snapshot, journal = self._paths(key)
+        model.compact(snapshot)
+        model.closeJournal()
+        model.stopWorkers()
+
+    def _evict(self, keep=None):
+
+        """
+        Unload the least recently used shards that are not pinned until the loaded shards fit into the memory budget.
+        """
+
+        for key in list(self._shards):
+            if sum(self._sizes.values()) <= self.memory_budget:
+                break
+            if key == keep or self._pins[key]:
+                continue
+            self._unload(key)
+
+    def get(self, key):
+
+        """
+        Return the model of a shard, loading it if necessary.
+        The shard is not pinned, use use() if the model is used for more than a quick lookup.
+        """
+
+        with self._lock:
+            model = self._shards.get(key)
+            if model is not None:
+                self._shards.move_to_end(key)
+                return model
+
+            model = self._load(key)
+            self._shards[key] = model
+            self._sizes[key] = model.estimateMemory()
+            self._evict(keep=key)
+            return model
+
+    def use(self, key, resize=False):
+
+        """
+        Return a context manager that pins a shard while it is in use and returns its model.
+        If resize is True, the memory usage of the shard is estimated again once it is unpinned,
+        which should be done if the shard is changed.
+        """
+
+        return _ShardUse(self, key, resize)
+
+    def pin(self, key):
+
+        with self._lock:
+            model = self.get(key)
+            self._pins[key] += 1
+            return model
+
+    def unpin(self, key, resize=False):
+
+        with self._lock:
+            if resize and key in self._shards:
+                self._sizes[key] = self._shards[key].estimateMemory()
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+                #the shard may have been skipped by _evict() while it was pinned
+                self._evict(keep=next(reversed(self._shards), None))
+
+    def loaded(self):
+
+        """
+        Return a list of the keys of all loaded shards, least recently used first.
+        """
+
+        with self._lock:
+            return list(self._shards)
+
+    def observe(self, key, message, conversation=None):
+
+        with self.use(key, resize=True) as model:
+            model.observe(message, conversation)
+
+    def observeMany(self, key, messages):
+
+        with self.use(key, resize=True) as model:
+            model.observeMany(messages)
+
+    def respond(self, key, message, conversation=None):
+
+        with self.use(key) as model:
+            return model.respond(message, conversation)
+
+    def maintenanceDue(self, key):
+
+        """
+        Check if the maintenance pass of a shard is due. Shards that are not loaded are never due.
+        """
+
+        with self._lock:
+            model = self._shards.get(key)
+            return model is not None and model.maintenanceDue()
+
+    def maintain(self, key):
+
+        """
+        Run the maintenance pass of a shard if it is loaded and due.
+        """
+
+        with self._lock:
+            if not key in self._shards:
+                return
+            model = self.pin(key)
+        try:
+            if model.maintenanceDue():
+                model.maintain()
+        finally:
+            self.unpin(key, resize=True)
+
+    def configure(self):
+
+        """
+        Apply the configuration of the template to all loaded shards.
+        This should be called after changing the template.
+        """
+
+        with self._lock:
+            for model in self._shards.values():
+                model.copySettings(self.template)
+
+    def checkpoint(self):
+
+        """
+        Make the changes to all loaded shards durable (see BrianModel.checkpoint()).
+        The memory usage estimates are updated as well, which may cause shards to be unloaded.
+        """
+
+        with self._lock:
+            for key, model in list(self._shards.items()):
+                snapshot, journal = self._paths(key)
+                model.checkpoint(snapshot)
+                self._sizes[key] = model.estimateMemory()
+            self._evict(keep=next(reversed(self._shards), None))
+
+    def close(self):
+
+        """
+        Unload all shards that are not pinned.
+        """
+
+        with self._lock:
+            for key in list(self._shards):
+                if not self._pins[key]:
+                    self._unload(key)
+
+class _ShardUse():
+
+    def __init__(self, shards, key, resize):
+
+        self.shards = shards
+        self.key = key
+        self.resize = resize
+
+    def __enter__(self):
+
+        return self.shards.pin(self.key)
+
+    def __exit__(self, exc_type, exc_value, tb):
+
+        self.shards.unpin(self.key, self.resize)
+        return False
@@ -0,0 +1,349 @@
+#BrianCS model benchmarks
+#
+#These are not unit tests and are not collected by the test runner.
+#Run them from the repository root, for example:
+#
+#   python -m brianCS.tests.bench_model memory
+
+import argparse
+import time
+import tracemalloc
+import random
+import os
+import tempfile
+import multiprocessing
+import asyncio
+
+try: #resource is only available on unix systems
+    import resource
+except ImportError:
+    resource = None
+
+from .. import model, server
+from ..enums import Storage, ModelFormat
+
+TRAINING_DATA = "brianCS/training/megahal.trn"
+
+def load_training_data():
+
+    with open(TRAINING_DATA) as f:
+        return [l.lower() for l in f.readlines()]
+
+def bench_memory(args):
+
+    """
+    Compare the memory used by the object graph and the compact graph after training on megahal.trn.
+    """
+
+    data = load_training_data()
+    for storage in Storage:
+        tracemalloc.start()
+        m = model.BrianModel(storage=storage)
+        start = time.perf_counter()
+        m.train(data)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        edges = len(m.genForward.edges) + len(m.genBackward.edges)
+        nodes = len(m.genForward.nodes) + len(m.genBackward.nodes)
+        print("%-8s nodes=%-7i edges=%-7i memory=%8.2f MiB peak=%8.2f MiB train=%.2fs" % (
+            storage.name, nodes, edges, current / 2**20, peak / 2**20, elapsed))
+
+def build_model(storage, synthetic=0):
+
+    """
+    Build a model from megahal.trn and synthetic additional lines.
+    Synthetic lines are random sequences of words from the training data, which
+    lets us grow the model to sizes similar to a long running bot.
+    Dropout is skipped while building.
+    """
+
+    data = load_training_data()
+    rng = random.Random(0)
+    words = " ".join(data).split()
+    for i in range(synthetic):
+        data.append(" ".join(rng.choice(words) for j in range(rng.randrange(3, 15))))
+
+    m = model.BrianModel(storage=storage)
+    for numTokens in m.parser.parseMany(data):
+        if not numTokens:
+            continue
+        m.genForward.feed(numTokens)
+        numTokens.reverse()
+        m.genBackward.feed(numTokens)
+    return m
+
+def peak_rss():
+
+    """
+    Return the peak resident set size of this process in KiB.
+    ru_maxrss is preserved across exec() on linux, so we prefer the high water mark reported by /proc.
+    """
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if resource:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return 0
+
+def _measure_load(path, queue):
+
+    baseline = peak_rss()
+    start = time.perf_counter()
+    m = model.BrianModel()
+    m.load(path)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, peak_rss() - baseline))
+
+def bench_format(args):
+
+    """
+    Compare save time, load time and peak resident memory during load for the zip/JSON and binary formats.
+    Loading is measured in a fresh process so the peak RSS is not skewed by the benchmark itself.
+    """
+
+    ctx = multiprocessing.get_context("spawn")
+    directory = tempfile.mkdtemp()
+    for storage in Storage:
+        m = build_model(storage, args.synthetic)
+        edges = len(m.genForward.edges) + len(m.genBackward.edges)
+        print("%s storage, %i edges" % (storage.name, edges))
+        for format in ModelFormat:
+            path = os.path.join(directory, "model.%s" % format.name.lower())
+            start = time.perf_counter()
+            m.save(path, format)
+            save_time = time.perf_counter() - start
+
+            queue = ctx.Queue()
+            p = ctx.Process(target=_measure_load, args=(path, queue))
+            p.start()
+            load_time, peak = queue.get()
+            p.join()
+            print("    %-7s size=%8.2f MiB save=%6.2fs load=%6.2fs peak RSS during load=+%.1f MiB" % (
+                format.name, os.path.getsize(path) / 2**20, save_time, load_time, peak / 1024))
+            os.remove(path)
+    os.rmdir(directory)
+
+def bench_generate(args):
+
+    """
+    Compare the amount of reply candidates generated per second locally and by generator workers.
+    """
+
+    m = build_model(Storage.OBJECT, args.synthetic)
+    seeds = [token.index for token in m.filter(m.parser.parse("what do you think about the weather today"))]
+    duration = 2.0
+    for count in [0] + [n for n in (1, 2, 4, 8, 16) if n <= model.PROCESS_COUNT]:
+        if count:
+            m.startWorkers(count)
+            results = m.workers.generate(list(seeds), duration, 10**9)
+        else:
+            results = m._generateCandidates(list(seeds), duration, 10**9)
+        print("workers=%-3i candidates/s=%.0f" % (count, len(results) / duration))
+    m.stopWorkers()
+
+def bench_observe(args):
+
+    """
+    Measure per message observe latency as the model grows.
+    Dropout after every message (dropout_interval=1, the old behaviour) is compared to
+    the default interval, with the maintenance pass running outside of observe.
+    """
+
+    data = load_training_data()
+    rng = random.Random(0)
+    words = " ".join(data).split()
+    lines = [" ".join(rng.choice(words) for j in range(rng.randrange(3, 15))) for i in range(args.synthetic)]
+
+    for interval in (1, model.BrianModel().dropout_interval):
+        m = model.BrianModel(dropout_interval=interval)
+        print("dropout_interval=%i" % interval)
+        for chunk in range(0, len(lines), len(lines) // 5):
+            m.auto_maintenance = True
+            m.train(lines[chunk:chunk + len(lines) // 5 - 200])
+            m.auto_maintenance = interval == 1
+            timings = []
+            for line in lines[chunk + len(lines) // 5 - 200:chunk + len(lines) // 5]:
+                start = time.perf_counter()
+                m.observe(line)
+                timings.append(time.perf_counter() - start)
+                if not m.auto_maintenance and m.maintenanceDue():
+                    m.maintain()
+            timings.sort()
+            print("    edges=%-8i observe mean=%7.3fms p99=%7.3fms" % (len(m.genForward.edges),
+                  sum(timings) / len(timings) * 1000, timings[int(len(timings) * 0.99)] * 1000))
+
+def bench_dropout(args):
+
+    """
+    Measure the time of a single dropout pass per storage, curve and policy.
+    The NumPy path is compared to the pure Python one.
+    """
+
+    for storage in Storage:
+        base = build_model(storage, args.synthetic)
+        paths = [False] + ([True] if model.HAS_NUMPY else [])
+        for numpy in paths:
+            model.HAS_NUMPY, has_numpy = numpy, model.HAS_NUMPY
+            print("%s storage%s, %i edges" % (storage.name, " (NumPy)" if numpy else "", len(base.genForward.edges)))
+            for curve in model.DropoutCurve:
+                for policy in (model.Dropout.ALL, model.Dropout.LEAST_USED, model.Dropout.RANDOM_WEIGHTED):
+                    m = model.BrianModel(storage=storage)
+                    m.genForward.loadArrays(base.genForward.saveArrays())
+                    start = time.perf_counter()
+                    dropped = m.genForward.dropout(policy, curve, 0.1, 5)
+                    print("    %-12s %-16s dropped=%-7i time=%7.3fs" % (curve.name, policy.name, len(dropped), time.perf_counter() - start))
+            model.HAS_NUMPY = has_numpy
+
+def _synthetic_lines(count):
+
+    data = load_training_data()
+    rng = random.Random(0)
+    words = " ".join(data).split()
+    for i in range(count):
+        yield " ".join(rng.choice(words) for j in range(rng.randrange(3, 15)))
+
+def _measure_train(storage, bulk, count, queue):
+
+    baseline = peak_rss()
+    m = model.BrianModel(storage=storage)
+    start = time.perf_counter()
+    if bulk:
+        m.trainBulk(_synthetic_lines(count))
+    else:
+        m.train(_synthetic_lines(count))
+    queue.put((time.perf_counter() - start, peak_rss() - baseline, len(m.genForward.edges)))
+
+def bench_bulk(args):
+
+    """
+    Compare train() and trainBulk() on a stream of synthetic lines.
+    Every run happens in a fresh process so the peak RSS can be compared.
+    """
+
+    ctx = multiprocessing.get_context("spawn")
+    for storage in Storage:
+        for bulk in (False, True):
+            queue = ctx.Queue()
+            p = ctx.Process(target=_measure_train, args=(storage, bulk, args.synthetic, queue))
+            p.start()
+            elapsed, peak, edges = queue.get()
+            p.join()
+            print("%-8s %-10s lines=%-8i edges=%-8i time=%7.2fs lines/s=%8.0f peak RSS=+%.1f MiB" % (storage.name,
+                  "trainBulk" if bulk else "train", args.synthetic, edges, elapsed, args.synthetic / elapsed, peak / 1024))
+
+async def _heartbeat(work):
+
+    """
+    Run the coroutine work while measuring how late a 10ms heartbeat fires on the event loop.
+    Returns the sorted lags in seconds and the time work took.
+    """
+
+    lags = []
+    done = False
+
+    async def heartbeat():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - start - 0.01)
+
+    task = asyncio.ensure_future(heartbeat())
+    start = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - start
+    done = True
+    await task
+    lags.sort()
+    return lags, elapsed
+
+def bench_server(args):
+
+    """
+    Compare the event loop latency while observing and responding in the default thread pool
+    and in a model server process.
+    """
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "model.zip")
+    m = build_model(Storage.OBJECT, args.synthetic)
+    m.save(path)
+    lines = list(_synthetic_lines(400))
+
+    async def executor():
+        loop = asyncio.get_running_loop()
+        for i, line in enumerate(lines):
+            if i % 20 == 0:
+                await loop.run_in_executor(None, m.respond, line, "bench")
+            else:
+                await loop.run_in_executor(None, m.observe, line, "bench")
+
+    async def process():
+        s = server.ModelServer(path, os.path.join(directory, "model.journal"))
+        await s.start()
+        async def work():
+            for i, line in enumerate(lines):
+                if i % 20 == 0:
+                    await s.respond(line, "bench")
+                else:
+                    await s.observe(line, "bench")
+        result = await _heartbeat(work)
+        await s.close()
+        return result
+
+    async def run():
+        return [("executor", await _heartbeat(executor)), ("process", await process())]
+
+    for name, (lags, elapsed) in asyncio.run(run()):
+        print("%-8s time=%6.2fs heartbeat lag mean=%7.2fms p99=%7.2fms max=%7.2fms" % (name, elapsed,
+              sum(lags) / len(lags) * 1000, lags[int(len(lags) * 0.99)] * 1000, lags[-1] * 1000))
+    os.remove(path)
+    os.remove(os.path.join(directory, "model.journal"))
+    os.rmdir(directory)
+
+def bench_score(args):
+
+    """
+    Compare the amount of reply candidates scored per second with and without NumPy.
+    """
+
+    m = build_model(Storage.OBJECT, args.synthetic)
+    seeds = [token.index for token in m.filter(m.parser.parse("what do you think about the weather today"))]
+    candidates = m._generateCandidates(seeds, 2.0, 2000)
+    m.observe("the weather has been awful all week", "bench")
+    m.observe("i think it will rain again tomorrow", "bench")
+    tokens = m.filter(m.parser.parse("what do you think about the weather today"))
+    for numpy in sorted({False, model.HAS_NUMPY}):
+        model.HAS_NUMPY = numpy
+        start = time.perf_counter()
+        rounds = 0
+        while time.perf_counter() - start < 2.0:
+            m._evaluate_current(candidates, tokens)
+            m._evaluate_conversation(candidates, "bench")
+            rounds += 1
+        elapsed = time.perf_counter() - start
+        print("numpy=%-5s candidates=%-5i candidates/s=%.0f" % (numpy, len(candidates), rounds * len(candidates) / elapsed))
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "format": bench_format,
+    "generate": bench_generate,
+    "observe": bench_observe,
+    "dropout": bench_dropout,
+    "bulk": bench_bulk,
+    "server": bench_server,
+    "score": bench_score
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="BrianCS model benchmarks")
+    parser.add_argument("benchmark", choices=list(BENCHMARKS.keys()))
+    parser.add_argument("--synthetic", type=int, default=20000, help="amount of synthetic training lines to add to megahal.trn")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -1,7 +1,18 @@
 import unittest
 import os
+import io
+import json
+import random
+import threading
+import math
+from unittest import mock
 from .. import model
 
+def graph_state(graph):
+    d = json.loads(graph.save())
+    edges = {(e["s"], e["d"]): e["w"] for e in d["edges"]}
+    return d["nodes"], edges
+
 class TestModel(unittest.TestCase):
 
     def test_model_component_init(self):
@@ -18,19 +29,590 @@ class TestModel(unittest.TestCase):
         m.save("./test_model.zip")
         m.load("./test_model.zip")
 
+    def test_model_save_load_binary(self):
+        for storage in model.Storage:
+            m = model.BrianModel(storage=storage)
+            m.observe("hello world, this is a test", "a conversation")
+            m.observe("ünïcode wörds", "a conversation")
+            m.blacklist.append("test")
+            m.save("./test_model.zip")
+            model.convert("./test_model.zip", "./test_model.bin")
+            m2 = model.BrianModel()
+            m2.load("./test_model.bin")
+            self.assertEqual(m2.save_format, model.ModelFormat.BINARY)
+            self.assertEqual(m2.storage, storage)
+            self.assertEqual(m2.blacklist, ["test"])
+            self.assertEqual(m2.tokenTable.save(), m.tokenTable.save())
+            self.assertEqual(graph_state(m2.genForward), graph_state(m.genForward))
+            self.assertEqual(graph_state(m2.genBackward), graph_state(m.genBackward))
+            m2.save("./test_model.bin")
+            m2.load("./test_model.bin")
+            self.assertEqual(graph_state(m2.genForward), graph_state(m.genForward))
+            m2.observe("hello again", "a conversation")
+
+    def test_model_load_mapped(self):
+        m = model.BrianModel(storage=model.Storage.COMPACT)
+        m.observe("hello world, this is a test", "a conversation")
+        m.save("./test_model.bin", model.ModelFormat.BINARY)
+        state = graph_state(m.genForward)
+        m2 = model.BrianModel()
+        m2.load("./test_model.bin")
+        graph = m2.genForward
+        #compact graphs use the mapped file until they are changed, even while it is replaced
+        self.assertTrue(graph._mapped)
+        self.assertIsInstance(graph._weights, memoryview)
+        m2.save("./test_model.bin")
+        self.assertTrue(graph._mapped)
+        self.assertEqual(graph_state(graph), state)
+        graph.edges[0].weight += 1
+        self.assertFalse(graph._mapped)
+        self.assertIsInstance(graph._weights, model.array)
+        self.assertEqual(m2.respond("something completely different", "a conversation"), "hello world, this is a test")
+        self.assertIsInstance(m2.genBackward._argPool, model.array)
+        m2.save("./test_model.bin")
+        m3 = model.BrianModel()
+        m3.load("./test_model.bin")
+        self.assertEqual(graph_state(m3.genForward), graph_state(graph))
+
+        with model.binary.BinaryReader("./test_model.bin") as f:
+            view = f.view("forward.edges.weight")
+            self.assertEqual(model.binary.copyArray(view), f.array("forward.edges.weight"))
+        #views stay valid after the reader is closed
+        self.assertEqual(len(view), len(graph.edges))
+        view.release()
+
+    def test_graph_json_without_fresh(self):
+        #sections written by older versions do not include the fresh edges
+        a = model.MModel(3)
+        a.feed([1, 2, 3])
+        arrays = {name: data for name, data in a.saveArrays().items() if not (name == "feeds" or name.startswith("fresh."))}
+        for graph in (model.MModel(3), model.CompactMModel(3)):
+            graph.load(io.StringIO(model.graphJSON(arrays)))
+            self.assertEqual(graph_state(graph), graph_state(a))
+            self.assertEqual((graph._feeds, graph._fresh), (0, {}))
+            graph.loadArrays(arrays)
+            self.assertEqual(graph_state(graph), graph_state(a))
+
     def test_model_train(self):
         m = model.BrianModel()
         with open("brianCS/training/megahal.trn") as f:
             m.train(map(lambda x: x.lower(), f.readlines()))
 
+    def test_model_train_bulk(self):
+        with open("brianCS/training/megahal.trn") as f:
+            data = [l.lower() for l in f.readlines()]
+        a = model.BrianModel(dropout=model.Dropout.LEAST_FREQUENTLY, dropout_interval=10**6, dropout_period=3600)
+        b = model.BrianModel(dropout=model.Dropout.LEAST_FREQUENTLY, dropout_interval=10**6, dropout_period=3600)
+        a.train(data)
+        a.maintain()
+        b.openJournal("./test_model.journal")
+        self.assertEqual(b.trainBulk(iter(data + [""]), batch=64), len(data) + 1)
+        b.closeJournal()
+        self.assertEqual(b.dropout_pending, 0)
+        self.assertEqual(b.tokenTable.save(), a.tokenTable.save())
+        self.assertEqual(graph_state(b.genForward), graph_state(a.genForward))
+        self.assertEqual(graph_state(b.genBackward), graph_state(a.genBackward))
+
+        c = model.BrianModel()
+        c.openJournal("./test_model.journal")
+        c.closeJournal()
+        self.assertEqual(graph_state(c.genForward), graph_state(a.genForward))
+        self.assertEqual(graph_state(c.genBackward), graph_state(a.genBackward))
+
     def test_model_observe_respond(self):
         m = model.BrianModel()
         m.observe("hello world", "a conversation")
         res = m.respond("something completely different", "a conversation")
         self.assertEqual(res, "hello world") #since the model knows nothing else, this should be the output
-        
-    def tearDown(self):
+
+    def test_candidate_scorer(self):
+        idf = {1: 1.0, 2: 1.0, 3: 2.0, 4: 0.5, 5: 3.0}.get
+        candidates = [[1, 2], [1, 2, 3], [3, 3, 5], [4], [5, 5], []]
+        for numpy in {False, model.HAS_NUMPY}:
+            with mock.patch.object(model, "HAS_NUMPY", numpy), mock.patch.object(model.CandidateScorer, "ARRAY_THRESHOLD", 0):
+                scorer = model.CandidateScorer([(3, [1, 2, 3]), (1, [5])], idf)
+                scores = scorer.score(candidates)
+                self.assertAlmostEqual(scores[1], 2 * 4 * 0.75 / (4 + 4 * 0.75 + 3 * 0.25))
+                self.assertGreater(scores[1], scores[0])
+                self.assertGreater(scores[2], scores[4])
+                self.assertEqual(scores[3], 0)
+                self.assertEqual(scores[5], 0)
+                #repeating the references is not rewarded with novelty
+                scores = model.CandidateScorer([(1, [1, 2])], idf, novelty=True).score(candidates)
+                self.assertEqual(scores[0], 0)
+                self.assertGreater(scores[1], 0)
+                self.assertEqual(model.CandidateScorer([], idf).score(candidates), [0] * len(candidates))
+
+    def test_model_evaluate(self):
+        m = model.BrianModel(context_bias=1)
+        m.train(["the cat sat on the mat", "a dog ran in the park", "birds fly south"])
+        m.observe("did you see the cat", "c")
+        parse = lambda s: m.parser.parseIDs(s)
+        candidates = [parse("a dog ran in the park"), parse("the cat sat on the mat")]
+        weights = m._evaluate_conversation(candidates, "c")
+        self.assertGreater(weights[1], weights[0])
+        self.assertEqual(m._evaluate_conversation(candidates, "other"), [0, 0])
+        #older messages weigh less
+        for timeout in model.Timeout:
+            m.timeout = timeout
+            self.assertGreater(m._messageWeight(0), m._messageWeight(m.CONTEXT_TIMEOUT))
+            self.assertAlmostEqual(m._messageWeight(m.CONTEXT_TIMEOUT), 0.5)
+        results, weights = m._evaluate(candidates, [], "c")
+        self.assertEqual(results, candidates)
+        self.assertGreater(weights[1], weights[0])
+        with mock.patch.object(m, "EVALUATION_BATCH", 1), mock.patch.object(m, "EVALUATION_TIME", -1):
+            self.assertEqual(m._evaluate(candidates, [], "c")[0], candidates[:1])
+
+    def test_model_observe_many(self):
+        with open("brianCS/training/megahal.trn") as f:
+            messages = [(l.lower(), str(i % 3)) for i, l in enumerate(f.readlines()[:100])] + [("", "0")]
+        a = model.BrianModel(dropout_interval=10**6)
+        b = model.BrianModel(dropout_interval=10**6)
+        for message, conversation in messages[:-1]:
+            a.observe(message, conversation)
+        a.updateConversation([], "0")
+        b.openJournal("./test_model.journal")
+        b.observeMany(messages)
+        b.closeJournal()
+        self.assertEqual(b.tokenTable.save(), a.tokenTable.save())
+        self.assertEqual(graph_state(b.genForward), graph_state(a.genForward))
+        self.assertEqual(graph_state(b.genBackward), graph_state(a.genBackward))
+        self.assertEqual({k: [[t.name for t in m.data] for m in c] for k, c in b.conversations.items()},
+                         {k: [[t.name for t in m.data] for m in c] for k, c in a.conversations.items()})
+
+        c = model.BrianModel()
+        c.openJournal("./test_model.journal")
+        c.closeJournal()
+        self.assertEqual(graph_state(c.genForward), graph_state(a.genForward))
+
+    def test_model_journal(self):
+        with open("brianCS/training/megahal.trn") as f:
+            data = [l.lower() for l in f.readlines()[:60]]
+        for storage in model.Storage:
+            m = model.BrianModel(dropout=model.Dropout.ALL, dropout_curve=model.DropoutCurve.HALF, dropout_chance=0.3, storage=storage,
+                                 dropout_interval=5)
+            m.openJournal("./test_model.journal")
+            m.train(data[:20])
+            m.compact("./test_model.zip")
+            m.train(data[20:40])
+            m.dropout_factor = 0.5
+            m.recordSettings()
+            m.respond(data[40], "a conversation")
+            m.train(data[41:])
+            m.checkpoint("./test_model.zip")
+            self.assertGreater(m.journal.size(), 0)
+
+            #recover from the snapshot and the journal
+            m2 = model.BrianModel()
+            m2.load("./test_model.zip")
+            pending = m.journal_seq - m2.journal_seq
+            self.assertEqual(m2.openJournal("./test_model.journal"), pending)
+            self.assertEqual(m2.dropout_factor, 0.5)
+            self.assertEqual(m2.tokenTable.save(), m.tokenTable.save())
+            self.assertEqual(graph_state(m2.genForward), graph_state(m.genForward))
+            self.assertEqual(graph_state(m2.genBackward), graph_state(m.genBackward))
+
+            #records already included in a snapshot are skipped
+            m.save("./test_model.zip")
+            m2.closeJournal()
+            m2.load("./test_model.zip")
+            self.assertEqual(m2.openJournal("./test_model.journal"), 0)
+            m2.closeJournal()
+            m.closeJournal()
+            os.remove("./test_model.journal")
+
+    def test_model_snapshot(self):
+        m = model.BrianModel()
+        m.observe("hello world, this is a test", "a conversation")
+        snapshot = m.snapshot()
+        state = graph_state(m.genForward)
+        m.observe("something completely different", "a conversation")
+        snapshot.write("./test_model.zip")
+        self.assertFalse([p for p in os.listdir(".") if p.endswith(".tmp")])
+        m2 = model.BrianModel()
+        m2.load("./test_model.zip")
+        self.assertEqual(graph_state(m2.genForward), state)
+
+    def test_model_background_compact(self):
+        with open("brianCS/training/megahal.trn") as f:
+            data = [l.lower() for l in f.readlines()[:200]]
+        m = model.BrianModel()
+        m.openJournal("./test_model.journal")
+        m.train(data[:100])
+        worker = threading.Thread(target=m.train, args=(data[100:],))
+        worker.start()
+        while worker.is_alive():
+            m.compact("./test_model.zip")
+        worker.join()
+        m.closeJournal()
+        m2 = model.BrianModel()
+        m2.load("./test_model.zip")
+        m2.openJournal("./test_model.journal")
+        m2.closeJournal()
+        self.assertEqual(m2.tokenTable.save(), m.tokenTable.save())
+        self.assertEqual(graph_state(m2.genForward), graph_state(m.genForward))
+        self.assertEqual(graph_state(m2.genBackward), graph_state(m.genBackward))
+
+    def test_model_compact_without_journal(self):
+        m = model.BrianModel()
+        m.observe("hello world")
+        m.compact("./test_model.zip")
+        m2 = model.BrianModel()
+        m2.load("./test_model.zip")
+        self.assertEqual(graph_state(m2.genForward), graph_state(m.genForward))
+
+    def test_model_maintenance(self):
+        m = model.BrianModel(dropout_interval=3, dropout_period=3600)
+        m.observe("hello world")
+        m.observe("hello there")
+        self.assertEqual(m.dropout_pending, 2)
+        self.assertEqual(m.genForward.findEdge(0, m.genForward.findNodeForArgs([0]).index).weight, 110)
+        m.observe("something else")
+        self.assertEqual(m.dropout_pending, 0)
+        self.assertEqual(m.genForward.findEdge(0, m.genForward.findNodeForArgs([0]).index).weight, 107)
+        #edges created since the last pass are only weighed for the messages that followed
+        self.assertEqual(m.genForward.findEdge(0, m.genForward.findNodeForArgs([m.tokenTable.getTokenByName("something").index]).index).weight, 99)
+        m.auto_maintenance = False
+        for i in range(5):
+            m.observe("hello world")
+        self.assertTrue(m.maintenanceDue())
+        m.maintain()
+        self.assertFalse(m.maintenanceDue())
+
+        #with a linear curve, batched dropout is the same as dropout after every message
+        with open("brianCS/training/megahal.trn") as f:
+            data = [l.lower() for l in f.readlines()[:40]]
+        a = model.BrianModel(dropout=model.Dropout.LEAST_FREQUENTLY, dropout_interval=1)
+        b = model.BrianModel(dropout=model.Dropout.LEAST_FREQUENTLY, dropout_interval=8)
+        a.train(data)
+        b.train(data)
+        self.assertEqual(graph_state(a.genForward), graph_state(b.genForward))
+
+        #applying a curve once for several steps is the same as applying it step by step
+        for curve in model.DropoutCurve:
+            a = model.MModel(3)
+            a.feed([1, 2, 3])
+            a.feed([1, 2, 4])
+            a._clearFresh()
+            b = model.MModel(3)
+            b.load(io.StringIO(a.save()))
+            for i in range(4):
+                a._weighEdges(curve, 0)
+            b._weighEdges(curve, 0, 4)
+            self.assertEqual(graph_state(a), graph_state(b))
+
+    def test_model_workers(self):
+        m = model.BrianModel(prediction_time=200)
+        m.observe("hello world")
+        m.startWorkers(2)
         try:
-            os.remove("./test_model.zip")
-        except OSError:
-            pass
+            self.assertEqual(m.respond("something completely different"), "hello world")
+            m.observe("foo")
+            foo = m.tokenTable.getTokenByName("foo")
+            results = m.workers.generate([foo.index], 0.1, 10)
+            self.assertEqual(len(results), 10)
+            self.assertEqual({m.parser.build(r) for r in results}, {"foo"})
+        finally:
+            m.stopWorkers()
+
+    def test_token_table(self):
+        table = model.TokenTable()
+        for name in ("a", "b", "c"):
+            table.addToken(name)
+        table.deleteToken(1)
+        self.assertEqual(table.getTokenByID(2).name, "c")
+        self.assertRaises(KeyError, table.getTokenByID, 1)
+        self.assertRaises(KeyError, table.getTokenByID, 3)
+        self.assertIn(table.getRandom().name, ("a", "c"))
+        copy = model.TokenTable()
+        copy.load(io.StringIO(table.save()))
+        self.assertEqual(copy.tokens, table.tokens)
+        copy.loadArrays(table.saveArrays())
+        self.assertEqual(copy.tokens, table.tokens)
+        self.assertEqual(copy.addToken("d").index, 3)
+
+    def test_parser_cache(self):
+        table = model.TokenTable()
+        parser = model.Parser(table, cache_size=2)
+        ids = parser.parseIDs("hello world, see www.example.com/x")
+        self.assertEqual(parser.build(ids), "hello world, see www.example.com/x")
+        self.assertEqual([t.index for t in parser.parse("hello world, see www.example.com/x")], ids)
+        self.assertEqual(table.getTokenByName("www.example.com/x").type, model.TokenTypes.LINK)
+        self.assertEqual(table.getTokenByName(",").type, model.TokenTypes.SEPARATOR)
+        self.assertEqual(parser.parseMany(["hello world, see www.example.com/x", "foo"]), [ids, parser.parseIDs("foo")])
+
+        parser.parseIDs("bar")
+        self.assertEqual(list(parser._cache), ["foo", "bar"])
+        #stale IDs must not be returned after the table changed
+        bar = table.getTokenByName("bar").index
+        table.deleteToken(bar)
+        self.assertEqual(parser.parseIDs("bar"), [bar + 1])
+        other = model.TokenTable()
+        other.addToken("foo")
+        table.load(io.StringIO(other.save()))
+        self.assertEqual(parser.parseIDs("foo"), [0])
+
+    def test_select_dropout(self):
+        for threshold in {model.SELECT_ARRAY_THRESHOLD, 0 if model.HAS_NUMPY else model.SELECT_ARRAY_THRESHOLD}:
+            with mock.patch.object(model, "SELECT_ARRAY_THRESHOLD", threshold):
+                self._select_dropout()
+
+    def _select_dropout(self):
+        candidates = [(-w, i, i) for i, w in enumerate((0, 1, 2, 4, 8, 16))]
+        for policy in (model.Dropout.LEAST_USED, model.Dropout.RANDOM_WEIGHTED):
+            self.assertEqual(len(model.selectDropout(candidates, policy, 0.5)), 3)
+        self.assertEqual(sorted(model.selectDropout(candidates, model.Dropout.LEAST_USED, 0.5)), sorted(candidates[3:]))
+        self.assertEqual(model.selectDropout(candidates, model.Dropout.RANDOM, 0), [])
+        self.assertEqual(len(model.selectDropout(candidates, model.Dropout.RANDOM, 1)), len(candidates))
+
+        #RANDOM_WEIGHTED selects edges with the same probabilities as drawing them one at a time
+        random.seed(3)
+        if model.HAS_NUMPY:
+            model.np.random.seed(3)
+        weights = [1 + 0.5 * -c[0] for c in candidates]
+        expected = [0] * len(candidates)
+        selected = [0] * len(candidates)
+        for i in range(4000):
+            pool = list(range(len(candidates)))
+            for j in range(3):
+                k = random.choices(range(len(pool)), [weights[p] for p in pool])[0]
+                expected[pool.pop(k)] += 1
+            for c in model.selectDropout(candidates, model.Dropout.RANDOM_WEIGHTED, 0.5):
+                selected[c[1]] += 1
+        for e, s in zip(expected, selected):
+            self.assertAlmostEqual(e / 4000, s / 4000, delta=0.04)
+
+    def test_mmodel_edges(self):
+        m = model.MModel(3)
+        m.feed([1, 2, 3])
+        m.feed([1, 2, 4])
+        a = m.findNodeForArgs([1])
+        b = m.findNodeForArgs([1, 2])
+        self.assertIs(m.findEdge(a.index, b.index), m._incoming[b.index][a.index])
+        self.assertEqual(m.findEdge(0, a.index).weight, m.starting_weight + m.weight_increase)
+        self.assertEqual(len(m._outgoing[b.index]), 2)
+        m.deleteEdge(a.index, b.index)
+        with self.assertRaises(KeyError):
+            m.findEdge(a.index, b.index)
+        self.assertFalse(m.hasIncoming(b))
+        self.assertEqual(len(m.edges), 5)
+
+    def test_mmodel_sanitize(self):
+        m = model.MModel(3)
+        m.feed([1, 2, 3])
+        m.feed([1, 4])
+        c = m.findNodeForArgs([3])
+        m.deleteEdge(c.index, 0)
+        m.sanitize([c])
+        #the path 1 -> 2 -> 3 is now a dead end and should have been removed completely
+        self.assertRaises(KeyError, m.findEdge, m.findNodeForArgs([1]).index, m.findNodeForArgs([2]).index)
+        for i in range(10):
+            self.assertEqual(m.getSequence(), [1, 4])
+
+    def test_mmodel_sanitize_random(self):
+        #compare against the previous round based implementation
+        def sanitize_rounds(graph, indices):
+            dirty = set(indices)
+            while indices:
+                next_indices = []
+                for ind in indices:
+                    if ind != 0 and not graph._outDegree(ind):
+                        for fromInd in graph._predecessors(ind):
+                            graph.deleteEdge(fromInd, ind)
+                            next_indices.append(fromInd)
+                dirty.update(next_indices)
+                indices = next_indices
+            return dirty
+
+        for seed in range(20):
+            for graph_type in (model.MModel, model.CompactMModel):
+                rng = random.Random(seed)
+                a, b = graph_type(3), graph_type(3)
+                for i in range(150):
+                    seq = [rng.randrange(12) for j in range(rng.randrange(1, 6))]
+                    a.feed(seq)
+                    b.feed(seq)
+                edges = sorted((e.fromInd, e.toInd) for e in a.edges)
+                dropped = rng.sample(edges, len(edges) // 4)
+                for graph in (a, b):
+                    for fromInd, toInd in dropped:
+                        graph.deleteEdge(fromInd, toInd)
+                touched = list({ind for edge in dropped for ind in edge})
+                self.assertEqual(a._sanitizeIndices(touched), sanitize_rounds(b, touched))
+                self.assertEqual(graph_state(a), graph_state(b))
+
+    def test_mmodel_feed_many(self):
+        for graph_type in (model.MModel, model.CompactMModel):
+            rng = random.Random(4)
+            a, b = graph_type(3), graph_type(3)
+            seqs = [[rng.randrange(10) for j in range(rng.randrange(0, 6))] for i in range(300)]
+            for seq in seqs[:50]:
+                if seq:
+                    a.feed(seq)
+            b.feedMany(seqs[:50])
+            a.dropout(model.Dropout.ALL, model.DropoutCurve.HALF, threshold=2)
+            b.dropout(model.Dropout.ALL, model.DropoutCurve.HALF, threshold=2)
+            for seq in seqs[50:]:
+                if seq:
+                    a.feed(seq)
+            b.feedMany(seqs[50:])
+            self.assertEqual(graph_state(a), graph_state(b))
+            self.assertEqual((a._feeds, a._fresh), (b._feeds, b._fresh))
+
+    def test_mmodel_context_index(self):
+        m = model.MModel(3)
+        rng = random.Random(1)
+        for i in range(200):
+            m.feed([rng.randrange(8) for j in range(rng.randrange(1, 6))])
+        m.dropout(model.Dropout.ALL, model.DropoutCurve.HALF, threshold=20)
+        m2 = model.MModel(3)
+        m2.load(io.StringIO(m.save()))
+        for graph in (m, m2):
+            nodes = [n for n in graph.nodes.values() if n is not None]
+            for n in nodes:
+                for i in range(1, n.order + 1):
+                    expected = [x for x in nodes if x.args[-i:] == n.args[-i:]][0]
+                    self.assertEqual(graph.findNodeForArgs(n.args[-i:]), expected)
+        self.assertRaises(ValueError, m.findNodeForArgs, [99])
+
+    def test_mmodel_sampler_cache(self):
+        m = model.MModel(3)
+        m.feed([1, 2])
+        a = m.findNodeForArgs([1])
+        self.assertEqual(m.getNext(a).value, 2)
+        self.assertIn(a.index, m._samplers)
+        m.feed([1, 3])
+        self.assertNotIn(a.index, m._samplers)
+        self.assertEqual({m.getNext(a).value for i in range(100)}, {2, 3})
+        m.deleteEdge(a.index, m.findNodeForArgs([1, 2]).index)
+        self.assertEqual({m.getNext(a).value for i in range(20)}, {3})
+
+    def tearDown(self):
+        for path in ("./test_model.zip", "./test_model.bin", "./test_model.journal"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+class TestCompactModel(unittest.TestCase):
+
+    def _graphs(self, seed, threshold=8):
+        a = model.MModel(3)
+        b = model.CompactMModel(3)
+        b.MERGE_THRESHOLD = threshold
+        rng = random.Random(seed)
+        for i in range(300):
+            seq = [rng.randrange(10) for j in range(rng.randrange(1, 6))]
+            a.feed(seq)
+            b.feed(seq)
+        return a, b
+
+    def test_compact_feed(self):
+        a, b = self._graphs(1)
+        self.assertEqual(graph_state(a), graph_state(b))
+        self.assertEqual(len(a.nodes), len(b.nodes))
+        for node in a.nodes.values():
+            if node is None:
+                continue
+            self.assertEqual(b.nodes[node.index].args, node.args)
+            self.assertEqual(b.findNodeForArgs(node.args[-1:]), a.findNodeForArgs(node.args[-1:]))
+            self.assertEqual(b.contextCount(node.args[-1]), a.contextCount(node.args[-1]))
+            self.assertEqual(sorted(b._predecessors(node.index)), sorted(a._predecessors(node.index)))
+
+    def test_compact_dropout(self):
+        for numpy in {False, model.HAS_NUMPY}:
+            with mock.patch.object(model, "HAS_NUMPY", numpy):
+                a, b = self._graphs(2)
+                for curve in (model.DropoutCurve.HALF, model.DropoutCurve.DECREMENT):
+                    a.dropout(model.Dropout.ALL, curve, threshold=30)
+                    b.dropout(model.Dropout.ALL, curve, threshold=30)
+                    self.assertEqual(graph_state(a), graph_state(b))
+                    self.assertEqual(len(a.nodes), len(b.nodes))
+                for i in range(50):
+                    b.getSequence()
+
+                a, b = self._graphs(3)
+                for curve in (model.DropoutCurve.HALF, model.DropoutCurve.LOG2, model.DropoutCurve.SQUARE_ROOT):
+                    a.dropout(model.Dropout.ALL, curve, threshold=1, steps=2)
+                    b.dropout(model.Dropout.ALL, curve, threshold=1, steps=2)
+                    self.assertEqual(graph_state(a), graph_state(b))
+                self.assertTrue(a.edges)
+
+    def test_mmodel_dropout_numpy(self):
+        #the NumPy path weighs and drops the same edges as the pure Python one
+        if not model.HAS_NUMPY:
+            self.skipTest("NumPy is not installed")
+        graphs = []
+        for numpy in (False, True):
+            with mock.patch.object(model, "HAS_NUMPY", numpy):
+                a, b = self._graphs(7)
+                a.feed([11, 12, 13])
+                for curve in model.DropoutCurve:
+                    dropped = a.dropout(model.Dropout.ALL, curve, threshold=60, steps=2)
+                    a.feed([1, 2, 3])
+                graphs.append((graph_state(a), dropped))
+                self.assertTrue(a.edges)
+                for i in range(50):
+                    a.getSequence()
+        self.assertEqual(graphs[0], graphs[1])
+        self.assertRaises(KeyError, a.dropEdges, [(0, 0)])
+
+    @unittest.skipUnless(model.HAS_NUMPY, "NumPy is not installed")
+    def test_apply_curve_array(self):
+        rng = random.Random(5)
+        weights = [rng.uniform(-5, 300) for i in range(200)] + [math.nan] * 5
+        steps = [rng.randrange(0, 5) for w in weights]
+        for curve in model.DropoutCurve:
+            for s in (3, model.np.array(steps)):
+                array = model.np.array(weights)
+                model.applyCurveArray(array, curve, s)
+                expected = [model.applyCurve(w, curve, s if isinstance(s, int) else s[i]) for i, w in enumerate(weights)]
+                self.assertTrue(model.np.allclose(array, expected, equal_nan=True, rtol=1e-12), curve)
+
+    def test_compact_edges(self):
+        a, b = self._graphs(3, threshold=10**6)
+        self.assertTrue(b._staged)
+        for graph in (a, b):
+            graph.deleteEdge(0, graph.findNodeForArgs([1]).index)
+            self.assertRaises(KeyError, graph.deleteEdge, 0, graph.findNodeForArgs([1]).index)
+        b._merge()
+        self.assertFalse(b._staged)
+        self.assertEqual(graph_state(a), graph_state(b))
+
+    def test_compact_set_weight(self):
+        a, b = self._graphs(6, threshold=10**6)
+        b._merge()
+        for graph in (a, b):
+            #new nodes, which leaves part of the edges staged
+            graph.feed([11, 12, 13])
+            edges = sorted((edge.fromInd, edge.toInd) for edge in graph.edges)
+            for i, (fromInd, toInd) in enumerate(edges[::3]):
+                graph.setWeight(fromInd, toInd, i)
+            for fromInd, toInd in edges[1::3]:
+                graph.findEdge(fromInd, toInd).weight += 0.5
+            edge = graph.addEdge(0, graph.findNodeForArgs([7]).index, 2)
+            edge.weight *= 3
+            self.assertRaises(KeyError, graph.setWeight, 0, 0, 1)
+        self.assertTrue(b._staged)
+        self.assertEqual(graph_state(a), graph_state(b))
+        b._merge()
+        self.assertEqual(graph_state(a), graph_state(b))
+        edge = b.findEdge(0, b.findNodeForArgs([11]).index)
+        self.assertEqual(edge.toNode, a.findNodeForArgs([11]))
+
+    def test_compact_save_load(self):
+        a, b = self._graphs(4)
+        c = model.CompactMModel(3)
+        c.load(io.StringIO(a.save()))
+        self.assertEqual(graph_state(a), graph_state(c))
+        a.load(io.StringIO(b.save()))
+        self.assertEqual(graph_state(a), graph_state(b))
+
+    def test_compact_brian_model(self):
+        m = model.BrianModel(storage=model.Storage.COMPACT)
+        m.observe("hello world", "a conversation")
+        self.assertEqual(m.respond("something completely different", "a conversation"), "hello world")
+        state = graph_state(m.genBackward)
+        m.setStorage(model.Storage.OBJECT)
+        self.assertNotIsInstance(m.genForward, model.CompactMModel)
+        self.assertEqual(graph_state(m.genBackward), state)
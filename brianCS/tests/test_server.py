@@ -0,0 +1,79 @@
+import unittest
+import tempfile
+import shutil
+import asyncio
+import os
+from .. import model, server
+from .test_MModel import graph_state
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "model.zip")
+        self.journal = os.path.join(self.directory, "model.journal")
+        with open("brianCS/training/megahal.trn") as f:
+            self.data = [l.lower() for l in f.readlines()[:30]]
+        #dropout is random, so the tests must not reach the dropout interval
+        m = model.BrianModel(dropout_interval=1000)
+        m.prediction_time = 50
+        m.blacklist = ["foo"]
+        m.save(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reload(self):
+        m = model.BrianModel()
+        m.load(self.path)
+        m.openJournal(self.journal)
+        m.closeJournal()
+        return m
+
+    def test_server_observe_respond(self):
+        async def run():
+            s = server.ModelServer(self.path, self.journal, max_pending=2, max_observe=4)
+            await s.start()
+            self.assertEqual((s.template.dropout_interval, s.template.blacklist), (1000, ["foo"]))
+            for line in self.data:
+                await s.observe(line, "a")
+            #pipelined replies see all messages observed before them
+            replies = await asyncio.gather(*(s.respond("hello", "a") for i in range(5)))
+            self.assertTrue(all(isinstance(reply, str) for reply in replies))
+            await s.observe("another message", "a")
+            await s.close()
+        asyncio.run(run())
+
+        reference = model.BrianModel()
+        #replies train the model on their input as well
+        for line in self.data + ["hello"] * 5 + ["another message"]:
+            reference.observe(line, "a")
+        m = self.reload()
+        self.assertEqual(m.tokenTable.save(), reference.tokenTable.save())
+        self.assertEqual(graph_state(m.genForward), graph_state(reference.genForward))
+
+    def test_server_configure(self):
+        async def run():
+            s = server.ModelServer(self.path, self.journal)
+            await s.start()
+            s.template.context_bias = 0.25
+            s.template.blacklist.append("bar")
+            await s.configure()
+            await s.observe("hello world", "a")
+            await s.save()
+
+            backup = os.path.join(self.directory, "backup.zip")
+            await s.save(backup)
+            s.template.context_bias = 0.75
+            await s.load(backup)
+            self.assertEqual((s.template.context_bias, s.template.blacklist), (0.25, ["foo", "bar"]))
+            with self.assertRaises(RuntimeError):
+                await s.request("unknown")
+            await s.close()
+            with self.assertRaises(ConnectionError):
+                await s.respond("hello")
+        asyncio.run(run())
+
+        m = self.reload()
+        self.assertEqual((m.context_bias, m.dropout_interval, m.blacklist), (0.25, 1000, ["foo", "bar"]))
+        self.assertTrue(m.tokenTable.hasToken("hello"))
@@ -0,0 +1,92 @@
+import unittest
+import tempfile
+import shutil
+import os
+from .. import model, shards
+from .test_MModel import graph_state
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open("brianCS/training/megahal.trn") as f:
+            self.data = [l.lower() for l in f.readlines()[:30]]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shards_isolated(self):
+        s = shards.ModelShards(self.directory)
+        s.observe("a", "hello world")
+        s.observe("b", "something else")
+        self.assertTrue(s.get("a").tokenTable.hasToken("hello"))
+        self.assertFalse(s.get("b").tokenTable.hasToken("hello"))
+        self.assertEqual(s.loaded(), ["a", "b"])
+        s.close()
+
+    def test_shards_eviction(self):
+        reference = model.BrianModel()
+        s = shards.ModelShards(self.directory, memory_budget=1)
+        for line in self.data:
+            s.observe("a", line)
+            reference.observe(line)
+        with s.use("a") as a:
+            #the most recently used shard is kept even though it exceeds the budget
+            s.observe("b", "hello world")
+            self.assertEqual(s.loaded(), ["a", "b"])
+            a.observe("another message")
+            reference.observe("another message")
+        s.observe("b", "hello again")
+        self.assertEqual(s.loaded(), ["b"])
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "a.zip")))
+
+        a = s.get("a")
+        self.assertEqual(s.loaded(), ["a"])
+        self.assertEqual(a.tokenTable.save(), reference.tokenTable.save())
+        self.assertEqual(graph_state(a.genForward), graph_state(reference.genForward))
+        self.assertEqual(graph_state(a.genBackward), graph_state(reference.genBackward))
+        s.close()
+
+    def test_shards_configure(self):
+        template = model.BrianModel(dropout_interval=7)
+        template.blacklist = ["foo"]
+        s = shards.ModelShards(self.directory, template=template)
+        a = s.get("a")
+        self.assertEqual((a.dropout_interval, a.blacklist), (7, ["foo"]))
+        template.context_bias = 0.25
+        template.setStorage(model.Storage.COMPACT)
+        s.configure()
+        self.assertEqual((a.context_bias, a.storage), (0.25, model.Storage.COMPACT))
+        s.observe("a", "hello world")
+        s.close()
+
+        #settings recorded in the journal of a shard are replaced by the template when it is loaded
+        template.context_bias = 0.75
+        a = s.get("a")
+        self.assertEqual((a.context_bias, a.storage), (0.75, model.Storage.COMPACT))
+        self.assertTrue(a.tokenTable.hasToken("hello"))
+        s.close()
+
+    def test_shards_reload_journal(self):
+        template = model.BrianModel(dropout_interval=7)
+        s = shards.ModelShards(self.directory, template=template)
+        s.observe("a", "hello world")
+        s.close()
+        #reloading a shard with unchanged settings does not add records to its journal
+        for i in range(3):
+            self.assertEqual(s.get("a").journal.size(), 0)
+            s.close()
+        template.context_bias = 0.25
+        self.assertGreater(s.get("a").journal.size(), 0)
+        s.close()
+
+    def test_shards_resize(self):
+        s = shards.ModelShards(self.directory)
+        s.get("a")
+        s.get("b")
+        s.memory_budget = s.get("a").estimateMemory() + s.get("b").estimateMemory()
+        self.assertEqual(s.loaded(), ["a", "b"])
+        #a growing shard is estimated again after observing, which unloads the other one
+        s.observeMany("a", [(line, None) for line in self.data])
+        self.assertEqual(s.loaded(), ["a"])
+        s.close()
@@ -4,22 +4,43 @@
 #
 #MegaHAL chatbot implementation
 
+#Clients keep persistent connections to the wrapper. Every frame on a
+#connection is a JSON object prefixed with its length as a 4 byte big
+#endian integer. Requests carry an ID and the message text ("i" and "t"),
+#the reply carries the same ID and the answer ("i" and "r"), or an error
+#message ("e"). Requests with ID 0 are not answered. Requests are handled
+#concurrently, so a client may send several requests over the same
+#connection without waiting for their replies.
+#
+#The wrapper can run several MegaHAL processes (see MegaHALPool), each
+#with its own copy of the brain. Requests without an ID are learned by
+#all processes, requests with an ID are answered by a single process.
+#MegaHAL learns from the messages it answers as well, so the brains of
+#the processes drift apart by the messages they answered. Requests are
+#dispatched in the order they arrive.
+
 host = "localhost"
 port = 50011
 port2 = 50012
 
 import os
 import sys
+import json
+import struct
 import asyncio
 import subprocess
 import logging
+import argparse
 
-logging.basicConfig(level=logging.INFO) #set log level
 logger = logging.getLogger("MegaHAL")
 
 wd = "bin/megahal"
 binpath = "bin/megahal/megahal.exe"
 
+HEADER = struct.Struct(">I")
+PROMPT = b"\r\n> " #MegaHAL is done answering once it prompts for the next message
+INTRO_LINES = 11
+
 def bytes_in(b):
 
     """prepare bytestring for AI process"""
@@ -40,70 +61,289 @@ def stripBrackets(b):
         b = b[2:]
     return b
 
-def readMessage(stream):
+async def readFrame(reader):
 
-    """Read exactly one message from input."""
+    """Read exactly one frame from a stream. Raises asyncio.IncompleteReadError once the stream ends."""
 
-    answer = b""
-    while True: #since we are getting multiline bot answers now, we have to make sure to read until completion, even over multiple lines
-        char = stream.read(1) #be fucking careful
-        answer += char
-        if answer.endswith(b"\r\n> "): #we have to do this to ensure newlines are properly converted
-            break
-    return answer[:-3]
+    header = await reader.readexactly(HEADER.size)
+    return json.loads(await reader.readexactly(HEADER.unpack(header)[0]))
 
-proc = subprocess.Popen(binpath, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=False, cwd=wd)
-for i in range(0, 11):
-    a = proc.stdout.readline() #skip intro
+def writeFrame(writer, frame):
 
-readMessage(proc.stdout) #skip first message
+    data = json.dumps(frame, separators=(",", ":")).encode()
+    writer.write(HEADER.pack(len(data)) + data)
 
-logger.info("Startup sequence successful")
+class MegaHALProcess():
 
-loop = asyncio.get_event_loop()
+    """
+    A MegaHAL subprocess.
 
-async def handle_request(reader, writer):
+    MegaHAL reads one message at a time, so messages are passed to the process one after another.
+    """
 
-    message = await reader.read(-1)
-    if not message:
-        #We do not handle empty messages anymore... if it occurs just return a default placeholder
-        writer.write(b"There is nothing here...")
-        writer.write_eof()
-        writer.close()
-    else:
-        message += b"\n\n"
-        proc.stdin.write(bytes_in(message))
-        proc.stdin.flush()
-        if not message.startswith(b"#"): #fix for commands
-            answer = stripBrackets(bytes_out(readMessage(proc.stdout))) #read until completion
-        else:
-            answer = b"OK" #DO NOT READ ANYTHING since UN seems to suppress the 3 extra characters we usually get...
-        writer.write(answer)
-        writer.write_eof()
+    def __init__(self, command=binpath, cwd=wd):
+
+        self.command = command if isinstance(command, (list, tuple)) else [command]
+        self.cwd = cwd
+        self.proc = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+
+        #answers may be long, don't let readuntil() give up on them
+        self.proc = await asyncio.create_subprocess_exec(*self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                         cwd=self.cwd, limit=2**20)
+        for i in range(INTRO_LINES):
+            await self.proc.stdout.readline() #skip intro
+        await self.proc.stdout.readuntil(PROMPT) #skip first message
+
+    async def communicate(self, message):
+
+        """
+        Pass a message to MegaHAL and return its answer.
+        Commands (starting with #) are not answered by MegaHAL, "OK" is returned instead.
+        """
+
+        async with self._lock:
+            self.proc.stdin.write(bytes_in(message + b"\n\n"))
+            await self.proc.stdin.drain()
+            if message.startswith(b"#"):
+                return b"OK" #DO NOT READ ANYTHING since UN seems to suppress the 3 extra characters we usually get...
+            answer = await self.proc.stdout.readuntil(PROMPT) #multiline answers are read until completion
+            return stripBrackets(bytes_out(answer[:-len(PROMPT)]))
+
+    def alive(self):
+
+        return self.proc is not None and self.proc.returncode is None
+
+    async def restart(self):
+
+        """
+        Kill the process if it is still running and start a new one.
+        """
+
+        if self.alive():
+            self.proc.kill()
+            await self.proc.wait()
+        self._lock = asyncio.Lock() #the lock may be held by a request that was cancelled
+        await self.start()
+
+    async def close(self):
+
+        if self.alive():
+            try:
+                self.proc.stdin.write(b"#QUIT\r\n\r\n")
+                await self.proc.stdin.drain()
+                await asyncio.wait_for(self.proc.wait(), 5)
+            except (OSError, asyncio.TimeoutError):
+                self.proc.kill()
+                await self.proc.wait()
+
+class MegaHALPool():
+
+    """
+    A pool of MegaHAL processes.
+
+    Messages are queued and dispatched in the order they arrive. A message that needs an answer waits in
+    the queue until a process is idle, which answers it. Learned messages and commands are passed to all
+    processes, except for commands that write the brain files, which all processes share, and are only
+    passed to the first process.
+
+    A process that does not answer within timeout seconds, or that fails, is restarted.
+    """
+
+    PRIMARY_COMMANDS = (b"#SAVE",)
+
+    def __init__(self, command=binpath, cwd=wd, workers=1, timeout=30):
+
+        self.timeout = timeout
+        self.workers = [MegaHALProcess(command, cwd) for i in range(max(workers, 1))]
+        self._queue = asyncio.Queue() #messages in the order they arrived, with the future of their answer (or None)
+        self._inboxes = [asyncio.Queue() for worker in self.workers] #messages dispatched to each process
+        self._busy = [False] * len(self.workers)
+        self._idle = asyncio.Event()
+        self._tasks = []
+
+    async def start(self):
+
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        self._tasks = [asyncio.ensure_future(self._run(i)) for i in range(len(self.workers))]
+        self._tasks.append(asyncio.ensure_future(self._dispatch()))
+
+    async def _idleWorker(self):
+
+        while True:
+            for i, inbox in enumerate(self._inboxes):
+                if not self._busy[i] and inbox.empty():
+                    return i
+            self._idle.clear()
+            await self._idle.wait()
+
+    async def _dispatch(self):
+
+        while True:
+            message, future = await self._queue.get()
+            if future is None:
+                targets = [0] if message.split(b" ")[0].upper() in self.PRIMARY_COMMANDS else range(len(self.workers))
+                for i in targets:
+                    self._inboxes[i].put_nowait((message, None))
+                continue
+            self._inboxes[await self._idleWorker()].put_nowait((message, future))
+
+    async def _run(self, index):
+
+        worker = self.workers[index]
+        inbox = self._inboxes[index]
+        while True:
+            message, future = await inbox.get()
+            self._busy[index] = True
+            try:
+                if not worker.alive():
+                    logger.warning("MegaHAL process %i has exited, restarting..." % index)
+                    await worker.restart()
+                #requests that timed out while queued are still passed on, the process learns them anyway
+                answer = await asyncio.wait_for(worker.communicate(message), self.timeout)
+                if future is not None and not future.done():
+                    future.set_result(answer)
+            except Exception as e:
+                logger.exception("MegaHAL process %i failed, restarting: " % index)
+                if future is not None and not future.done():
+                    future.set_exception(RuntimeError("MegaHAL process failed: %s" % (str(e) or type(e).__name__)))
+                try:
+                    await worker.restart()
+                except Exception:
+                    logger.exception("Restarting MegaHAL process %i failed: " % index)
+            finally:
+                self._busy[index] = False
+                if inbox.empty():
+                    self._idle.set()
+
+    async def communicate(self, message, learn=False):
+
+        """
+        Pass a message to MegaHAL and return its answer.
+        If learn is True or the message is a command, the message is learned by all processes and
+        an empty answer ("OK" for commands) is returned right away.
+        """
+
+        if learn or message.startswith(b"#"):
+            self._queue.put_nowait((message, None))
+            return b"OK" if message.startswith(b"#") else b""
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((message, future))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("MegaHAL did not answer within %i seconds" % self.timeout)
+
+    async def close(self):
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await asyncio.gather(*(worker.close() for worker in self.workers))
+
+class AIServer():
+
+    """
+    Serves MegaHAL to clients of the framed protocol described at the top of this file.
+    """
+
+    def __init__(self, backend):
+
+        self.backend = backend
+        self.server = None
+        self._writers = set()
+
+    async def _handle(self, frame, writer):
+
+        message = frame["t"].encode()
+        try:
+            if not message:
+                #We do not handle empty messages anymore... if it occurs just return a default placeholder
+                reply = {"r": "There is nothing here..."}
+            else:
+                reply = {"r": (await self.backend.communicate(message, learn=not frame["i"])).decode(errors="replace")}
+        except Exception as e:
+            logger.exception("Handling request failed: ")
+            reply = {"e": str(e)}
+        if frame["i"] and not writer.is_closing():
+            reply["i"] = frame["i"]
+            writeFrame(writer, reply)
+
+    async def handle_connection(self, reader, writer):
+
+        tasks = set()
+        self._writers.add(writer)
+        try:
+            while True:
+                frame = await readFrame(reader)
+                task = asyncio.ensure_future(self._handle(frame, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        if tasks:
+            await asyncio.wait(tasks)
+        self._writers.discard(writer)
         writer.close()
 
-async def handle_console():
+    async def start(self, host=host, port=port):
+
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+
+        """
+        Stop accepting connections and close all open connections.
+        """
 
+        self.server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self.server.wait_closed()
+
+async def handle_console(backend, server):
+
+    loop = asyncio.get_running_loop()
     while True:
         cmd = await loop.run_in_executor(None, input, (""))
-        proc.stdin.write(bytes_in(cmd.encode()))
-        proc.stdin.flush()
+        if not cmd:
+            continue
         if cmd in ("#QUIT", "#EXIT"):
-            loop.stop()
-            AIServer.close()
+            await server.close()
+            await backend.close()
             return
+        print((await backend.communicate(cmd.encode())).decode(errors="replace"))
+
+async def main(args):
+
+    backend = MegaHALPool(workers=args.workers, timeout=args.timeout)
+    await backend.start()
+    logger.info("Startup sequence successful")
+
+    #set up tasks
+    logger.info("Starting AI server...")
+    server = AIServer(backend)
+    await server.start()
+
+    #Setup done, start application
+    logger.info("ProtOS Discord Bot Remote AI/MegaHAL wrapper v2.1.0")
+    logger.info("----------------------------------------------------\n")
+    logger.info("Enter MegaHAL commands using the commandline interface")
+
+    logger.info("Starting console loop...")
+    await handle_console(backend, server)
 
-#set up tasks
-logger.info("Starting AI server...")
-AIServer = asyncio.start_server(handle_request, host, port, loop=loop)
-loop.create_task(AIServer)
-logger.info("Starting console loop...")
-loop.create_task(handle_console())
+if __name__ == "__main__":
 
-#Setup done, start application
-logger.info("ProtOS Discord Bot Remote AI/MegaHAL wrapper v2.0.1")
-logger.info("----------------------------------------------------\n")
-logger.info("Enter MegaHAL commands using the commandline interface")
+    parser = argparse.ArgumentParser(description="ProtOS Discord Bot Remote AI/MegaHAL wrapper")
+    parser.add_argument("--workers", type=int, default=1, help="amount of MegaHAL processes")
+    parser.add_argument("--timeout", type=int, default=30, help="seconds to wait for an answer before restarting a MegaHAL process")
+    args = parser.parse_args()
 
-loop.run_forever()
-loop.close()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO) #set log level
+    asyncio.run(main(args))
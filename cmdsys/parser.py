@@ -137,7 +137,7 @@ class CommandParser():
 
         if response_handle.getMessage().guild:
             msg = response_handle.getMessage()
-            if len(client.db.get_db_by_message(msg).query(BlockedUser).filter(user_id=msg.author.id)) > 0: #FOUND YOU
+            if client.db.get_db_by_message(msg).query(BlockedUser).filter(user_id=msg.author.id): #FOUND YOU
                 raise PermissionDeniedException("You have been blocked from using bot commands. If you believe that this is an error please report this to the bot owner.")
 
 
@@ -259,9 +259,7 @@ class AutoPurge(Command):
                             self.logger.warn("Job %s does not exist in the database." % str(job))
                             job.to_dataset(db)
                         else:
-                            for m in q:
-                                m.last = job.last.timestamp
-                                m.save()
+                            q.update(last=job.last.timestamp)
                 except Exception as e:
                     await self.log(str(e))
                     
@@ -27,7 +27,7 @@ class BlockUser(Command):
 
         db = self.db.get_db_by_message(self.msg)
         
-        if len(db.query(BlockedUser).filter(user_id=member.id)) > 0:
+        if db.query(BlockedUser).filter(user_id=member.id):
             await self.respond("This user is already blocked.", True)
             return
 
@@ -56,7 +56,7 @@ class Unblock(Command):
         db = self.db.get_db_by_message(self.msg)
         
         q = db.query(BlockedUser).filter(user_id=member.id)
-        if len(q) < 1:
+        if not q:
             await self.respond("This user can't be unblocked since he was never blocked in the first place.", True)
             return
 
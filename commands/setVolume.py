@@ -29,10 +29,8 @@ class SetVolume(Command):
             return
 
         db = self.db.get_db(server.id)
-        q = db.query(VoiceClientSettings).filter(name="volume")
-        if q:
-            m = q[0]
-        else:
+        m = db.query(VoiceClientSettings).filter(name="volume").first()
+        if m is None:
             m = db.new(VoiceClientSettings)
             m.name = "volume"
 
@@ -50,9 +50,8 @@ class TimeoutCmd(Command):
             await self.respond("Timed %s out for %i minute(s)." % (member.name, duration))
 
             db = self.db.get_db(self.msg.guild.id)
-            q = db.query(TimeoutCount).filter(user_id=member.id)
-            if q:
-                m = q[0]
+            m = db.query(TimeoutCount).filter(user_id=member.id).first()
+            if m is not None:
                 m.count += 1
             else:
                 m = db.new(TimeoutCount)
@@ -76,11 +75,11 @@ class TimeoutCmd(Command):
     async def getRole(self):
 
         db = self.db.get_db(self.msg.guild.id)
-        q = db.query(TimeoutRole)
-        if len(q) < 1:
+        m = db.query(TimeoutRole).first()
+        if m is None:
             return None
 
-        name = q[0].role_id
+        name = m.role_id
 
         for role in self.msg.guild.roles:
             if role.id == name:
@@ -33,11 +33,11 @@ class VoiceJoin(Command):
 
         #Load audio configuration for server
         db = self.db.get_db(self.msg.guild.id)
-        q = db.query(VoiceClientSettings).filter(name="volume")
-        if not q:
+        m = db.query(VoiceClientSettings).filter(name="volume").first()
+        if m is None:
             return
 
-        volume = q[0].value
+        volume = m.value
         if volume in (None, "None"): #Some dataset weirdness
             return
 
@@ -31,7 +31,7 @@ class MakeWeeb(Command):
             return
 
         db = self.db.get_db("global") #use some global database
-        if len(db.query(WeebModel).filter(user_id=member.id)) > 0:
+        if db.query(WeebModel).filter(user_id=member.id):
             #user is already a weeb. FCKIN WEB LULZ
             await self.respond("That user is already a filthy weeb.", True)
             return
@@ -48,7 +48,7 @@ class _NeedWeeb(Command):
     async def call(self, **kwargs):
 
         db = self.db.get_db("global") #use some global database
-        if len(db.query(WeebModel).filter(user_id=self.msg.author.id)) < 1:
+        if not db.query(WeebModel).filter(user_id=self.msg.author.id):
             await self.respond("Only believers in the god of anime may use this command.", True)
             return
 
@@ -6,9 +6,15 @@
 
 import asyncio
 import logging
+import os
+import time
+import json
+import struct
 import functools as ft
 
 from brianCS import BrianModel
+from brianCS.shards import ModelShards
+from brianCS.server import ModelServer
 from brianCS.enums import *
 HAS_GASSIST = True
 try: #GAssist package is optional
@@ -54,12 +60,20 @@ class ConversationSimulator():
         available through the standard command getHelp feature. Note that even if this
         option is not implemented, the option interface is still available.
 
+    Messages passed to queueObserve() are buffered and observed in batches using observeMany(),
+    either once bot.chat.observe_batch messages are queued or bot.chat.observe_delay milliseconds
+    after the first message was queued. Implementations that can apply many messages at once
+    should override observeMany(). Statistics on the queue are available through observeStats().
+
     This is an abstract class and should not be instanciated directly.
     """
 
     logger = logging.getLogger("ConversationSimulator")
     name = "GenericConversationSimulator"
 
+    OBSERVE_DELAY = 50 #ms
+    OBSERVE_BATCH = 100
+
     def __init__(self, client: "ProtosBot", config: "ConfigManager"):
 
         """
@@ -73,6 +87,13 @@ class ConversationSimulator():
         self.client = client
         self.config = config
 
+        self.observe_delay = config.getElementInt("bot.chat.observe_delay", self.OBSERVE_DELAY) / 1000
+        self.observe_batch = config.getElementInt("bot.chat.observe_batch", self.OBSERVE_BATCH)
+        self._observeQueue = [] #queued messages along with the time they were queued at
+        self._observeLock = asyncio.Lock() #batches are observed one at a time and in order
+        self._observeTimer = None
+        self._observeStats = {"batches": 0, "messages": 0, "latency": 0.0, "max_latency": 0.0, "total_latency": 0.0}
+
     async def observe(self, msg: "discord.Message"):
 
         """
@@ -87,6 +108,84 @@ class ConversationSimulator():
 
         pass
 
+    async def observeMany(self, msgs: list):
+
+        """
+        Observe a batch of messages, in order.
+
+        By default this calls observe() for every message.
+        """
+
+        for msg in msgs:
+            await self.observe(msg)
+
+    async def queueObserve(self, msg: "discord.Message"):
+
+        """
+        Queue a message to be observed in the next batch.
+
+        This only waits for the batch to be observed if the queue is full.
+        """
+
+        self._observeQueue.append((msg, time.perf_counter()))
+        if len(self._observeQueue) >= self.observe_batch:
+            await self.flushObserve()
+        elif self._observeTimer is None:
+            self._observeTimer = self.client.loop.create_task(self._observeLater())
+
+    async def _observeLater(self):
+
+        await asyncio.sleep(self.observe_delay)
+        self._observeTimer = None
+        await self.flushObserve()
+
+    async def flushObserve(self):
+
+        """
+        Observe all queued messages.
+
+        Messages queued while a batch is observed are part of the next batch.
+        """
+
+        async with self._observeLock:
+            batch, self._observeQueue = self._observeQueue, []
+            if not batch:
+                return
+            try:
+                await self.observeMany([msg for msg, queued in batch])
+            except Exception:
+                self.logger.exception("Observing %i message(s) failed." % len(batch))
+
+            #the latency of a batch is the time its oldest message spent in the queue and being observed
+            latency = time.perf_counter() - batch[0][1]
+            stats = self._observeStats
+            stats["batches"] += 1
+            stats["messages"] += len(batch)
+            stats["latency"] = latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            stats["total_latency"] += latency
+
+    def observeStats(self) -> dict:
+
+        """
+        Return statistics on the observe queue.
+
+        depth is the amount of queued messages, batches and messages count the observed batches
+        and messages. latency, mean_latency and max_latency are the last, mean and highest flush
+        latency in seconds, measured from queueing the oldest message of a batch until the batch
+        was observed.
+        """
+
+        stats = self._observeStats
+        return {
+            "depth": len(self._observeQueue),
+            "batches": stats["batches"],
+            "messages": stats["messages"],
+            "latency": stats["latency"],
+            "mean_latency": stats["total_latency"] / stats["batches"] if stats["batches"] else 0.0,
+            "max_latency": stats["max_latency"]
+            }
+
     async def respond(self, msg: "discord.Message") -> str:
 
         """
@@ -114,6 +213,79 @@ class ConversationSimulator():
 
         raise NotImplementedError("Unsupported option %s" % key)
 
+    async def close(self):
+
+        """
+        Release all resources held by this CS. Called once when the bot shuts down.
+
+        The default implementation observes all queued messages. Implementations
+        holding connections, processes or files should close them after calling it.
+        """
+
+        if self._observeTimer is not None:
+            self._observeTimer.cancel()
+            self._observeTimer = None
+        await self.flushObserve()
+
+class _MegaHALConnection():
+
+    """
+    A persistent connection to the MegaHAL wrapper (see chatbot.py for the protocol).
+    Any amount of requests may be in flight on a connection.
+    """
+
+    HEADER = struct.Struct(">I")
+
+    def __init__(self, reader, writer):
+
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        self.pending = {} #futures of requests waiting for their reply by request ID
+        self._receiver = asyncio.ensure_future(self._receive())
+
+    async def _receive(self):
+
+        try:
+            while True:
+                header = await self.reader.readexactly(self.HEADER.size)
+                frame = json.loads(await self.reader.readexactly(self.HEADER.unpack(header)[0]))
+                future = self.pending.pop(frame["i"], None)
+                if future is None or future.done():
+                    continue
+                if "e" in frame:
+                    future.set_exception(RuntimeError(frame["e"]))
+                else:
+                    future.set_result(frame["r"])
+        except (asyncio.IncompleteReadError, OSError, ValueError):
+            pass
+
+        self.closed = True
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection to AI server lost."))
+        self.pending.clear()
+        self.writer.close()
+
+    def send(self, id, text):
+
+        """
+        Send a request. If id is not 0, a future resolving to the reply is returned.
+        """
+
+        data = json.dumps({"i": id, "t": text}, separators=(",", ":")).encode()
+        self.writer.write(self.HEADER.pack(len(data)) + data)
+        if id:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[id] = future
+            return future
+        return None
+
+    async def close(self):
+
+        self.writer.close()
+        await self._receiver
+
 class MegaHAL(ConversationSimulator):
 
     """
@@ -126,6 +298,10 @@ class MegaHAL(ConversationSimulator):
     when connecting to the remote MegaHAL instance. This wrapper
     supports standard MegaHAL commands and exposes them through the
     setOpt/getOpt interface.
+
+    Connections to the wrapper are kept open and shared by all requests.
+    Up to bot.network.AI.connections connections are opened, a new one
+    only once all open connections are waiting for replies.
     """
 
     COMMANDS = [
@@ -147,15 +323,19 @@ class MegaHAL(ConversationSimulator):
         super().__init__(client, config)
         self.ip = config.getElementText("bot.network.AI.IP", "localhost")
         self.port = config.getElementInt("bot.network.AI.port", 50011)
+        self.connections = config.getElementInt("bot.network.AI.connections", 2)
+        self._pool = []
+        self._connectLock = asyncio.Lock()
+        self._nextID = 0
 
-    def _prepareMessage(self, msg: "discord.Message") -> bytes:
+    def _prepareMessage(self, msg: "discord.Message") -> str:
 
         """
-        Prepares a chat message for export to the AI process via local IPv4 loopback
+        Prepares a chat message for export to the AI process
         """
 
-        s = msg.content.replace("<@" + self.client.user.id + ">", "") #make sure the bot mention doesn't show up if it was input
-        s = s.replace("<@!" + self.client.user.id + ">", "") #secondary mention format
+        s = msg.content.replace("<@" + str(self.client.user.id) + ">", "") #make sure the bot mention doesn't show up if it was input
+        s = s.replace("<@!" + str(self.client.user.id) + ">", "") #secondary mention format
         s = s.lstrip(" ,") #Do this last so there aren't any unnecessary spaces left
 
         #command blacklisting
@@ -166,10 +346,24 @@ class MegaHAL(ConversationSimulator):
             s = s.replace("\n\n", "\n") #Injection protection. Not an ACE or anything but it was causing trouble with linefeeds and also allowed users to insert AI commands directly into the subprocess by using modified messages.
             
         if not s: #we deleted everything... WELL
-            return None
+            return ""
         if not (s[-1] in ["?", "!", "."]): #this checks if the sentence was properly terminated
             s += "." #add a period to tell the AI that the sentence ends here, otherwise it will fuck up mentions and emotes
-        return s.encode() #prepare message for network transfer
+        return s
+
+    async def _connection(self):
+
+        """
+        Return a connection to the AI server, opening a new one if all open connections are busy.
+        """
+
+        async with self._connectLock:
+            self._pool = [c for c in self._pool if not c.closed]
+            if len(self._pool) < max(self.connections, 1) and all(c.pending for c in self._pool):
+                reader, writer = await asyncio.open_connection(self.ip, self.port)
+                self._pool.append(_MegaHALConnection(reader, writer))
+                return self._pool[-1]
+            return min(self._pool, key=lambda c: len(c.pending))
 
     async def _communicate(self, text, wait):
 
@@ -178,34 +372,39 @@ class MegaHAL(ConversationSimulator):
         """
 
         try:
-            reader, writer = await asyncio.open_connection(self.ip, self.port, loop=self.client.loop) #open connection to the AI
-        except:
+            connection = await self._connection()
+        except OSError:
             self.logger.exception("Error while trying to connect to AI server: ")
             return "Error: Connection to AI server could not be established."
     
         try:
-            writer.write(text)
-            if writer.can_write_eof():
-                writer.write_eof()
-        except:
+            self._nextID += 1
+            future = connection.send(self._nextID if wait else 0, text)
+            await connection.writer.drain()
+        except OSError:
             self.logger.exception("An error occured while communicating with AI process: ")
             return "Error: Communication with host process failed."
 
         if wait:
             try:
-                result = await reader.read(-1)
-                writer.close()
-            except:
+                return await future
+            except (RuntimeError, ConnectionError):
                 self.logger.exception("An error occured while retrieving the result: ")
                 return "Error: No response from host process."
-            return result.decode()
-    
-        try:
-            writer.close()
-        except:
-            pass
         return ""
 
+    async def close(self):
+
+        """
+        Close all connections to the AI server.
+        Requests still waiting for their reply fail with a ConnectionError.
+        """
+
+        await super().close()
+        pool, self._pool = self._pool, []
+        for connection in pool:
+            await connection.close()
+
     async def observe(self, msg):
 
         text = self._prepareMessage(msg)
@@ -241,7 +440,7 @@ class MegaHAL(ConversationSimulator):
         argstr = " ".join(args)
         cmd = "#%s %s" % (key, argstr)
         self.logger.debug("Executing MegaHAL command '%s'" % cmd)
-        await self._communicate(cmd.encode(), False)
+        await self._communicate(cmd, False)
 
     async def getOpt(self, key):
 
@@ -289,16 +488,71 @@ class BrianCS(ConversationSimulator):
     This CS runs inside the main application. By default, it does not
     provide a networking interface or multi core processing options.
     It is threaded however.
+
+    Changes to the model are recorded in a journal. Regular SAVE requests
+    only sync the journal to disk, full snapshots of the model are written
+    once the journal grows too large. The journal is replayed on startup.
+
+    If bot.chat.brian.sharded is set to 1, every guild gets its own model
+    (see brianCS/shards.py). Guilds can share a model by listing them in a group:
+
+        <groups><group name="friends"><guild>1234</guild><guild>5678</guild></group></groups>
+
+    Shards are loaded on demand and unloaded once they exceed bot.chat.brian.memory_budget
+    (in MiB). Options apply to all shards. Loading and saving backups is not supported in
+    sharded mode.
+
+    If bot.chat.brian.process is set to 1, the model runs in a child process instead (see
+    brianCS/server.py), which keeps model work from blocking the event loop. This is not
+    supported in sharded mode.
     """
 
     name = "Brian CS"
     MODEL_PATH = "brianCS/model.zip"
+    JOURNAL_PATH = "brianCS/model.journal"
+    SHARD_DIRECTORY = "brianCS/shards"
+    TEMPLATE_PATH = "brianCS/shard_template.zip"
 
     def __init__(self, client, config):
 
         super().__init__(client, config)
-        self.model = BrianModel() #TODO: Add model configuration from config file for new models
-        self.model.load(self.MODEL_PATH)
+        self.shards = None
+        self.server = None
+        self.groups = {}
+        self._maintenance = {}
+        workers = config.getElementInt("bot.chat.brian.workers", 0)
+        process = config.getElementInt("bot.chat.brian.process", 0)
+
+        if config.getElementInt("bot.chat.brian.sharded", 0):
+            if process:
+                self.logger.warning("Running the model in a child process is not supported in sharded mode.")
+            #self.model only holds the configuration shared by all shards
+            self.model = BrianModel()
+            if os.path.exists(self.TEMPLATE_PATH):
+                self.model.load(self.TEMPLATE_PATH)
+            self.model.auto_maintenance = False #dropout is scheduled in the background, see _scheduleMaintenance()
+            budget = config.getElementInt("bot.chat.brian.memory_budget", 512) * 2**20
+            self.shards = ModelShards(self.SHARD_DIRECTORY, budget, self.model)
+            groups = config.getElement("bot.chat.brian.groups")
+            if groups is not None:
+                for group in groups:
+                    for guild in group:
+                        self.groups[guild.text.strip()] = group.get("name")
+        elif process:
+            #self.model only holds the configuration of the served model, it is updated once the server has loaded the model
+            self.model = BrianModel()
+            self.server = ModelServer(self.MODEL_PATH, self.JOURNAL_PATH, self.model, workers)
+        else:
+            self.model = BrianModel() #TODO: Add model configuration from config file for new models
+            self.model.load(self.MODEL_PATH)
+            self.model.openJournal(self.JOURNAL_PATH)
+            self.model.auto_maintenance = False #dropout is scheduled in the background, see _scheduleMaintenance()
+
+        #reply candidates can be generated by worker processes, each holding a copy of the model
+        if workers > 0 and self.shards is not None:
+            self.logger.warning("Generator workers are not supported in sharded mode.")
+        elif workers > 0 and self.server is None:
+            self.model.startWorkers(workers)
 
         def positive(x):
 
@@ -342,7 +596,12 @@ class BrianCS(ConversationSimulator):
             "prediction_time": [self.getPredictionTime, self.setPredictionTime, positive_float],
             "dropout_factor": [self.getDropoutFactor, self.setDropoutFactor, positive_float],
             "dropout": [self.getDropout, self.setDropout, ft.partial(enum_name, Dropout)],
-            "dropout_curve": [self.getDropoutCurve, self.setDropoutCurve, ft.partial(enum_name, DropoutCurve)]
+            "dropout_curve": [self.getDropoutCurve, self.setDropoutCurve, ft.partial(enum_name, DropoutCurve)],
+            "dropout_interval": [self.getDropoutInterval, self.setDropoutInterval, positive_nz],
+            "dropout_period": [self.getDropoutPeriod, self.setDropoutPeriod, positive_float],
+            "storage": [self.getStorage, self.setStorage, ft.partial(enum_name, Storage)],
+            "save_format": [self.getSaveFormat, self.setSaveFormat, ft.partial(enum_name, ModelFormat)],
+            "observe_stats": [self.observeStats, not_implemented, str]
             }
 
     def addToBlacklist(self, name: str):
@@ -403,17 +662,83 @@ class BrianCS(ConversationSimulator):
     def setDropoutCurve(self, t: DropoutCurve):
         self.model.dropout_curve = t
 
-    def load(self, path=None):
+    def getDropoutInterval(self) -> int:
+        return self.model.dropout_interval
 
-        if not path:
-            path = self.MODEL_PATH
-        self.model.load(path)
+    def setDropoutInterval(self, t: int):
+        self.model.dropout_interval = t
 
-    def save(self, path=None):
+    def getDropoutPeriod(self) -> float:
+        return self.model.dropout_period
 
-        if not path:
-            path = self.MODEL_PATH
-        self.model.save(path)
+    def setDropoutPeriod(self, t: float):
+        self.model.dropout_period = t
+
+    def getStorage(self) -> Storage:
+        return self.model.storage
+
+    def setStorage(self, t: Storage):
+        self.model.setStorage(t)
+
+    def getSaveFormat(self) -> ModelFormat:
+        return self.model.save_format
+
+    def setSaveFormat(self, t: ModelFormat):
+        self.model.save_format = t
+
+    def _load(self, path=None):
+
+        if self.shards is not None:
+            if path:
+                raise NotImplementedError("Loading backups is not supported in sharded mode.")
+            #shards are reloaded from their snapshots and journals once they are used again
+            self.shards.close()
+        elif not path:
+            self.model.load(self.MODEL_PATH)
+            self.model.openJournal(self.JOURNAL_PATH)
+        else:
+            #the backup replaces the current state, which makes the journal obsolete
+            self.model.load(path)
+            self.model.compact(self.MODEL_PATH)
+
+    async def load(self, path=None):
+
+        if self.server is not None:
+            await self.server.load(path)
+        else:
+            await self.client.loop.run_in_executor(None, self._load, path)
+
+    async def save(self, path=None):
+
+        #the model is only locked while its state is copied, the file is written in the background
+        if self.shards is not None:
+            if path:
+                raise NotImplementedError("Saving backups is not supported in sharded mode.")
+            await self.client.loop.run_in_executor(None, self.shards.checkpoint)
+        elif self.server is not None:
+            await self.server.save(path)
+        elif not path:
+            await self.client.loop.run_in_executor(None, self.model.checkpoint, self.MODEL_PATH)
+        else:
+            await self.client.loop.run_in_executor(None, self.model.save, path)
+
+    async def close(self):
+
+        """
+        Wait for running maintenance passes and stop the model.
+        The server process is stopped, the shards are unloaded or the journal of the model is closed.
+        """
+
+        await super().close()
+        if self._maintenance:
+            await asyncio.gather(*self._maintenance.values(), return_exceptions=True)
+        if self.server is not None:
+            await self.server.close()
+        elif self.shards is not None:
+            await self.client.loop.run_in_executor(None, self.shards.close)
+        else:
+            await self.client.loop.run_in_executor(None, self.model.closeJournal)
+        self.model.stopWorkers()
 
     def _prepareMessage(self, msg):
 
@@ -429,20 +754,105 @@ class BrianCS(ConversationSimulator):
             return None
         return s
 
+    def _shardKey(self, msg):
+
+        """
+        Return the key of the shard a message belongs to.
+        Direct messages share a single shard.
+        """
+
+        if msg.guild is None:
+            return "direct"
+        guild = str(msg.guild.id)
+        return self.groups.get(guild, guild)
+
+    def _scheduleMaintenance(self, key=None):
+
+        """
+        Start the maintenance pass of the model (or of the shard key) in the background if it is due and not already running.
+        """
+
+        if key in self._maintenance:
+            return
+        if self.shards is None:
+            if not self.model.maintenanceDue():
+                return
+            func = self.model.maintain
+        else:
+            if not self.shards.maintenanceDue(key):
+                return
+            func = ft.partial(self.shards.maintain, key)
+        self._maintenance[key] = self.client.loop.create_task(self._maintain(key, func))
+
+    async def _maintain(self, key, func):
+
+        try:
+            await self.client.loop.run_in_executor(None, func)
+        except Exception:
+            self.logger.exception("Model maintenance failed.")
+        finally:
+            del self._maintenance[key]
+
     async def observe(self, msg):
 
         t = self._prepareMessage(msg)
-        await self.client.loop.run_in_executor(None, self.model.observe, t.lower(), str(msg.channel.id))
+        if self.server is not None:
+            #maintenance is scheduled by the server process
+            await self.server.observe(t.lower(), str(msg.channel.id))
+        elif self.shards is None:
+            await self.client.loop.run_in_executor(None, self.model.observe, t.lower(), str(msg.channel.id))
+            self._scheduleMaintenance()
+        else:
+            key = self._shardKey(msg)
+            await self.client.loop.run_in_executor(None, self.shards.observe, key, t.lower(), str(msg.channel.id))
+            self._scheduleMaintenance(key)
+
+    async def observeMany(self, msgs):
+
+        messages = []
+        for msg in msgs:
+            t = self._prepareMessage(msg)
+            if t:
+                messages.append((msg, t.lower(), str(msg.channel.id)))
+
+        if self.server is not None:
+            for msg, t, conversation in messages:
+                await self.server.observe(t, conversation)
+        elif self.shards is None:
+            await self.client.loop.run_in_executor(None, self.model.observeMany, [(t, conversation) for msg, t, conversation in messages])
+            self._scheduleMaintenance()
+        else:
+            shards = {}
+            for msg, t, conversation in messages:
+                shards.setdefault(self._shardKey(msg), []).append((t, conversation))
+            for key, batch in shards.items():
+                await self.client.loop.run_in_executor(None, self.shards.observeMany, key, batch)
+                self._scheduleMaintenance(key)
 
     async def respond(self, msg):
         
         t = self._prepareMessage(msg)
-        res = await self.client.loop.run_in_executor(None, self.model.respond, t.lower(), str(msg.channel.id))
+        if self.server is not None:
+            res = await self.server.respond(t.lower(), str(msg.channel.id))
+        elif self.shards is None:
+            res = await self.client.loop.run_in_executor(None, self.model.respond, t.lower(), str(msg.channel.id))
+            self._scheduleMaintenance()
+        else:
+            key = self._shardKey(msg)
+            res = await self.client.loop.run_in_executor(None, self.shards.respond, key, t.lower(), str(msg.channel.id))
+            self._scheduleMaintenance(key)
 
         return res
 
+    def _configureShards(self):
+
+        self.shards.configure()
+        self.model.save(self.TEMPLATE_PATH)
+
     async def getOpt(self, key):
         
+        if self.server is not None:
+            await self.server.start() #the configuration is known once the server has loaded the model
         if key == "HELP":
             opts = ["HELP"]
             opts.extend(self.options.keys())
@@ -455,13 +865,21 @@ class BrianCS(ConversationSimulator):
     async def setOpt(self, key, value):
 
         if key == "SAVE":
-            self.save(value)
+            await self.save(value)
         elif key == "LOAD":
-            self.load(value)
+            await self.load(value)
         elif key in self.options:
+            if self.server is not None:
+                await self.server.start()
             get, set, t = self.options[key]
             value = t(value)
             set(value)
+            if self.server is not None:
+                await self.server.configure()
+            elif self.shards is None:
+                self.model.recordSettings()
+            else:
+                await self.client.loop.run_in_executor(None, self._configureShards)
 
         else:
             raise NotImplementedError("Unsupported option %s" % key)
@@ -1,5 +1,8 @@
-from typing import Type, TypeVar, Sequence, Mapping
+from typing import Type, TypeVar, Sequence, Mapping, Tuple, Callable, Hashable, Iterable, Iterator, Optional
 from pathlib import Path
+from collections import OrderedDict
+from operator import itemgetter
+import itertools
 import logging
 
 import sqlite3
@@ -16,11 +19,23 @@ class DatabaseEngine():
 
     """
     Abstract DatabaseEngine interface.
+
+    Query results are cached per model, until a record of the model, or of any other model read by the
+    filters of the query, is inserted, updated or deleted through this engine (see fetch()). Changes made
+    by other connections to the same database are not tracked, call clear_cache() after making them.
+    Only results of at most CACHE_ROWS rows are cached, so large results are not kept in memory.
     """
 
+    CACHE_SIZE = 256 #maximum amount of cached query results per model, 0 disables the cache
+    CACHE_ROWS = 32 #maximum amount of rows of a cached query result, larger results are not cached
+
     def __init__(self):
 
         self.logger = logging.getLogger("database."+self.__class__.__name__)
+        self._cache = {} #query result rows by model, query and parameters
+        self._dependents = {} #models whose cached results read other models, by the model they read
+        self._cache_hits = 0
+        self._cache_misses = 0
 
     def connect(self, *args, **kwargs):
 
@@ -47,34 +62,51 @@ class DatabaseEngine():
 
         pass
 
-    def _query(self, model_cls: Type[Model], filters: Sequence[Filter]) -> str:
+    def _query(self, query: Query, limit: Optional[int] = None) -> Tuple[str, Sequence[object]]:
 
         """
-        Query the database for models.
-        model_cls is the Model subclass of the corresponding table.
-        filters is a sequence of Filter instances applying restrictions to the query.
-        returns a sequence fof Model instances.
+        Query the database for the models described by query, applying its filters, ordering, limit and offset.
+        If limit is not None, at most limit models are returned.
+        returns the query and its parameters.
+        """
+
+        pass
+
+    def _count(self, query: Query) -> Tuple[str, Sequence[object]]:
+
+        """
+        Count the records described by query. The query must return a single row holding the count.
+        """
+
+        pass
+
+    def _exists(self, query: Query) -> Tuple[str, Sequence[object]]:
+
+        """
+        Check whether any record described by query exists. The query must return a single row holding a boolean value.
         """
 
         pass
 
-    def _insert(self, model: Model) -> str:
+    def _insert(self, model: Model) -> Tuple[str, Sequence[object]]:
 
         """
         Insert a new Model instance into the database.
+        Like all query builders, this returns the query and its parameters. Values are always passed
+        as parameters, so queries of the same shape share the same SQL and can be cached by the database.
         """
 
-        return model
+        pass
 
-    def _update(self, model: Model) -> str:
+    def _update(self, model: Model) -> Tuple[str, Sequence[object]]:
 
         """
         Update a Model instance on the database.
         """
 
-        return model
+        pass
 
-    def _delete(self, model: Model) -> str:
+    def _delete(self, model: Model) -> Tuple[str, Sequence[object]]:
 
         """
         Delete a Model isntance from the database.
@@ -91,6 +123,24 @@ class DatabaseEngine():
 
         raise NotImplementedError()
 
+    def _bulk_update(self, query: Query, values: Mapping[str, object]):
+
+        """
+        Bulk update all records described by query, setting fields to the values in values.
+        Implementing this method is OPTIONAL.
+        """
+
+        raise NotImplementedError()
+
+    def _bulk_insert(self, models: Sequence[Model]):
+
+        """
+        Insert several new Model instances into the database and update them with the values generated by the database.
+        Implementing this method is OPTIONAL.
+        """
+
+        raise NotImplementedError()
+
     def _begin_transaction(self):
 
         """
@@ -107,14 +157,61 @@ class DatabaseEngine():
 
         pass
 
+    def _in_transaction(self) -> bool:
+
+        """
+        Return True if a transaction is open.
+        """
+
+        return False
+
     def _execute(self, query: str, args: Sequence[object] = [], kwargs: Mapping[str, object] = []) -> None:
 
         pass
 
-    def _fetch(self, model_cls: Type[Model]) -> Sequence[Model]:
+    def _execute_many(self, query: str, args: Iterable[Sequence[object]]) -> None:
+
+        """
+        Execute a query once for every sequence of arguments.
+        """
+
+        for a in args:
+            self._execute(query, a)
+
+    def _fetch_rows(self) -> Sequence[tuple]:
+
+        """
+        Return the rows returned by the last executed query.
+        """
 
         pass
 
+    def _fetch_batches(self, query: str, args: Sequence[object]) -> Iterator[Sequence[tuple]]:
+
+        """
+        Execute a query and yield the rows it returns in batches.
+        Other queries may be executed while the rows are consumed.
+        """
+
+        self._execute(query, args)
+        yield self._fetch_rows()
+
+    def _load(self, model_cls: Type[Model], rows: Sequence[tuple]) -> Sequence[Model]:
+
+        """
+        Create bound Model instances from rows of field values.
+        """
+
+        models = []
+        for row in rows:
+            model = model_cls()
+            model.connect_engine(self)
+            for field, value in zip(model._fields.values(), row):
+                field._set_field(value)
+            model._bound = True
+            models.append(model)
+        return models
+
     def _commit(self):
 
         """
@@ -131,8 +228,8 @@ class DatabaseEngine():
         """
 
         bound = model._bound
-        query = self._update(model) if bound else self._insert(model)
-        self._execute(query)
+        query, args = self._update(model) if bound else self._insert(model)
+        self._execute(query, args)
         model._bound = True
 
         if bound:
@@ -140,6 +237,37 @@ class DatabaseEngine():
         else:
             self.on_insert(model)
 
+    def save_many(self, models: Iterable[Model]):
+
+        """
+        Save several model instances at once.
+        This has the same effect as calling save() on every instance, but all of them are saved in a single transaction,
+        and queries of the same shape are executed as a batch.
+        """
+
+        models = list(models)
+        for model in models:
+            model._validate()
+
+        if self._in_transaction():
+            self._save_many(models)
+        else:
+            with self.transaction():
+                self._save_many(models)
+
+    def _save_many(self, models):
+
+        updates = [model for model in models if model._bound]
+        #consecutive updates of the same shape are executed at once, which keeps their order
+        statements = [(*self._update(model), model) for model in updates]
+        for query, group in itertools.groupby(statements, key=itemgetter(0)):
+            group = list(group)
+            self._execute_many(query, [args for q, args, model in group])
+            for q, args, model in group:
+                self.on_update(model)
+
+        self.bulk_insert([model for model in models if not model._bound])
+
     def delete(self, model: Model):
 
         """
@@ -147,20 +275,127 @@ class DatabaseEngine():
         Do not call this method directly. Call it on the model instance instead.
         """
 
-        self._execute(self._delete(model))
+        self._execute(*self._delete(model))
         model._bound = False
 
         self.on_delete(model)
 
-    def fetch(self, query: Query) -> Sequence[Model]:
+    def _cached(self, query: Query, statement: str, args: Sequence[object]) -> Optional[Sequence[tuple]]:
+
+        """
+        Return the cached rows of a statement executed for a query, or None if they are not cached.
+        """
+
+        cache = self._cache.get(query._model)
+        key = (statement, tuple(args))
+        rows = cache.get(key) if cache is not None else None
+        if rows is not None:
+            self._cache_hits += 1
+            cache.move_to_end(key)
+        else:
+            self._cache_misses += 1
+        return rows
+
+    def _rows(self, query: Query, statement: str, args: Sequence[object]) -> Sequence[tuple]:
+
+        """
+        Return the rows of a statement executed for a query, from the cache if possible.
+        """
+
+        rows = self._cached(query, statement, args)
+        if rows is None:
+            self._execute(statement, args)
+            rows = tuple(self._fetch_rows())
+            if self.CACHE_SIZE > 0 and len(rows) <= self.CACHE_ROWS:
+                model_cls = query._model
+                #results reading other models have to be dropped when those change, too (see invalidate())
+                for f in query._filters:
+                    for other in f.models():
+                        if other is not model_cls:
+                            self._dependents.setdefault(other, set()).add(model_cls)
+                cache = self._cache.setdefault(model_cls, OrderedDict())
+                cache[(statement, tuple(args))] = rows
+                if len(cache) > self.CACHE_SIZE:
+                    cache.popitem(last=False)
+        return rows
+
+    def fetch(self, query: Query, limit: Optional[int] = None) -> Sequence[Model]:
 
         """
-        Execute a query on the database.
+        Execute a query on the database and return all models it describes, or at most limit models.
         Do not call this method directly. Instead, use DatabaseEngine.query() to create a query and use its execute() method.
         """
 
-        self._execute(self._query(query._model, query._filters))
-        return self._fetch(query._model)
+        #models are created for every query, so changing them does not affect the cached rows
+        return self._load(query._model, self._rows(query, *self._query(query, limit)))
+
+    def stream(self, query: Query) -> Iterator[Model]:
+
+        """
+        Execute a query on the database and yield the models it describes.
+        Rows are read in batches, so only a batch of models is held in memory at a time. Results are
+        only cached by fetch(), streamed results are not, but cached results are used if available.
+        Do not call this method directly. Iterate over the query instead.
+        """
+
+        statement, args = self._query(query)
+        rows = self._cached(query, statement, args)
+        if rows is not None:
+            yield from self._load(query._model, rows)
+            return
+        for batch in self._fetch_batches(statement, args):
+            yield from self._load(query._model, batch)
+
+    def count(self, query: Query) -> int:
+
+        """
+        Return the amount of records described by a query, without fetching them.
+        Do not call this method directly. Use len() on the query instead.
+        """
+
+        return self._rows(query, *self._count(query))[0][0]
+
+    def exists(self, query: Query) -> bool:
+
+        """
+        Return True if any record described by a query exists, without fetching it.
+        Do not call this method directly. Use bool() on the query instead.
+        """
+
+        return bool(self._rows(query, *self._exists(query))[0][0])
+
+    def invalidate(self, model_cls: Type[Model]):
+
+        """
+        Drop all cached query results of a model, and those of other models whose queries read it.
+        """
+
+        self._cache.pop(model_cls, None)
+        for dependent in self._dependents.pop(model_cls, ()):
+            self._cache.pop(dependent, None)
+
+    def clear_cache(self):
+
+        """
+        Drop all cached query results.
+        """
+
+        self._cache.clear()
+        self._dependents.clear()
+
+    def cache_stats(self) -> Mapping[str, object]:
+
+        """
+        Return the amount of query cache hits and misses, the hit rate and the amount of cached results.
+        """
+
+        total = self._cache_hits + self._cache_misses
+        return {
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "hit_rate": self._cache_hits / total if total else 0.0,
+            "entries": sum(map(len, self._cache.values()))
+            }
 
     def query(self, model_cls: Type[Model]) -> Query:
 
@@ -197,9 +432,23 @@ class DatabaseEngine():
         Subclass hook for insert events.
 
         This method is called every time a model instance is inserted with the instance as a single argument.
+        Subclasses must call this implementation, which invalidates the cached query results of the model.
         """
 
-        pass
+        self.invalidate(model.__class__)
+
+    def on_bulk_insert(self, models: Sequence[Model]):
+
+        """
+        Subclass hook for bulk insert events.
+
+        This method is called with a list of the inserted instances every time instances are inserted by _bulk_insert(),
+        instead of calling on_insert() for every instance.
+        Subclasses must call this implementation, which invalidates the cached query results of their models.
+        """
+
+        for model_cls in {model.__class__ for model in models}:
+            self.invalidate(model_cls)
 
     def on_update(self, model: Model):
 
@@ -207,9 +456,10 @@ class DatabaseEngine():
         Subclass hook for update events.
 
         This method is called every time a model instance is updated in the database with the instance as a single argument.
+        Subclasses must call this implementation, which invalidates the cached query results of the model.
         """
 
-        pass
+        self.invalidate(model.__class__)
 
     def on_delete(self, model: Model):
 
@@ -217,9 +467,10 @@ class DatabaseEngine():
         Subclass hook for deletion events.
 
         This method is called every time a model instance is deleted from the database with the instance as a single argument.
+        Subclasses must call this implementation, which invalidates the cached query results of the model.
         """
 
-        pass
+        self.invalidate(model.__class__)
 
     def transaction(self) -> Transaction:
 
@@ -231,15 +482,60 @@ class DatabaseEngine():
 
         return Transaction(self)
 
+    def bulk_insert(self, models: Sequence[Model]):
+
+        """
+        Insert several unbound model instances.
+        Do not call this method directly. Use save_many() instead.
+        """
+
+        if not models:
+            return
+        try:
+            self._bulk_insert(models)
+        except NotImplementedError as e:
+            #fall back on simple insert
+            for m in models:
+                self.save(m)
+            return
+        for m in models:
+            m._bound = True
+        self.on_bulk_insert(models)
+
     def bulk_delete(self, query: Query):
 
+        """
+        Delete all records described by query.
+        Do not call this method directly. Use Query.delete() instead.
+        """
+
         try:
-            self._execute(self._bulk_delete(query))
+            self._execute(*self._bulk_delete(query))
+            self.invalidate(query._model)
         except NotImplementedError as e:
             #fall back on simple delete
-            for m in query:
+            for m in query.all():
                 m.delete()
 
+    def bulk_update(self, query: Query, values: Mapping[str, object]):
+
+        """
+        Update all records described by query.
+        Do not call this method directly. Use Query.update() instead.
+        """
+
+        if not values:
+            return
+        try:
+            self._execute(*self._bulk_update(query, values))
+            self.invalidate(query._model)
+        except NotImplementedError as e:
+            #fall back on simple update
+            for m in query.all():
+                for name, value in values.items():
+                    setattr(m, name, value)
+                m.save()
+
     def __del__(self):
 
         try:
@@ -249,15 +545,22 @@ class DatabaseEngine():
 
 class SQLiteEngine(DatabaseEngine):
 
+    BULK_CHUNK = 500 #maximum amount of models inserted by a single batch, see _bulk_insert()
+    FETCH_BATCH = 256 #amount of rows read at once while iterating over a query
+
     def connect(self, path: Path, *args, **kwargs) -> bool:
         
         """
         Connect to a SQLite3 database.
         You can specify additional connection arguments, which will be passed to the sqlite3 database connector.
+        Unless specified otherwise, the connection is in autocommit mode: changes made outside of a transaction
+        are written immediately instead of once the engine is disconnected.
         """
 
+        kwargs.setdefault("isolation_level", None)
         self._db = sqlite3.connect(path.as_posix(), *args, **kwargs)
         self._c = self._db.cursor()
+        self._statements = {} #generated SQL by model and statement shape
         return True
 
     def disconnect(self, commit=True):
@@ -265,29 +568,57 @@ class SQLiteEngine(DatabaseEngine):
         if commit:
             self._commit()
         self._db.close()
+        self.clear_cache()
 
     def _commit(self):
         
         return self._db.commit()
 
-    def _fetch(self, model_cls):
+    def _fetch_rows(self):
 
-        data = self._c.fetchall()
-        models = []
-        for row in data:
-            model = model_cls()
-            model.connect_engine(self)
-            for field, value in zip(model._fields.values(), row):
-                field._set_field(value)
-            model._bound = True
-            models.append(model)
-        return models
+        return self._c.fetchall()
+
+    def _fetch_batches(self, query, args):
+
+        cursor = self._db.cursor() #a cursor of its own, so the shared cursor can be used while iterating
+        try:
+            self.logger.debug("Streaming query '%s' with arguments '%r'.", query, args)
+            cursor.execute(query, args)
+            while True:
+                rows = cursor.fetchmany(self.FETCH_BATCH)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
 
     def _execute(self, query, args=[], kwargs={}):
         
         parameters = args or kwargs
-        self.logger.debug("Executing query '%s' with arguments '%s'." % (query, repr(parameters)))
-        self._c.execute(query+";", parameters)
+        self.logger.debug("Executing query '%s' with arguments '%r'.", query, parameters)
+        self._c.execute(query, parameters)
+
+    def _execute_many(self, query, args):
+
+        args = list(args)
+        self.logger.debug("Executing query '%s' with %i sets of arguments.", query, len(args))
+        self._c.executemany(query, args)
+
+    def _in_transaction(self):
+
+        return self._db.in_transaction
+
+    def _statement(self, key: Hashable, build: Callable[[], str]) -> str:
+
+        """
+        Return the SQL statement cached under key, build() is called to generate it on the first use.
+        """
+
+        try:
+            return self._statements[key]
+        except KeyError:
+            statement = self._statements[key] = build()
+            return statement
 
     def _create_model(self, model_cls):
         
@@ -324,55 +655,188 @@ class SQLiteEngine(DatabaseEngine):
         table_args = ", ".join([*field_specs, *table_constraints])
         return 'CREATE TABLE IF NOT EXISTS "%s" (%s)' % (model_cls._table_name, table_args)
 
-    def _insert(self, model):
-        
+    def _values(self, model):
+
+        """
+        Return the names of all fields of a model that are set and their values as query parameters.
+        """
+
         field_names = []
         field_values = []
         for name, field in model._fields.items():
-            value = field._get_field()
+            value = field._get_parameter()
             if value is EMPTY:
                 continue
             field_names.append(name)
             field_values.append(value)
+        return tuple(field_names), field_values
+
+    def _pk_values(self, model):
 
-        if not field_names:
-            return 'INSERT INTO %s DEFAULT VALUES' % model._table_name
-        return 'INSERT INTO %s (%s) VALUES (%s)' % (model._table_name, ", ".join(field_names), ", ".join(field_values))
+        return [object.__getattribute__(model, pk)._get_parameter() for pk in model._pk]
+
+    def _insert(self, model):
+        
+        field_names, field_values = self._values(model)
+
+        def build():
+            if not field_names:
+                return 'INSERT INTO "%s" DEFAULT VALUES' % model._table_name
+            return 'INSERT INTO "%s" (%s) VALUES (%s)' % (model._table_name, _columns(field_names), ", ".join("?" * len(field_names)))
+        return self._statement((model.__class__, "insert", field_names), build), field_values
 
     def on_insert(self, model):
 
         # update the models values after insertion to retrieve generated values from the database
         # (for example defaults, expressions and auto increments).
 
-        self._execute('SELECT * FROM %s WHERE ROWID=:id' % model._table_name, kwargs={"id": self._c.lastrowid})
+        super().on_insert(model)
+        query = self._statement((model.__class__, "refresh"), lambda: 'SELECT * FROM "%s" WHERE ROWID=?' % model._table_name)
+        self._execute(query, [self._c.lastrowid])
         for field, value in zip(model._fields.values(), self._c.fetchone()):
             field._set_field(value)
 
+    def _bulk_insert(self, models):
+
+        #models are inserted by class and in chunks, each chunk is refreshed by a single query
+        by_class = OrderedDict()
+        for model in models:
+            by_class.setdefault(model.__class__, []).append(model)
+        for model_cls, group in by_class.items():
+            for start in range(0, len(group), self.BULK_CHUNK):
+                self._insert_chunk(model_cls, group[start:start+self.BULK_CHUNK])
+
+    def _insert_chunk(self, model_cls, models):
+
+        """
+        Insert models of the same class and update them with the values generated by the database.
+        Must be called within a transaction.
+        """
+
+        #Rows without an explicit ROWID are assigned ascending ROWIDs above the largest existing one, so they
+        #are matched to their models in insertion order. Rows with an explicit ROWID (an INTEGER PRIMARY KEY)
+        #are matched by their key.
+        alias = _rowid_alias(model_cls)
+        self._execute(self._statement((model_cls, "last_rowid"), lambda: 'SELECT max(ROWID) FROM "%s"' % model_cls._table_name))
+        last = self._c.fetchone()[0] or 0
+
+        statements = [(*self._insert(model), model) for model in models]
+        explicit = {}
+        generated = []
+        for query, group in itertools.groupby(statements, key=itemgetter(0)):
+            group = list(group)
+            self._execute_many(query, [args for q, args, model in group])
+            for q, args, model in group:
+                key = object.__getattribute__(model, alias)._get_parameter() if alias else None
+                if key is None or key is EMPTY:
+                    generated.append(model)
+                else:
+                    explicit[key] = model
+
+        query = 'SELECT ROWID, * FROM "%s" WHERE ROWID>?' % model_cls._table_name
+        if explicit:
+            query += " OR ROWID IN (%s)" % ", ".join("?" * len(explicit))
+        self._execute(query + " ORDER BY ROWID", [last, *explicit])
+        generated = iter(generated)
+        for row in self._c.fetchall():
+            model = explicit[row[0]] if row[0] in explicit else next(generated)
+            for field, value in zip(model._fields.values(), row[1:]):
+                field._set_field(value)
+
     def _update(self, model):
         
-        update_args = []
-        for name, field in model._fields.items():
-            update_args.append("%s=%s" % (name, field._get_field()))
-        return 'UPDATE %s SET %s' % (model._table_name, ", ".join(update_args))
+        field_names, field_values = self._values(model)
+
+        def build():
+            update_args = ", ".join('"%s"=?' % name for name in field_names)
+            return 'UPDATE "%s" SET %s WHERE %s' % (model._table_name, update_args, _conditions(model._pk))
+        return self._statement((model.__class__, "update", field_names), build), field_values + self._pk_values(model)
 
     def _delete(self, model):
         
-        targets = []
-        for pk in model._pk:
-            targets.append(object.__getattribute__(model, pk)._get_field())
+        query = self._statement((model.__class__, "delete"), lambda: 'DELETE FROM "%s" WHERE %s' % (model._table_name, _conditions(model._pk)))
+        return query, self._pk_values(model)
 
-        delete_args = []
-        for key, value in zip(model._pk, targets):
-            delete_args.append("%s=%s" % (key, value))
-        return 'DELETE FROM %s WHERE %s' % (model._table_name, ", ".join(delete_args))
+    def _where(self, model_cls, filters):
+
+        """
+        Return the WHERE clause for a sequence of filters (an empty string if there are none) and its parameters.
+        """
 
-    def _query(self, model_cls, filters):
-        
         select_args = ' AND '.join(map(lambda x: x.construct(model_cls), filters))
+        parameters = [value for f in filters for value in f.parameters(model_cls)]
 
         if select_args:
-            return 'SELECT * FROM %s WHERE %s' % (model_cls._table_name, select_args)
-        return 'SELECT * FROM %s' % model_cls._table_name
+            return ' WHERE %s' % select_args, parameters
+        return '', parameters
+
+    def _select(self, query, columns, limit=None):
+
+        """
+        Return a SELECT statement of columns of the records described by query and its parameters.
+        """
+
+        where, parameters = self._where(query._model, query._filters)
+        statement = 'SELECT %s FROM "%s"%s' % (columns, query._model._table_name, where)
+        if query._order:
+            statement += " ORDER BY " + ", ".join('"%s" %s' % (name, "DESC" if descending else "ASC") for name, descending in query._order)
+        if query._limit is not None:
+            limit = query._limit if limit is None else min(limit, query._limit)
+        if limit is not None or query._offset:
+            statement += " LIMIT ? OFFSET ?"
+            parameters = parameters + [-1 if limit is None else limit, query._offset]
+        return statement, parameters
+
+    def _target(self, query):
+
+        """
+        Return the WHERE clause selecting the records described by query for a DELETE or UPDATE statement, and its parameters.
+        """
+
+        if query._limit is None and not query._offset:
+            return self._where(query._model, query._filters)
+        statement, parameters = self._select(query, "ROWID")
+        return " WHERE ROWID IN (%s)" % statement, parameters
+
+    def _query(self, query, limit=None):
+        
+        return self._select(query, "*", limit)
+
+    def _count(self, query):
+
+        if query._limit is None and not query._offset:
+            where, parameters = self._where(query._model, query._filters)
+            return 'SELECT COUNT(*) FROM "%s"%s' % (query._model._table_name, where), parameters
+        statement, parameters = self._select(query, "1")
+        return "SELECT COUNT(*) FROM (%s)" % statement, parameters
+
+    def _exists(self, query):
+
+        statement, parameters = self._select(query, "1")
+        return "SELECT EXISTS (%s)" % statement, parameters
+
+    def _bulk_delete(self, query):
+
+        where, parameters = self._target(query)
+        return 'DELETE FROM "%s"%s' % (query._model._table_name, where), parameters
+
+    def _bulk_update(self, query, values):
+
+        model_cls = query._model
+        update_args = []
+        update_values = []
+        for name, value in values.items():
+            if not name in model_cls._fields:
+                raise DatabaseError("Model %s has no field %s." % (model_cls.__name__, name))
+            field = model_cls._fields[name]
+            if value is not None:
+                field._validate(value)
+                value = field._adapt(value)
+            update_args.append('"%s"=?' % name)
+            update_values.append(value)
+
+        where, parameters = self._target(query)
+        return 'UPDATE "%s" SET %s%s' % (model_cls._table_name, ", ".join(update_args), where), update_values + parameters
 
     def _begin_transaction(self):
         
@@ -383,4 +847,26 @@ class SQLiteEngine(DatabaseEngine):
         if rollback:
             self._execute("ROLLBACK TRANSACTION")
         else:
-            self._execute("COMMIT TRANSACTION")
\ No newline at end of file
+            self._execute("COMMIT TRANSACTION")
+
+def _rowid_alias(model_cls):
+
+    """
+    Return the name of the field aliasing the ROWID of a models table, or None if the table has no such field.
+    """
+
+    if len(model_cls._pk) == 1 and model_cls._fields[model_cls._pk[0]]._typeref == "INTEGER":
+        return model_cls._pk[0]
+    return None
+
+def _columns(names):
+
+    return ", ".join('"%s"' % name for name in names)
+
+def _conditions(names):
+
+    """
+    Return a condition matching every column in names to a placeholder.
+    """
+
+    return " AND ".join('"%s"=?' % name for name in names)
@@ -65,6 +65,27 @@ class Field():
 
         return str(value)
 
+    def _adapt(self, value):
+
+        """
+        Convert a value to a type supported by the database driver, for passing it as a query parameter.
+        """
+
+        return value
+
+    def _get_parameter(self):
+
+        """
+        Like _get_field(), but returns the value as a query parameter instead of a SQL literal.
+        """
+
+        if self._value is EMPTY:
+            return EMPTY
+        if self._value is None:
+            return None
+        self._validate(self._value)
+        return self._adapt(self._value)
+
     def _get_field(self):
 
         if self._value is EMPTY:
@@ -154,6 +175,9 @@ class BooleanField(Field):
     def _serialize(self, value):
         return "1" if value else "0"
 
+    def _adapt(self, value):
+        return 1 if value else 0
+
 class JSONField(Field):
 
     def __init__(self, *args, **kwargs):
@@ -172,6 +196,10 @@ class JSONField(Field):
 
         return shlex.quote(json.dumps(value))
 
+    def _adapt(self, value):
+
+        return json.dumps(value)
+
     def _deserialize(self, value):
         
         return json.loads(value)
\ No newline at end of file
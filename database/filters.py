@@ -6,8 +6,28 @@ class Filter():
 
     def construct(self, model: "Model") -> str:
 
+        """
+        Return the SQL expression of this filter, using ? placeholders for values.
+        """
+
         pass
 
+    def parameters(self, model: "Model") -> list:
+
+        """
+        Return the values of the placeholders in the expression returned by construct(), in order.
+        """
+
+        return []
+
+    def models(self) -> list:
+
+        """
+        Return all models other than the queried model whose tables are read by this filter.
+        """
+
+        return []
+
 class Equals(Filter):
 
     def __init__(self, name, value):
@@ -17,8 +37,11 @@ class Equals(Filter):
 
     def construct(self, model):
         
-        field = model._fields[self.name]
-        return '%s=%s' % (self.name, field._serialize(self.value))
+        return '"%s"=?' % self.name
+
+    def parameters(self, model):
+
+        return [model._fields[self.name]._adapt(self.value)]
 
 class And(Filter):
 
@@ -31,17 +54,34 @@ class And(Filter):
         
         return "%s AND %s" % (self._f1.construct(model), self._f2.construct(model))
 
+    def parameters(self, model):
+
+        return self._f1.parameters(model) + self._f2.parameters(model)
+
+    def models(self):
+
+        return self._f1.models() + self._f2.models()
+
 class Exists(Filter):
 
     def __init__(self, filter, model_override=None):
 
         self._next = filter
         self._table = model_override._table_name if model_override else None
+        self._model = model_override
 
     def construct(self, model):
 
         return ("EXISTS (SELECT * FROM %s WHERE %s)" % (self._table or model._table_name, self._next.construct(model)))
 
+    def parameters(self, model):
+
+        return self._next.parameters(self._model or model)
+
+    def models(self):
+
+        return ([self._model] if self._model else []) + self._next.models()
+
 class Not(Filter):
 
     def __init__(self, filter):
@@ -50,4 +90,12 @@ class Not(Filter):
 
     def construct(self, model):
         
-        return "NOT " + self._next.construct(model)
\ No newline at end of file
+        return "NOT (%s)" % self._next.construct(model)
+
+    def parameters(self, model):
+
+        return self._next.parameters(model)
+
+    def models(self):
+
+        return self._next.models()
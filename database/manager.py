@@ -1,6 +1,7 @@
 from pathlib import Path
 import logging
 from weakref import WeakValueDictionary
+from collections import OrderedDict
 import os
 from typing import Any, Type, Union
 
@@ -25,6 +26,8 @@ class DatabaseManager():
 
     logger = logging.getLogger("database.DatabaseManager")
 
+    KEEP_ALIVE = 32 #amount of recently used engines kept connected, which keeps their query caches warm
+
     def __init__(self, path: Union[Path, str], engine: DatabaseEngine = SQLiteEngine):
 
         """
@@ -36,6 +39,7 @@ class DatabaseManager():
 
         self._path = path
         self._cache = WeakValueDictionary()
+        self._recent = OrderedDict() #strong references to the most recently used engines
         self._engine = engine
         self._registered_models = set()
 
@@ -66,18 +70,20 @@ class DatabaseManager():
 
         id = str(id)
         try: #perform cache lookup for this server
-            ref = self._cache[id] 
-            return ref
+            handle = self._cache[id] 
         except KeyError: #the object may have been garbage collected while we were referencing it, or just doesn't exist
-            pass
-
-        # register models
-        handle = self._engine()
-        handle.connect(self._path / id)
-        for model in self._registered_models:
-            handle.register(model)
-
-        self._cache[id] = handle #cache our engine instance
+            # register models
+            handle = self._engine()
+            handle.connect(self._path / id)
+            for model in self._registered_models:
+                handle.register(model)
+
+            self._cache[id] = handle #cache our engine instance
+
+        self._recent[id] = handle
+        self._recent.move_to_end(id)
+        if len(self._recent) > self.KEEP_ALIVE:
+            self._recent.popitem(last=False)
         return handle
 
     def get_db_by_message(self, msg: Message = None) -> DatabaseEngine:
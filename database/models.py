@@ -61,10 +61,12 @@ class Model(metaclass=_ModelMeta):
         self._engine = None
 
         #copy fields to prevent issues with dangling values
+        fields = {}
         for k, f in self._fields.items():
             new_field = f.copy()
             object.__setattr__(self, k, new_field)
-            self._fields[k] = new_field
+            fields[k] = new_field
+        object.__setattr__(self, "_fields", fields) #the class level mapping is shared by all instances
 
     def connect_engine(self, engine: "DatabaseEngine"):
 
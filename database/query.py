@@ -1,4 +1,4 @@
-from typing import List, Type
+from typing import List, Type, Iterator, Optional
 
 from .errors import DatabaseError
 from .filters import Equals
@@ -12,6 +12,11 @@ class Query():
     The Query class supports a fluent interface for applying various Filters to a database query.
     Queries evaluate lazily, meaning that a query is only executed once its data is actually requested by
     the client code. Filtering a query does not require the database to be accessed.
+
+    Iterating over a query streams its records from the database in batches. len() and bool() count the records
+    or check whether any exist on the database, without fetching them. Indexing a query and checking whether it
+    contains a model execute the query and keep all of its records (see execute()), which is also used by all
+    of the above from then on.
     """
 
     def __init__(self, database_engine: "DatabaseEngine", model: Type["Model"]):
@@ -19,6 +24,9 @@ class Query():
         self._engine = database_engine
         self._model = model
         self._filters: List["Filter"] = []
+        self._order: List[tuple] = [] #(field name, descending) pairs
+        self._limit: Optional[int] = None
+        self._offset = 0
 
         self._result: List["Model"] = []
 
@@ -32,11 +40,16 @@ class Query():
         """
 
         if self._executed:
-            return 
+            return
 
         self.execute()
         self._executed = True
 
+    def _ensure_not_executed(self):
+
+        if self._executed:
+            raise DatabaseError("Cannot modify a database query that has already been executed.")
+
     def execute(self):
 
         """
@@ -69,24 +82,96 @@ class Query():
                     self._filters.append(Equals(field, value))
         return self
 
+    def order_by(self, *fields: str) -> "Query":
+
+        """
+        Order the records of this query by the given field names.
+        Prefix a field name with - to order by it in descending order.
+        Returns this query instance.
+        """
+
+        self._ensure_not_executed()
+        for name in fields:
+            descending = name.startswith("-")
+            name = name.lstrip("-")
+            if not name in self._model._fields:
+                raise DatabaseError("Model %s has no field %s." % (self._model.__name__, name))
+            self._order.append((name, descending))
+        return self
+
+    def limit(self, count: int) -> "Query":
+
+        """
+        Restrict this query to at most count records.
+        Returns this query instance.
+        """
+
+        self._ensure_not_executed()
+        self._limit = count
+        return self
+
+    def offset(self, count: int) -> "Query":
+
+        """
+        Skip the first count records of this query.
+        Returns this query instance.
+        """
+
+        self._ensure_not_executed()
+        self._offset = count
+        return self
+
+    def first(self) -> Optional["Model"]:
+
+        """
+        Return the first record of this query, or None if there is none.
+        Only a single record is fetched.
+        """
+
+        if self._executed:
+            return self._result[0] if self._result else None
+        result = self._engine.fetch(self, limit=1)
+        return result[0] if result else None
+
+    def all(self) -> List["Model"]:
+
+        """
+        Execute this query if necessary and return a list of all of its records.
+        """
+
+        self._ensure_executed()
+        return list(self._result)
+
     def delete(self):
 
         """
         Shortcut method for deleting all entries matching this query.
+        If the database engine supports it, the entries are deleted by a single statement without fetching them.
         """
-        
-        self._ensure_executed()
+
         self._engine.bulk_delete(self)
-        
-    def __iter__(self):
 
-        self._ensure_executed()
-        return iter(self._result)
+    def update(self, **values):
+
+        """
+        Set fields of all entries matching this query to the values given as keyword arguments.
+        If the database engine supports it, the entries are updated by a single statement without fetching them.
+        Models returned by this query before are not updated.
+        """
+
+        self._engine.bulk_update(self, values)
+
+    def __iter__(self) -> Iterator["Model"]:
+
+        if self._executed:
+            return iter(self._result)
+        return self._engine.stream(self)
 
     def __len__(self) -> int:
 
-        self._ensure_executed()
-        return len(self._result)
+        if self._executed:
+            return len(self._result)
+        return self._engine.count(self)
 
     def __getitem__(self, key: str) -> "Model":
 
@@ -103,5 +188,6 @@ class Query():
 
     def __bool__(self):
 
-        self._ensure_executed()
-        return bool(self._result)
\ No newline at end of file
+        if self._executed:
+            return bool(self._result)
+        return self._engine.exists(self)
@@ -0,0 +1,210 @@
+#Database engine benchmarks
+#
+#These are not unit tests and are not collected by the test runner.
+#They run on an in-memory SQLite database. Run them from the repository root:
+#
+#   python -m database.tests.bench_engine
+
+import argparse
+import time
+import tempfile
+import tracemalloc
+import os
+from pathlib import Path
+
+from ..models import Model
+from ..engine import SQLiteEngine
+from ..fields import TextField, IntegerField, FloatField
+
+class BenchModel(Model):
+
+    user_id = IntegerField()
+    score = FloatField(default=0.0)
+    name = TextField(null=True)
+
+def connect(path=":memory:"):
+
+    engine = SQLiteEngine()
+    engine.connect(Path(path))
+    engine.register(BenchModel)
+    return engine
+
+def insert(engine, count):
+
+    for i in range(count):
+        m = engine.new(BenchModel)
+        m.user_id = i
+        m.score = i / 2
+        m.name = "user's name %i" % i
+        m.save()
+
+def bench_insert(args):
+
+    """
+    Measure the amount of rows inserted per second using Model.save().
+    """
+
+    engine = connect()
+    start = time.perf_counter()
+    insert(engine, args.rows)
+    elapsed = time.perf_counter() - start
+    print("insert rows=%-7i rows/s=%.0f" % (args.rows, args.rows / elapsed))
+    engine.disconnect()
+
+def bench_select(args):
+
+    """
+    Measure the amount of single row lookups per second, similar to the guard checks of the bot.
+    """
+
+    engine = connect()
+    insert(engine, args.rows)
+    start = time.perf_counter()
+    for i in range(args.queries):
+        len(engine.query(BenchModel).filter(user_id=i % args.rows))
+    elapsed = time.perf_counter() - start
+    print("select rows=%-7i queries/s=%.0f" % (args.rows, args.queries / elapsed))
+    engine.disconnect()
+
+def bench_guard(args):
+
+    """
+    Measure lookups of a small set of hot keys, similar to the blocked channel checks in on_message, with and without the query cache.
+    """
+
+    engine = connect()
+    insert(engine, args.rows)
+    for size in (0, engine.CACHE_SIZE):
+        engine.CACHE_SIZE = size
+        engine.clear_cache()
+        hits = engine.cache_stats()["hits"]
+        start = time.perf_counter()
+        for i in range(args.queries):
+            bool(engine.query(BenchModel).filter(user_id=i % 16))
+        elapsed = time.perf_counter() - start
+        hits = engine.cache_stats()["hits"] - hits
+        print("guard cache=%-5i queries/s=%-7.0f hit_rate=%.3f" % (size, args.queries / elapsed, hits / args.queries))
+    engine.disconnect()
+
+def bench_bulk(args):
+
+    """
+    Compare inserting and updating rows one at a time using Model.save() to DatabaseEngine.save_many(),
+    on an in-memory database and on a database file, where every statement outside of a transaction is synced to disk.
+    """
+
+    directory = tempfile.mkdtemp()
+    for path in (":memory:", os.path.join(directory, "bench.db")):
+        rows = args.rows if path == ":memory:" else args.rows // 10
+        for bulk in (False, True):
+            engine = connect(path)
+            models = []
+            for i in range(rows):
+                m = engine.new(BenchModel)
+                m.user_id = i
+                models.append(m)
+            start = time.perf_counter()
+            if bulk:
+                engine.save_many(models)
+            else:
+                for m in models:
+                    m.save()
+            inserted = time.perf_counter() - start
+            for m in models:
+                m.score = 1.0
+            start = time.perf_counter()
+            if bulk:
+                engine.save_many(models)
+            else:
+                for m in models:
+                    m.save()
+            updated = time.perf_counter() - start
+            print("bulk %-6s %-10s rows=%-6i inserts/s=%-8.0f updates/s=%.0f" % ("file" if path != ":memory:" else "memory",
+                  "save_many" if bulk else "save", rows, rows / inserted, rows / updated))
+            engine.disconnect()
+            if path != ":memory:":
+                os.remove(path)
+    os.rmdir(directory)
+
+def bench_cleanup(args):
+
+    """
+    Compare updating and then deleting all rows one at a time to Query.update() and Query.delete().
+    """
+
+    for bulk in (False, True):
+        engine = connect()
+        insert(engine, args.rows)
+        start = time.perf_counter()
+        if bulk:
+            engine.query(BenchModel).update(score=-1.0)
+        else:
+            for m in engine.query(BenchModel):
+                m.score = -1.0
+                m.save()
+        updated = time.perf_counter() - start
+        start = time.perf_counter()
+        if bulk:
+            engine.query(BenchModel).filter(score=-1.0).delete()
+        else:
+            for m in engine.query(BenchModel).filter(score=-1.0):
+                m.delete()
+        deleted = time.perf_counter() - start
+        assert not engine.query(BenchModel)
+        print("cleanup %-6s rows=%-6i update=%7.2fms delete=%7.2fms" % ("query" if bulk else "rows", args.rows, updated * 1000, deleted * 1000))
+        engine.disconnect()
+
+def bench_stream(args):
+
+    """
+    Compare the peak memory used by iterating over a large table to fetching all of its rows,
+    and counting the rows using len() to fetching them.
+    """
+
+    engine = connect()
+    rows = args.rows * 25
+    models = []
+    for i in range(rows):
+        m = engine.new(BenchModel)
+        m.user_id = i
+        m.name = "user name %i" % i
+        models.append(m)
+    engine.save_many(models)
+    del models
+
+    for name, read in (("all", lambda q: sum(1 for m in q.all())), ("iterate", lambda q: sum(1 for m in q)),
+                       ("fetch+len", lambda q: len(q.all())), ("len", len)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        assert read(engine.query(BenchModel)) == rows
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        engine.clear_cache()
+        print("stream %-9s rows=%-7i time=%8.2fms peak=%8.2f MiB" % (name, rows, elapsed * 1000, peak / 2**20))
+    engine.disconnect()
+
+def bench_all(args):
+
+    for name, bench in BENCHMARKS.items():
+        if bench is not bench_all:
+            bench(args)
+
+BENCHMARKS = {
+    "insert": bench_insert,
+    "select": bench_select,
+    "guard": bench_guard,
+    "bulk": bench_bulk,
+    "cleanup": bench_cleanup,
+    "stream": bench_stream,
+    "all": bench_all
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Database engine benchmarks")
+    parser.add_argument("benchmark", nargs="?", default="all", choices=list(BENCHMARKS.keys()))
+    parser.add_argument("--rows", type=int, default=2000, help="amount of rows to insert")
+    parser.add_argument("--queries", type=int, default=5000, help="amount of queries to run")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
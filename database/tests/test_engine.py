@@ -4,6 +4,7 @@ from pathlib import Path
 from ..models import Model
 from ..engine import SQLiteEngine
 from ..fields import TextField, IntegerField, FloatField
+from ..filters import Equals, Exists, Not
 
 DB_PATH = Path("test.db")
 
@@ -32,4 +33,82 @@ class TestEngine(TestCase):
         self.engine.register(self._Model)
         with self.engine.transaction() as t:
             m = self.engine.new(self._Model)
-            m.save()
\ No newline at end of file
+            m.save()
+
+    def test_query_cache(self):
+
+        self.engine.register(self._Model)
+        m = self.engine.new(self._Model)
+        m.test_int = 1
+        m.save()
+
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_int=1)), 1)
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_int=1)), 1)
+        self.assertEqual(self.engine.cache_stats()["hits"], 1)
+        cached = self.engine.query(self._Model).filter(test_int=1)[0]
+        cached.test_int = 5 #changing a returned model does not change the cache
+        self.assertEqual(self.engine.query(self._Model).filter(test_int=1)[0].test_int, 1)
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_int=2)), 0)
+
+        m.test_int = 2
+        m.save()
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_int=1)), 0)
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_int=2)), 1)
+        m.delete()
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_int=2)), 0)
+        self.engine.new(self._Model).save()
+        self.assertEqual(len(self.engine.query(self._Model)), 1)
+
+        stats = self.engine.cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 7))
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 9)
+
+    def test_query_cache_rows(self):
+
+        self.engine.register(self._Model)
+        self.engine.CACHE_ROWS = 2
+        for i in range(3):
+            self.engine.new(self._Model).save()
+
+        #large results are not cached, their counts are
+        self.assertEqual(len(self.engine.query(self._Model).all()), 3)
+        self.assertEqual(len(self.engine.query(self._Model)), 3)
+        self.assertEqual(self.engine.cache_stats()["entries"], 1)
+        self.assertEqual(len(self.engine.query(self._Model).limit(2).all()), 2)
+        self.assertEqual(len(self.engine.query(self._Model).all()), 3)
+        self.assertEqual(len(self.engine.query(self._Model)), 3)
+        stats = self.engine.cache_stats()
+        self.assertEqual((stats["hits"], stats["entries"]), (1, 2))
+
+    def test_query_cache_other_model(self):
+
+        class _Other(Model):
+
+            test_int = IntegerField(0)
+
+        self.engine.register(self._Model)
+        self.engine.register(_Other)
+        self.engine.new(self._Model).save()
+
+        query = lambda: self.engine.query(self._Model).filter(Exists(Equals("test_int", 1), model_override=_Other))
+        self.assertEqual(len(query()), 0)
+        self.assertEqual(len(query().all()), 0)
+        other = self.engine.new(_Other)
+        other.test_int = 1
+        other.save()
+        #the cached results of _Model read _Other and have to be dropped
+        self.assertEqual(len(query()), 1)
+        self.assertEqual(len(query().all()), 1)
+        self.assertEqual(len(self.engine.query(self._Model).filter(Not(Exists(Equals("test_int", 1), model_override=_Other)))), 0)
+        other.delete()
+        self.assertEqual(len(query()), 0)
+
+    def test_query_cache_rollback(self):
+
+        self.engine.register(self._Model)
+        with self.assertRaises(ValueError):
+            with self.engine.transaction():
+                self.engine.new(self._Model).save()
+                self.assertEqual(len(self.engine.query(self._Model)), 1)
+                raise ValueError()
+        self.assertEqual(len(self.engine.query(self._Model)), 0)
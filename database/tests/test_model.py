@@ -1,9 +1,12 @@
 from unittest import TestCase
+import unittest.mock
+import sqlite3
 from pathlib import Path
 
 from ..models import Model
 from ..engine import SQLiteEngine
-from ..fields import TextField, IntegerField, FloatField
+from ..fields import TextField, IntegerField, FloatField, JSONField
+from ..constraints import PKConstraint
 
 DB_PATH = Path("test.db")
 
@@ -72,6 +75,101 @@ class TestModel(TestCase):
         m.test_string = "Hello World"
         m.save()
 
+    def test_model_update_single(self):
+
+        self.engine.register(self._Model)
+        a = self.engine.new(self._Model)
+        a.save()
+        b = self.engine.new(self._Model)
+        b.save()
+        a.test_string = "it's \"quoted\"; DROP TABLE _Model"
+        a.save()
+
+        self.assertEqual(self.engine.query(self._Model).filter(id=a.id)[0].test_string, a.test_string)
+        self.assertEqual(self.engine.query(self._Model).filter(id=b.id)[0].test_string, "")
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_string=a.test_string)), 1)
+
+    def test_model_composite_pk(self):
+
+        class M(Model):
+
+            a = IntegerField(constraints=(PKConstraint(),))
+            b = IntegerField(constraints=(PKConstraint(),))
+            data = JSONField(null=True)
+
+        self.engine.register(M)
+        for a, b in ((1, 1), (1, 2), (2, 1)):
+            m = self.engine.new(M)
+            m.a = a
+            m.b = b
+            m.data = {"a": a}
+            m.save()
+
+        m = self.engine.query(M).filter(a=1).filter(b=2)[0]
+        self.assertEqual(m.data, {"a": 1})
+        m.delete()
+        self.assertEqual(sorted((m.a, m.b) for m in self.engine.query(M)), [(1, 1), (2, 1)])
+
+    def test_save_many(self):
+
+        self.engine.register(self._Model)
+        m = self.engine.new(self._Model)
+        m.save()
+        m.delete() #generated IDs are not reused
+
+        models = []
+        for i in range(7):
+            m = self.engine.new(self._Model)
+            if i % 2:
+                m.test_int = i
+                m.test_string = "model %i" % i
+            models.append(m)
+        with unittest.mock.patch.object(self.engine, "BULK_CHUNK", 3):
+            self.engine.save_many(models)
+
+        self.assertTrue(all(m._bound for m in models))
+        self.assertEqual(sorted(m.id for m in models), list(range(2, 9)))
+        for m in self.engine.query(self._Model):
+            self.assertEqual(m, models[m.id - 2])
+        self.assertEqual([m.test_int for m in models], [42, 1, 42, 3, 42, 5, 42])
+
+        models[0].test_int = 0
+        models[1].test_string = "changed"
+        new = self.engine.new(self._Model)
+        self.engine.save_many([models[0], models[1], new])
+        self.assertEqual(self.engine.query(self._Model).filter(id=models[0].id)[0].test_int, 0)
+        self.assertEqual(self.engine.query(self._Model).filter(id=models[1].id)[0].test_string, "changed")
+        self.assertEqual(new.id, 9)
+
+    def test_save_many_explicit_keys(self):
+
+        class M(Model):
+
+            key = IntegerField(constraints=(PKConstraint(),))
+            value = IntegerField(default=7)
+
+        self.engine.register(M)
+        m = self.engine.new(M)
+        m.key = 100
+        m.save()
+
+        models = []
+        for key in (5, None, 200, None, 50):
+            m = self.engine.new(M)
+            if key is not None:
+                m.key = key
+                m.value = key
+            models.append(m)
+        self.engine.save_many(models)
+        self.assertEqual([(m.key, m.value) for m in models], [(5, 5), (101, 7), (200, 200), (201, 7), (50, 50)])
+
+        #a failing batch is rolled back as a whole
+        duplicate = self.engine.new(M)
+        duplicate.key = 5
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.engine.save_many([self.engine.new(M), duplicate])
+        self.assertEqual(len(self.engine.query(M)), 6)
+
     def test_bulk_delete(self):
 
         self.engine.register(self._Model)
@@ -1,11 +1,11 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 from pathlib import Path
 
 from ..models import Model
 from ..engine import SQLiteEngine
 from ..fields import TextField, IntegerField, FloatField
 from ..query import Query
-from ..filters import Equals
+from ..filters import Equals, And, Not
 from ..errors import DatabaseError
 
 DB_PATH = Path("test.db")
@@ -82,4 +82,77 @@ class TestQUery(TestCase):
             q[0]
         m.save()
         q = self.engine.query(self._Model)
-        self.assertEqual(q[0], m)
\ No newline at end of file
+        self.assertEqual(q[0], m)
+
+    def _create(self, *values):
+
+        for value in values:
+            m = self.engine.new(self._Model)
+            m.test_int = value
+            m.save()
+
+    def test_query_delete(self):
+
+        self._create(1, 2, 2, 3)
+        q = self.engine.query(self._Model).filter(Not(And(Equals("test_int", 1), Equals("test_int", 1))))
+        q.delete()
+        self.assertFalse(q._executed) #the records are not fetched
+        self.assertEqual([m.test_int for m in self.engine.query(self._Model)], [1])
+
+    def test_query_update(self):
+
+        self._create(1, 2, 2, 3)
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_int=2)), 2)
+        self.engine.query(self._Model).filter(test_int=2).update(test_float=1.5, test_string="it's two")
+        self.assertEqual([(m.test_int, m.test_float, m.test_string) for m in self.engine.query(self._Model)],
+                         [(1, None, ""), (2, 1.5, "it's two"), (2, 1.5, "it's two"), (3, None, "")])
+        self.engine.query(self._Model).update(test_int=0)
+        self.assertEqual(len(self.engine.query(self._Model).filter(test_int=0)), 4)
+        with self.assertRaises(DatabaseError):
+            self.engine.query(self._Model).update(missing=1)
+
+        #engines not supporting bulk updates fall back on updating every record
+        with mock.patch.object(self.engine, "_bulk_update", side_effect=NotImplementedError()):
+            self.engine.query(self._Model).filter(test_float=1.5).update(test_int=5)
+        self.assertEqual([m.test_int for m in self.engine.query(self._Model)], [0, 5, 5, 0])
+
+    def test_query_stream(self):
+
+        self._create(*range(10))
+        with mock.patch.object(self.engine, "FETCH_BATCH", 3):
+            seen = []
+            for m in self.engine.query(self._Model):
+                seen.append(m.test_int)
+                if m.test_int % 2:
+                    m.delete() #other queries may run while iterating
+        self.assertEqual(seen, list(range(10)))
+        self.assertEqual([m.test_int for m in self.engine.query(self._Model)], [0, 2, 4, 6, 8])
+
+    def test_query_count_exists(self):
+
+        self._create(1, 2, 2, 3)
+        q = self.engine.query(self._Model).filter(test_int=2)
+        self.assertEqual(len(q), 2)
+        self.assertTrue(q)
+        self.assertFalse(self.engine.query(self._Model).filter(test_int=4))
+        self.assertFalse(q._executed) #neither of them fetches the records
+        self.assertEqual(len(self.engine.query(self._Model).offset(3)), 1)
+        self.assertFalse(self.engine.query(self._Model).offset(4))
+
+    def test_query_order_limit(self):
+
+        self._create(3, 1, 4, 1, 5)
+        q = lambda: self.engine.query(self._Model)
+        self.assertEqual([m.test_int for m in q().order_by("-test_int").limit(3)], [5, 4, 3])
+        self.assertEqual([m.test_int for m in q().order_by("test_int", "-id").offset(1).limit(2)], [1, 3])
+        self.assertEqual(q().order_by("-id").first().test_int, 5)
+        self.assertEqual(q().limit(0).first(), None)
+        self.assertEqual(q().filter(test_int=9).first(), None)
+        self.assertEqual(len(q().limit(2)), 2)
+        with self.assertRaises(DatabaseError):
+            q().order_by("missing")
+
+        q().order_by("test_int").limit(2).update(test_float=0.5)
+        self.assertEqual(len(q().filter(test_float=0.5).filter(test_int=1)), 2)
+        q().order_by("-test_int").limit(2).delete()
+        self.assertEqual(sorted(m.test_int for m in q()), [1, 1, 3])
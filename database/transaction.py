@@ -19,6 +19,7 @@ class Transaction:
 
         if exc_type is not None:
             self.engine._end_transaction(True)
+            self.engine.clear_cache() #results cached during the transaction may include rolled back changes
         else:
             self.engine._end_transaction(False)
         return False
\ No newline at end of file
@@ -0,0 +1,148 @@
+#MegaHAL wrapper benchmarks
+#
+#These are not unit tests and are not collected by the test runner.
+#MegaHAL is replaced by tests/fake_megahal.py. Run them from the repository root:
+#
+#   python -m tests.bench_megahal
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from unittest.mock import Mock
+
+import chatbot
+import conversation
+
+FAKE_MEGAHAL = [sys.executable, "tests/fake_megahal.py"]
+
+def readMessage(stream):
+
+    """The byte at a time reader chatbot.py used before, kept for comparison."""
+
+    answer = b""
+    while True:
+        char = stream.read(1)
+        answer += char
+        if answer.endswith(b"\r\n> "):
+            break
+    return answer[:-3]
+
+def bench_read(args):
+
+    """
+    Compare reading answers byte by byte from a blocking pipe to buffered delimiter scanning.
+    """
+
+    text = " ".join("word%i" % i for i in range(args.words)).encode()
+
+    proc = subprocess.Popen(FAKE_MEGAHAL, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    for i in range(chatbot.INTRO_LINES):
+        proc.stdout.readline()
+    readMessage(proc.stdout)
+    start = time.perf_counter()
+    for i in range(args.requests):
+        proc.stdin.write(chatbot.bytes_in(text + b"\n\n"))
+        proc.stdin.flush()
+        readMessage(proc.stdout)
+    elapsed = time.perf_counter() - start
+    proc.stdin.close()
+    proc.wait()
+    print("%-12s requests/s=%8.0f" % ("read(1)", args.requests / elapsed))
+
+    async def buffered():
+        backend = chatbot.MegaHALProcess(FAKE_MEGAHAL, None)
+        await backend.start()
+        start = time.perf_counter()
+        for i in range(args.requests):
+            await backend.communicate(text)
+        elapsed = time.perf_counter() - start
+        await backend.close()
+        return elapsed
+
+    print("%-12s requests/s=%8.0f" % ("readuntil()", args.requests / asyncio.run(buffered())))
+
+def bench_client(args):
+
+    """
+    Compare opening a connection per request to the pooled persistent connections of conversation.MegaHAL,
+    with a number of concurrent requests.
+    """
+
+    text = " ".join("word%i" % i for i in range(args.words))
+
+    async def run():
+        backend = chatbot.MegaHALPool(FAKE_MEGAHAL, None)
+        await backend.start()
+        server = chatbot.AIServer(backend)
+        await server.start("localhost", 0)
+        port = server.server.sockets[0].getsockname()[1]
+
+        async def fresh():
+            reader, writer = await asyncio.open_connection("localhost", port)
+            chatbot.writeFrame(writer, {"i": 1, "t": text})
+            await chatbot.readFrame(reader)
+            writer.close()
+
+        async def measure(request):
+            start = time.perf_counter()
+            for i in range(0, args.requests, args.concurrency):
+                await asyncio.gather(*(request() for j in range(args.concurrency)))
+            return time.perf_counter() - start
+
+        print("%-16s requests/s=%8.0f" % ("per request", args.requests / await measure(fresh)))
+        for connections in (1, 2, 4):
+            config = Mock()
+            config.getElementInt.side_effect = lambda path, default=0: {"bot.network.AI.port": port, "bot.network.AI.connections": connections}.get(path, default)
+            config.getElementText.side_effect = lambda path, default="": default
+            cs = conversation.MegaHAL(Mock(), config)
+            msg = Mock()
+            msg.content = text
+            elapsed = await measure(lambda: cs.respond(msg))
+            print("%-16s requests/s=%8.0f" % ("pool of %i" % connections, args.requests / elapsed))
+            await cs.close()
+
+        await server.close()
+        await backend.close()
+
+    asyncio.run(run())
+
+def bench_pool(args):
+
+    """
+    Compare the reply throughput of MegaHAL pools of different sizes, with every reply taking --delay seconds
+    and one learned message per reply.
+    """
+
+    async def run(workers):
+        pool = chatbot.MegaHALPool(FAKE_MEGAHAL + [str(args.delay)], None, workers=workers)
+        await pool.start()
+        requests = args.requests // 10
+        start = time.perf_counter()
+        for i in range(0, requests, args.concurrency):
+            await pool.communicate(b"something to learn", learn=True)
+            await asyncio.gather(*(pool.communicate(b"hello world") for j in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        await pool.close()
+        return requests / elapsed
+
+    for workers in (1, 2, 4, 8):
+        print("workers=%-3i replies/s=%8.1f" % (workers, asyncio.run(run(workers))))
+
+BENCHMARKS = {
+    "read": bench_read,
+    "client": bench_client,
+    "pool": bench_pool
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="MegaHAL wrapper benchmarks")
+    parser.add_argument("benchmark", choices=list(BENCHMARKS.keys()))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=50, help="amount of words per message")
+    parser.add_argument("--concurrency", type=int, default=8, help="amount of concurrent requests")
+    parser.add_argument("--delay", type=float, default=0.01, help="seconds the fake MegaHAL takes per answer")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,66 @@
+#Discord ProtOS Bot
+#
+#Author: fredi_68
+#
+#Stand-in for the MegaHAL binary
+
+#Speaks the console protocol chatbot.py expects from MegaHAL: an intro,
+#a first message and a prompt, then one answer per message. Messages end
+#with an empty line, commands (starting with #) are not answered. The
+#answer is the message with its words in reverse order, except for the
+#message "count", which is answered with the amount of messages seen
+#before it, and "sleep <seconds>", which is answered after the given
+#time. This lets tests check which process has seen a message.
+#
+#Usage: python fake_megahal.py [delay in seconds per answer]
+
+import sys
+import time
+
+def main():
+
+    delay = float(sys.argv[1]) if len(sys.argv) > 1 else 0.0
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    seen = 0
+
+    for i in range(11):
+        stdout.write(b"Fake MegaHAL intro line %i\r\n" % i)
+    stdout.write(b"> I am a fake.\r\n> ")
+    stdout.flush()
+
+    while True:
+        lines = []
+        while True:
+            line = stdin.readline()
+            if not line:
+                return
+            line = line.rstrip(b"\r\n")
+            if not line:
+                break
+            lines.append(line)
+        if not lines:
+            continue
+
+        message = b" ".join(lines)
+        if message.startswith(b"#"):
+            if message in (b"#QUIT", b"#EXIT"):
+                return
+            continue
+
+        if delay:
+            time.sleep(delay)
+        words = message.rstrip(b".?!").split()
+        if words and words[0] == b"sleep":
+            time.sleep(float(words[1]))
+        if words == [b"count"]:
+            answer = b"%i" % seen
+        else:
+            answer = b" ".join(reversed(message.split()))
+        seen += 1
+        stdout.write(b"> " + answer.replace(b"\n", b"\r\n") + b"\r\n> ")
+        stdout.flush()
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,71 @@
+import unittest
+import asyncio
+from unittest.mock import Mock
+
+import conversation
+
+class RecordingSimulator(conversation.ConversationSimulator):
+
+    def __init__(self, client, config):
+        super().__init__(client, config)
+        self.batches = []
+
+    async def observeMany(self, msgs):
+        await asyncio.sleep(0.01)
+        self.batches.append(list(msgs))
+
+class TestObserveQueue(unittest.TestCase):
+
+    def create(self, delay, batch, cls=RecordingSimulator):
+        options = {"bot.chat.observe_delay": delay, "bot.chat.observe_batch": batch}
+        config = Mock()
+        config.getElementInt.side_effect = lambda path, default=0: options.get(path, default)
+        client = Mock()
+        client.loop = asyncio.get_running_loop()
+        return cls(client, config)
+
+    def test_observe_queue_batch(self):
+        async def run():
+            cs = self.create(10000, 3)
+            for i in range(7):
+                await cs.queueObserve(i)
+            self.assertEqual(cs.batches, [[0, 1, 2], [3, 4, 5]])
+            self.assertEqual(cs.observeStats()["depth"], 1)
+            await cs.flushObserve()
+            self.assertEqual(cs.batches[-1], [6])
+            stats = cs.observeStats()
+            self.assertEqual((stats["depth"], stats["batches"], stats["messages"]), (0, 3, 7))
+            self.assertGreater(stats["max_latency"], 0)
+            cs._observeTimer.cancel()
+        asyncio.run(run())
+
+    def test_observe_queue_delay(self):
+        async def run():
+            cs = self.create(20, 100)
+            for i in range(5):
+                await cs.queueObserve(i)
+            self.assertEqual(cs.batches, [])
+            await asyncio.sleep(0.1)
+            self.assertEqual(cs.batches, [[0, 1, 2, 3, 4]])
+            self.assertGreaterEqual(cs.observeStats()["latency"], 0.02)
+        asyncio.run(run())
+
+    def test_observe_queue_default(self):
+        async def run():
+            cs = self.create(0, 100, conversation.ConversationSimulator)
+            cs.observe = Mock(side_effect=lambda msg: asyncio.sleep(0))
+            for i in range(3):
+                await cs.queueObserve(i)
+            await cs.flushObserve()
+            self.assertEqual([c.args[0] for c in cs.observe.call_args_list], [0, 1, 2])
+        asyncio.run(run())
+
+    def test_observe_queue_close(self):
+        async def run():
+            cs = self.create(10000, 100)
+            for i in range(3):
+                await cs.queueObserve(i)
+            await cs.close()
+            self.assertEqual(cs.batches, [[0, 1, 2]])
+            self.assertIsNone(cs._observeTimer)
+        asyncio.run(run())
@@ -0,0 +1,108 @@
+import unittest
+import asyncio
+import sys
+import time
+from unittest.mock import Mock
+
+import chatbot
+import conversation
+
+FAKE_MEGAHAL = [sys.executable, "tests/fake_megahal.py"]
+
+def message(content):
+    msg = Mock()
+    msg.content = content
+    return msg
+
+class TestMegaHAL(unittest.TestCase):
+
+    async def start(self, connections=2):
+        self.backend = chatbot.MegaHALPool(FAKE_MEGAHAL, None)
+        await self.backend.start()
+        self.server = chatbot.AIServer(self.backend)
+        await self.server.start("localhost", 0)
+        options = {"bot.network.AI.port": self.server.server.sockets[0].getsockname()[1], "bot.network.AI.connections": connections}
+        config = Mock()
+        config.getElementInt.side_effect = lambda path, default=0: options.get(path, default)
+        config.getElementText.side_effect = lambda path, default="": default
+        return conversation.MegaHAL(Mock(), config)
+
+    async def stop(self):
+        await self.server.close()
+        await self.backend.close()
+
+    def test_megahal_respond(self):
+        async def run():
+            cs = await self.start()
+            self.assertEqual(await cs.respond(message("hello world")), "world. hello")
+            self.assertEqual(await cs.respond(message("first line\nsecond line!")), "line! second line first")
+            await cs.observe(message("something"))
+            await cs.setOpt("SAVE", [])
+            self.assertEqual(await cs.respond(message("count")), "3")
+            self.assertEqual(await cs.respond(message("")), "There is nothing here...")
+            self.assertEqual(len(cs._pool), 1)
+            await cs.close()
+            await self.stop()
+        asyncio.run(run())
+
+    def test_megahal_close(self):
+        async def run():
+            cs = await self.start()
+            cs.client.loop = asyncio.get_running_loop()
+            cs.observe_delay = 10000
+            await cs.queueObserve(message("queued"))
+            await cs.close()
+            self.assertEqual(cs._pool, [])
+            await cs.setOpt("SAVE", [])
+            self.assertEqual(await cs.respond(message("count")), "1")
+            await cs.close()
+            await self.stop()
+        asyncio.run(run())
+
+    def test_megahal_pool(self):
+        async def run():
+            cs = await self.start(connections=3)
+            replies = await asyncio.gather(*(cs.respond(message("message %i" % i)) for i in range(20)))
+            self.assertEqual(replies, ["%i. message" % i for i in range(20)])
+            self.assertEqual(len(cs._pool), 3)
+
+            #requests fail once the server is gone
+            await self.stop()
+            await asyncio.sleep(0.1)
+            self.assertTrue(all(c.closed for c in cs._pool))
+            self.assertTrue((await cs.respond(message("hello"))).startswith("Error"))
+        asyncio.run(run())
+
+class TestMegaHALPool(unittest.TestCase):
+
+    def test_megahal_pool_dispatch(self):
+        async def run():
+            pool = chatbot.MegaHALPool(FAKE_MEGAHAL + ["0.2"], None, workers=3)
+            await pool.start()
+            start = time.perf_counter()
+            #learned messages reach every process, answers are spread across idle processes
+            await pool.communicate(b"first", learn=True)
+            await pool.communicate(b"second", learn=True)
+            await pool.communicate(b"#SAVE")
+            answers = await asyncio.gather(*(pool.communicate(b"count") for i in range(3)))
+            self.assertEqual(answers, [b"2"] * 3)
+            self.assertLess(time.perf_counter() - start, 0.9)
+            await pool.close()
+        asyncio.run(run())
+
+    def test_megahal_pool_restart(self):
+        async def run():
+            pool = chatbot.MegaHALPool(FAKE_MEGAHAL, None, workers=1, timeout=1)
+            await pool.start()
+            proc = pool.workers[0].proc
+            with self.assertRaises(RuntimeError):
+                await pool.communicate(b"sleep 5")
+            self.assertEqual(await pool.communicate(b"hello world"), b"world hello")
+            self.assertIsNot(pool.workers[0].proc, proc)
+
+            #processes that exited are restarted before they are used again
+            pool.workers[0].proc.kill()
+            await pool.workers[0].proc.wait()
+            self.assertEqual(await pool.communicate(b"hello again"), b"again hello")
+            await pool.close()
+        asyncio.run(run())